@@ -12,11 +12,87 @@ DEVICE_ID = os.getenv("DEVICE_ID", "boat-1")
 
 # Telemetry Configuration
 TELEMETRY_INTERVAL = float(os.getenv("TELEMETRY_INTERVAL", "1.0"))  # Send telemetry every 1 second
+# Send telemetry when a field moves past its deadband, with TELEMETRY_INTERVAL as the heartbeat
+# when nothing changes; false sends every TELEMETRY_INTERVAL regardless
+TELEMETRY_ON_CHANGE = os.getenv("TELEMETRY_ON_CHANGE", "true").lower() in ("1", "true", "yes")
+TELEMETRY_MAX_RATE = float(os.getenv("TELEMETRY_MAX_RATE", "10"))  # Most change-driven messages per second
+TELEMETRY_HEADING_DEADBAND = float(os.getenv("TELEMETRY_HEADING_DEADBAND", "2.0"))  # Degrees
+TELEMETRY_POSITION_DEADBAND = float(os.getenv("TELEMETRY_POSITION_DEADBAND", "2.0"))  # Metres
+TELEMETRY_CONTROL_DEADBAND = float(os.getenv("TELEMETRY_CONTROL_DEADBAND", "1.0"))  # Throttle / rudder units
+# Carry commands and telemetry over WebRTC data channels to viewers that have them open, instead of the websocket
+WEBRTC_DATA_CHANNELS = os.getenv("WEBRTC_DATA_CHANNELS", "true").lower() in ("1", "true", "yes")
 
 # Video Configuration
 VIDEO_WIDTH = int(os.getenv("VIDEO_WIDTH", "1280"))
 VIDEO_HEIGHT = int(os.getenv("VIDEO_HEIGHT", "720"))
 VIDEO_FPS = int(os.getenv("VIDEO_FPS", "30"))
+# Capture pixel format: auto (MJPEG for 720p and up, YUYV below), mjpeg, yuyv or bgr (OpenCV conversion)
+VIDEO_PIXEL_FORMAT = os.getenv("VIDEO_PIXEL_FORMAT", "auto")
+# Draw a telemetry HUD (heading, speed, throttle, rudder) under the timestamp banner
+VIDEO_HUD = os.getenv("VIDEO_HUD", "false").lower() in ("1", "true", "yes")
+
+# Worker processes that decode and convert captured frames on the spare cores
+# (0, the default, converts on the capture thread; "auto": one per core beyond the first, up to 3)
+_preprocess_workers = os.getenv("VIDEO_PREPROCESS_WORKERS", "0").lower()
+VIDEO_PREPROCESS_WORKERS = (min(3, (os.cpu_count() or 1) - 1) if _preprocess_workers == "auto"
+                            else int(_preprocess_workers))
+
+# Seconds a viewer waits for the webcam to open before the offer is answered with an error
+VIDEO_SETUP_TIMEOUT = float(os.getenv("VIDEO_SETUP_TIMEOUT", "15"))
+
+# Seconds the webcam stays open (warm standby) after the last viewer leaves; 0 releases it at once
+CAMERA_IDLE_TIMEOUT = float(os.getenv("CAMERA_IDLE_TIMEOUT", "30"))
+
+# Static scene handling: after VIDEO_STATIC_SECONDS with less than VIDEO_STATIC_THRESHOLD of the
+# image changing, live video drops to VIDEO_IDLE_FPS (0 disables the detector)
+VIDEO_IDLE_FPS = int(os.getenv("VIDEO_IDLE_FPS", "2"))
+VIDEO_STATIC_THRESHOLD = float(os.getenv("VIDEO_STATIC_THRESHOLD", "0.005"))
+VIDEO_STATIC_SECONDS = float(os.getenv("VIDEO_STATIC_SECONDS", "2.0"))
+
+# Adaptive streaming: step through the ladder (WIDTHxHEIGHT@FPS:KBPS, best first) as link quality changes
+VIDEO_ADAPTIVE = os.getenv("VIDEO_ADAPTIVE", "true").lower() in ("1", "true", "yes")
+VIDEO_LADDER = os.getenv("VIDEO_LADDER", "1280x720@30:1500,960x540@25:900,640x360@20:500,426x240@15:250")
+# Encode each codec/ladder rung once and relay the packets to every viewer on it
+VIDEO_RELAY = os.getenv("VIDEO_RELAY", "true").lower() in ("1", "true", "yes")
+# Viewer admission: at most VIDEO_MAX_VIEWERS concurrent viewers (0 for no limit); up to
+# VIDEO_VIEWER_QUEUE more wait up to VIDEO_QUEUE_TIMEOUT seconds for a free slot, the rest are rejected
+VIDEO_MAX_VIEWERS = int(os.getenv("VIDEO_MAX_VIEWERS", "3"))
+VIDEO_VIEWER_QUEUE = int(os.getenv("VIDEO_VIEWER_QUEUE", "2"))
+VIDEO_QUEUE_TIMEOUT = float(os.getenv("VIDEO_QUEUE_TIMEOUT", "30"))
+# Peers that fail, stay disconnected for VIDEO_PEER_DISCONNECT_GRACE seconds or do not connect within
+# VIDEO_PEER_CONNECT_TIMEOUT seconds are closed, releasing their encoders and camera subscriptions
+VIDEO_PEER_CONNECT_TIMEOUT = float(os.getenv("VIDEO_PEER_CONNECT_TIMEOUT", "30"))
+VIDEO_PEER_DISCONNECT_GRACE = float(os.getenv("VIDEO_PEER_DISCONNECT_GRACE", "10"))
+# Per-viewer budget: caps every ladder rung's bitrate (kbps) and frame rate (0 for the ladder's own values)
+VIDEO_PEER_MAX_KBPS = int(os.getenv("VIDEO_PEER_MAX_KBPS", "0"))
+VIDEO_PEER_MAX_FPS = int(os.getenv("VIDEO_PEER_MAX_FPS", "0"))
+# Keep the capture running, VIDEO_PREWARM_PEERS peer connections with ICE gathered and the first
+# relay encoder open, so a new viewer's first frame does not wait for them
+VIDEO_PREWARM = os.getenv("VIDEO_PREWARM", "false").lower() in ("1", "true", "yes")
+VIDEO_PREWARM_PEERS = int(os.getenv("VIDEO_PREWARM_PEERS", "1"))
+# ICE candidates on interfaces matching these names (e.g. container bridges) are never offered to viewers,
+# nor are link-local addresses unless VIDEO_ICE_LINK_LOCAL is set
+VIDEO_ICE_EXCLUDE_INTERFACES = [i.strip() for i in os.getenv("VIDEO_ICE_EXCLUDE_INTERFACES", "docker*,br-*,veth*,virbr*").split(",") if i.strip()]
+VIDEO_ICE_LINK_LOCAL = os.getenv("VIDEO_ICE_LINK_LOCAL", "false").lower() in ("1", "true", "yes")
+# Video codecs to negotiate, most preferred first (VP8 is the cheapest to encode on the Pi)
+VIDEO_CODEC_PREFERENCE = [c.strip().upper() for c in os.getenv("VIDEO_CODEC_PREFERENCE", "VP8,H264").split(",") if c.strip()]
+
+# JPEG quality of stills returned by the snapshot command
+SNAPSHOT_QUALITY = int(os.getenv("SNAPSHOT_QUALITY", "85"))
+
+# Onboard recording of the camera into fixed-length segments, independent of viewers
+RECORDING_ENABLED = os.getenv("RECORDING_ENABLED", "false").lower() in ("1", "true", "yes")
+RECORDING_DIR = os.path.expanduser(os.getenv("RECORDING_DIR", "~/piboat_recordings"))
+RECORDING_FORMAT = os.getenv("RECORDING_FORMAT", "mkv")  # mkv survives power loss better than mp4
+RECORDING_SEGMENT_SECONDS = int(os.getenv("RECORDING_SEGMENT_SECONDS", "300"))
+RECORDING_MAX_MB = int(os.getenv("RECORDING_MAX_MB", "4096"))
+RECORDING_MIN_FREE_MB = int(os.getenv("RECORDING_MIN_FREE_MB", "500"))
+RECORDING_CODEC = os.getenv("RECORDING_CODEC", "libx264")  # h264_v4l2m2m uses the Pi's hardware encoder
+RECORDING_BITRATE = int(os.getenv("RECORDING_BITRATE", "2000")) * 1000
+RECORDING_FPS = int(os.getenv("RECORDING_FPS", str(VIDEO_FPS)))
+
+# Webcam capability cache (probed once, reused until /dev/video* changes)
+WEBCAM_CACHE_FILE = os.getenv("WEBCAM_CACHE_FILE", os.path.expanduser("~/.cache/piboat/webcam_capabilities.json"))
 
 # You can customize these values using environment variables
 if os.environ.get("WS_SERVER_URL"):
@@ -1,14 +1,25 @@
+import asyncio
+import base64
 import json
 import logging
 import os
 from datetime import datetime
+from piboat.config import SNAPSHOT_QUALITY
 from piboat.device.motor_controller import MotorController
+from piboat.webrtc.camera import get_camera_source
+from piboat.webrtc.device_executor import subscribe_source, submit_blocking
 
 logger = logging.getLogger("CommandHandler")
 
 # Get the maximum rudder angle from environment variable (default to 45 degrees if not set)
 MAX_RUDDER_ANGLE = float(os.environ.get("MAX_RUDDER_ANGLE", 45.0))
 
+# Seconds to wait for a snapshot frame (opening an idle camera takes a few seconds)
+SNAPSHOT_TIMEOUT = 10.0
+
+# Frames discarded after opening an idle camera for a snapshot, while exposure settles
+SNAPSHOT_WARMUP_FRAMES = 5
+
 class CommandHandler:
     """
     Command handler that processes control commands and controls the boat hardware.
@@ -36,13 +47,26 @@ class CommandHandler:
         else:
             logger.warning("Command handler initialized but no motor controller provided")
     
-    async def handle_command(self, command):
+    def set_websocket(self, websocket):
+        """
+        Use a new WebSocket connection for responses, e.g. after reconnecting.
+        
+        Args:
+            websocket: WebSocket connection to send responses
+        """
+        self.websocket = websocket
+    
+    async def handle_command(self, command, send=None):
         """
         Handle command messages from clients.
         
         Args:
             command (dict): The command message
+            send: Coroutine function for the replies, e.g. to answer on the data
+                  channel the command arrived on (defaults to the websocket)
         """
+        send = send or self.websocket.send
+        
         # Log the command
         timestamp = datetime.now().isoformat()
         logged_command = {
@@ -64,7 +88,10 @@ class CommandHandler:
         status = "rejected"
         message = None
         
-        if not self.motor_controller_initialized:
+        if command_type == "snapshot":
+            # Snapshots only need the camera, not the motor controller
+            status, message = await self.send_snapshot(command, data, send)
+        elif not self.motor_controller_initialized:
             message = "Motor controller not initialized"
             logger.error(f"Cannot process command '{command_type}': {message}")
         else:
@@ -117,9 +144,63 @@ class CommandHandler:
                 message = f"Unknown command type: {command_type}"
         
         # Send acknowledgement
-        await self.acknowledge_command(command, status, message)
+        await self.acknowledge_command(command, status, message, send)
+    
+    async def send_snapshot(self, command, data, send=None):
+        """
+        Send a JPEG of the latest camera frame to the server.
+        
+        The frame comes from the shared capture, so a camera that is already
+        streaming is not opened again; an idle camera is opened just for the
+        snapshot and released afterwards.
+        
+        Args:
+            command: The original command
+            data: Command data, optionally with a JPEG "quality" (10-95)
+            send: Coroutine function to send the snapshot with (defaults to the websocket)
+            
+        Returns:
+            Tuple of (status, message) for the acknowledgement
+        """
+        try:
+            quality = max(10, min(int(data.get("quality", SNAPSHOT_QUALITY)), 95))
+        except (TypeError, ValueError):
+            return "rejected", "Invalid snapshot quality"
+        
+        source = get_camera_source()
+        was_open = source.is_open()
+        subscribed = False
+        try:
+            # Opening the camera blocks, so it runs on the video device thread
+            await subscribe_source(source)
+            subscribed = True
+            
+            if not was_open:
+                seq = 0
+                for _ in range(SNAPSHOT_WARMUP_FRAMES):
+                    seq, _ = await asyncio.wait_for(source.get_frame(seq), SNAPSHOT_TIMEOUT)
+            frame, jpeg = await asyncio.wait_for(source.get_snapshot(quality), SNAPSHOT_TIMEOUT)
+        except Exception as e:
+            logger.error(f"Failed to capture snapshot: {str(e)}")
+            return "rejected", f"Failed to capture snapshot: {str(e)}"
+        finally:
+            if subscribed:
+                submit_blocking(source.unsubscribe)
+        
+        snapshot = {
+            "type": "snapshot",
+            "command_id": command.get("command_id", "unknown"),
+            "timestamp": datetime.now().isoformat(),
+            "format": "jpeg",
+            "width": frame.width,
+            "height": frame.height,
+            "data": base64.b64encode(jpeg).decode("ascii")
+        }
+        await (send or self.websocket.send)(json.dumps(snapshot))
+        logger.info(f"Sent {frame.width}x{frame.height} snapshot ({len(jpeg) // 1024} KB)")
+        return "accepted", None
     
-    async def acknowledge_command(self, command, status, message=None):
+    async def acknowledge_command(self, command, status, message=None, send=None):
         """
         Send command acknowledgement back to the server.
         
@@ -127,6 +208,7 @@ class CommandHandler:
             command: The original command
             status: Status of the command (accepted, rejected, etc.)
             message: Optional message to include
+            send: Coroutine function to send the acknowledgement with (defaults to the websocket)
         """
         command_id = command.get("command_id", "unknown")
         
@@ -139,7 +221,7 @@ class CommandHandler:
         if message:
             ack["message"] = message
             
-        await self.websocket.send(json.dumps(ack))
+        await (send or self.websocket.send)(json.dumps(ack))
         logger.debug(f"Sent command acknowledgement: {status}")
     
     def cleanup(self):
@@ -4,9 +4,20 @@ import logging
 import time
 import websockets
 
-from piboat.config import TELEMETRY_INTERVAL
+from piboat.config import (
+    TELEMETRY_INTERVAL, TELEMETRY_ON_CHANGE, TELEMETRY_MAX_RATE, TELEMETRY_HEADING_DEADBAND,
+    TELEMETRY_POSITION_DEADBAND, TELEMETRY_CONTROL_DEADBAND, RECORDING_ENABLED, VIDEO_PREWARM
+)
 from piboat.device.telemetry import TelemetryGenerator
+from piboat.device.telemetry_scheduler import TelemetryScheduler
 from piboat.device.commands import CommandHandler
+from piboat.device.dispatcher import (
+    MessageDispatcher, Lane, classify_message, command_key, LANE_SIZES, LANE_OVERFLOW, SUPERSEDED,
+    CONTROL_LANE, PING_LANE, WEBRTC_LANE, COMMAND_LANE
+)
+from piboat.webrtc.overlay import set_telemetry_provider
+from piboat.webrtc.recorder import VideoRecorder
+from piboat.webrtc.warmup import get_warm_pool
 from piboat.webrtc.webrtc_handler import WebRTCHandler
 
 logger = logging.getLogger("BoatDevice")
@@ -21,12 +32,35 @@ class BoatDevice:
         self.server_url = server_url.format(device_id=device_id)
         self.websocket = None
         self.running = False
+        
+        # Created on the first connection and kept across reconnects, so viewers'
+        # peer connections and data channels survive a lost websocket
+        self.command_handler = None
+        self.webrtc_handler = None
         self.reconnect_interval = 5  # Initial reconnect interval in seconds
         self.max_reconnect_interval = 60  # Maximum reconnect interval
         
         # Initialize telemetry generator with real GPS data
         self.telemetry = TelemetryGenerator(gps_port=gps_port)
         
+        # Feed the video telemetry HUD from the same status the dashboard sees
+        set_telemetry_provider(self.telemetry.get_current_status)
+        
+        # Send telemetry when something changes rather than only on a fixed interval
+        self.telemetry_scheduler = TelemetryScheduler(
+            heartbeat=TELEMETRY_INTERVAL,
+            on_change=TELEMETRY_ON_CHANGE,
+            max_rate=TELEMETRY_MAX_RATE,
+            heading_deadband=TELEMETRY_HEADING_DEADBAND,
+            position_deadband=TELEMETRY_POSITION_DEADBAND,
+            control_deadband=TELEMETRY_CONTROL_DEADBAND
+        )
+        self._fix_loop = None
+        self._fix_event = None
+        self._telemetry_task = None
+        if TELEMETRY_ON_CHANGE:
+            self.telemetry.set_fix_callback(self._on_gps_fix)
+        
         # Initialize motor controller once
         from piboat.device.motor_controller import MotorController
         self.motor_controller = MotorController()
@@ -41,6 +75,24 @@ class BoatDevice:
         else:
             logger.warning("Failed to initialize motor controller")
         
+        # Record the camera onboard for the whole mission, whether or not anyone is watching
+        self.recorder = VideoRecorder() if RECORDING_ENABLED else None
+        
+        # Keep the camera, a peer connection and an encoder ready for the next viewer
+        self.warm_pool = get_warm_pool() if VIDEO_PREWARM else None
+        self._warm_pool_task = None
+        
+        # Handle incoming messages in prioritized lanes so steering never waits behind video negotiation
+        self.dispatcher = MessageDispatcher([
+            Lane(CONTROL_LANE, self._handle_command, LANE_SIZES[CONTROL_LANE], LANE_OVERFLOW[CONTROL_LANE], command_key),
+            Lane(PING_LANE, self._handle_ping, LANE_SIZES[PING_LANE], LANE_OVERFLOW[PING_LANE]),
+            Lane(WEBRTC_LANE, self._handle_webrtc, LANE_SIZES[WEBRTC_LANE], LANE_OVERFLOW[WEBRTC_LANE]),
+            Lane(COMMAND_LANE, self._handle_command, LANE_SIZES[COMMAND_LANE], LANE_OVERFLOW[COMMAND_LANE])
+        ], on_discard=self._on_message_discarded)
+        # Acknowledgements of queued commands that were discarded, sent in the background
+        self._discard_tasks = set()
+        self.telemetry.set_message_stats_provider(self.dispatcher.get_stats)
+        
         logger.info(f"Initialized boat device {device_id}")
     
     async def connect(self):
@@ -51,10 +103,18 @@ class BoatDevice:
             self.websocket = await websockets.connect(self.server_url)
             logger.info("Connected to WebSocket server")
             
-            # Once connected, initialize the command and WebRTC handlers
-            # Pass the existing motor controller to CommandHandler
-            self.command_handler = CommandHandler(self.telemetry, self.websocket, self.motor_controller)
-            self.webrtc_handler = WebRTCHandler(self.device_id, self.websocket)
+            if self.webrtc_handler is None:
+                # Once connected, initialize the command and WebRTC handlers
+                # Pass the existing motor controller to CommandHandler
+                self.command_handler = CommandHandler(self.telemetry, self.websocket, self.motor_controller)
+                self.webrtc_handler = WebRTCHandler(self.device_id, self.websocket)
+                self.telemetry.set_viewer_stats_provider(self.webrtc_handler.get_viewer_stats)
+                self.telemetry.set_video_stats_provider(self.webrtc_handler.get_video_stats)
+                self.webrtc_handler.set_command_handler(self.dispatch_message)
+            else:
+                # Reconnected: keep the existing handlers and their peers, only swap the websocket
+                self.command_handler.set_websocket(self.websocket)
+                self.webrtc_handler.set_websocket(self.websocket)
             
             self.running = True
             return True
@@ -64,6 +124,19 @@ class BoatDevice:
     
     async def run(self):
         """Main execution loop."""
+        # The lanes run for the whole process, so commands arriving on viewers' data channels
+        # are still handled while the server connection is down
+        self.dispatcher.start()
+        # Telemetry is sampled for the whole process too, and reaches viewers' data channels
+        # while the server connection is down
+        self.running = True
+        self._telemetry_task = asyncio.create_task(self.telemetry_loop())
+        if self.recorder is not None:
+            self.recorder.start()
+        if self.warm_pool is not None:
+            # Warm up in the background; connecting to the server does not wait for the camera
+            self._warm_pool_task = asyncio.create_task(self.warm_pool.start())
+        
         # Keep attempting to run until explicitly stopped
         while True:
             if not await self.connect():
@@ -83,7 +156,6 @@ class BoatDevice:
             reconnect_event = asyncio.Event()
             
             # Start tasks with access to the reconnection event
-            telemetry_task = asyncio.create_task(self.telemetry_loop(reconnect_event))
             message_task = asyncio.create_task(self.message_handler(reconnect_event))
             reconnect_wait_task = asyncio.create_task(reconnect_event.wait())
             
@@ -92,7 +164,7 @@ class BoatDevice:
                 
                 # Wait for either task to complete or reconnect_event to be set
                 done, pending = await asyncio.wait(
-                    [telemetry_task, message_task, reconnect_wait_task],
+                    [message_task, reconnect_wait_task],
                     return_when=asyncio.FIRST_COMPLETED
                 )
                 
@@ -100,12 +172,7 @@ class BoatDevice:
                 if reconnect_wait_task in done:
                     logger.info("Reconnection event triggered, will reconnect")
                 else:
-                    # Log which task completed
-                    for task in done:
-                        if task is telemetry_task:
-                            logger.info("Telemetry task completed")
-                        elif task is message_task:
-                            logger.info("Message handler task completed")
+                    logger.info("Message handler task completed")
                 
                 # Cancel remaining tasks
                 for task in pending:
@@ -155,11 +222,23 @@ class BoatDevice:
         # We don't shut down telemetry or WebRTC handlers completely
         # as they will be reused on reconnection
     
-    async def telemetry_loop(self, reconnect_event=None):
-        """Periodically send telemetry data to the server."""
+    async def telemetry_loop(self):
+        """
+        Sample telemetry and send it whenever the scheduler says it changed
+        enough, at least every heartbeat. Runs for the life of the process:
+        every sample goes to the server while connected and to the viewers'
+        telemetry data channels as well. A new GPS fix wakes the loop at once
+        instead of waiting for the next sample.
+        """
         logger.info("Starting telemetry loop")
         
         last_gps_status = None
+        last_websocket = None
+        scheduler = self.telemetry_scheduler
+        
+        # The GPS reader thread signals new fixes through this loop
+        self._fix_loop = asyncio.get_running_loop()
+        self._fix_event = asyncio.Event()
         
         while self.running:
             try:
@@ -179,41 +258,75 @@ class BoatDevice:
                             logger.info(f"GPS is acquiring fix. Satellites: {gps_info.get('satellites')}")
                         elif current_gps_status == 'fix_acquired':
                             logger.info(f"GPS fix acquired! Position: {telemetry['position']['latitude']}, {telemetry['position']['longitude']}")
-                    
-                    # Log detailed GPS info periodically (every 10 sequences)
-                    if telemetry['sequence'] % 10 == 0:
-                        logger.info(f"GPS Status: {current_gps_status}, Fix: {gps_info.get('has_fix')}, Satellites: {gps_info.get('satellites')}")
                 
                 last_gps_status = current_gps_status
                 
-                # Generate telemetry in server format and send it if websocket is connected
-                if self.websocket is not None:
+                # Send the first sample on a new connection straight away
+                websocket = self.websocket
+                if websocket is not None and websocket is not last_websocket:
+                    scheduler.reset()
+                last_websocket = websocket
+                
+                channels = self.webrtc_handler is not None and self.webrtc_handler.has_telemetry_channels()
+                now = time.monotonic()
+                reason = scheduler.check(telemetry, now)
+                
+                # Generate telemetry in server format and send it to everyone listening
+                if reason is not None and (websocket is not None or channels):
                     try:
-                        server_telemetry = self.telemetry.generate_server_telemetry_data()
-                        await self.websocket.send(json.dumps(server_telemetry))
-                        logger.debug(f"Sent telemetry data: sequence={server_telemetry['sequence']}, type={server_telemetry['type']}")
+                        # Send the sample that was checked, rather than taking (and smoothing) another;
+                        # the viewer, video and message statistics only ride on heartbeats
+                        server_telemetry = self.telemetry.generate_server_telemetry_data(
+                            telemetry=telemetry, include_stats=(reason == "heartbeat"))
+                        payload = json.dumps(server_telemetry)
+                        
+                        if channels:
+                            self.webrtc_handler.send_telemetry(payload)
+                            logger.debug(f"Sent telemetry data over data channels: sequence={server_telemetry['sequence']}, reason={reason}")
+                        if websocket is not None:
+                            await websocket.send(payload)
+                            logger.debug(f"Sent telemetry data: sequence={server_telemetry['sequence']}, type={server_telemetry['type']}, reason={reason}")
+                        scheduler.mark_sent(telemetry, now)
+                        
+                        # Log detailed GPS info periodically (every 10 sequences)
+                        if current_gps_status is not None and server_telemetry['sequence'] % 10 == 0:
+                            gps_info = telemetry['status']['gps']
+                            logger.info(f"GPS Status: {current_gps_status}, Fix: {gps_info.get('has_fix')}, Satellites: {gps_info.get('satellites')}")
                     except websockets.exceptions.ConnectionClosed:
+                        # The message handler notices the closed connection and reconnects
                         logger.warning("Connection closed while sending telemetry")
-                        if reconnect_event:
-                            reconnect_event.set()
-                        return  # Exit the function to trigger reconnection
                     except Exception as e:
                         logger.warning(f"Failed to send telemetry: {str(e)}")
                         # Continue running even if we can't send data
-                else:
-                    logger.debug("WebSocket not available, skipping telemetry send")
+                elif websocket is None and not channels:
+                    logger.debug("No WebSocket or telemetry channel available, skipping telemetry send")
                 
-                # Wait for next telemetry interval
-                await asyncio.sleep(TELEMETRY_INTERVAL)
+                # Wait for the next sample, or a new GPS fix
+                try:
+                    await asyncio.wait_for(self._fix_event.wait(), scheduler.sample_interval)
+                except asyncio.TimeoutError:
+                    pass
+                self._fix_event.clear()
                 
+            except asyncio.CancelledError:
+                raise
             except Exception as e:
                 logger.error(f"Error in telemetry loop: {str(e)}")
                 if not self.running:
                     break
                 await asyncio.sleep(1)  # Wait before retrying
     
+    def _on_gps_fix(self):
+        """Wake the telemetry loop for a new GPS fix. Called from the GPS reader thread."""
+        if self._fix_loop is None:
+            return
+        try:
+            self._fix_loop.call_soon_threadsafe(self._fix_event.set)
+        except RuntimeError:
+            pass  # The event loop has closed
+    
     async def message_handler(self, reconnect_event=None):
-        """Handle incoming messages from the server."""
+        """Receive messages from the server and queue them in the dispatcher's lanes."""
         logger.info("Starting message handler")
         
         while self.running:
@@ -221,24 +334,7 @@ class BoatDevice:
                 # Receive message
                 message = await self.websocket.recv()
                 data = json.loads(message)
-                
-                # Handle different message types
-                message_type = data.get("type")
-                
-                if message_type == "webrtc":
-                    await self.webrtc_handler.handle_message(data)
-                elif message_type == "command":
-                    await self.command_handler.handle_command(data)
-                elif message_type == "ping":
-                    # Respond to ping messages with a pong
-                    pong = {
-                        "type": "pong",
-                        "timestamp": int(time.time() * 1000)
-                    }
-                    await self.websocket.send(json.dumps(pong))
-                    logger.debug("Responded to ping with pong")
-                else:
-                    logger.warning(f"Unknown message type: {message_type}")
+                await self.dispatch_message(data)
                 
             except websockets.exceptions.ConnectionClosed:
                 logger.warning("Connection closed by server, will attempt to reconnect")
@@ -249,11 +345,92 @@ class BoatDevice:
                 logger.error(f"Error in message handler: {str(e)}")
                 await asyncio.sleep(1)
     
+    async def dispatch_message(self, data, send=None):
+        """
+        Queue a message from the server or a data channel in its lane. Returns at once.
+        A command its lane has no room for is rejected with an error acknowledgement,
+        and a signaling message with an error to the client it came from.
+        
+        Args:
+            data (dict): The parsed message
+            send: Coroutine function replying where the message came from (None for the websocket)
+        """
+        message_type = data.get("type")
+        lane = classify_message(data)
+        if lane is None:
+            logger.warning(f"Unknown message type: {message_type}")
+            return
+        
+        if self.dispatcher.dispatch(lane, data, send):
+            return
+        
+        try:
+            if message_type == "command":
+                await self.command_handler.acknowledge_command(data, "rejected", "Too many pending commands, try again", send)
+            elif message_type == "webrtc":
+                await self.webrtc_handler.reject_message(data, "Too many pending signaling messages, try again")
+        except Exception as e:
+            logger.warning(f"Error rejecting {message_type} message: {str(e)}")
+    
+    def _on_message_discarded(self, lane, reason, data, send=None):
+        """
+        Acknowledge a queued command the dispatcher discarded: "superseded" when a
+        newer command of the same kind replaced it, "rejected" when it was dropped.
+        """
+        if data.get("type") != "command" or self.command_handler is None:
+            return
+        
+        if reason == SUPERSEDED:
+            ack = self.command_handler.acknowledge_command(data, "superseded", "Replaced by a newer command", send)
+        else:
+            ack = self.command_handler.acknowledge_command(data, "rejected", "Dropped from a full queue", send)
+        task = asyncio.create_task(self._send_discard_ack(ack))
+        self._discard_tasks.add(task)
+        task.add_done_callback(self._discard_tasks.discard)
+    
+    async def _send_discard_ack(self, ack):
+        """Send an acknowledgement for a discarded command."""
+        try:
+            await ack
+        except Exception as e:
+            logger.warning(f"Error acknowledging discarded command: {str(e)}")
+    
+    async def _handle_command(self, data, send=None):
+        """Handle a command in the control or command lane."""
+        await self.command_handler.handle_command(data, send)
+    
+    async def _handle_webrtc(self, data, send=None):
+        """Handle a WebRTC signaling message in the webrtc lane."""
+        await self.webrtc_handler.handle_message(data)
+    
+    async def _handle_ping(self, data, send=None):
+        """Respond to a ping with a pong."""
+        pong = {
+            "type": "pong",
+            "timestamp": int(time.time() * 1000)
+        }
+        await self.websocket.send(json.dumps(pong))
+        logger.debug("Responded to ping with pong")
+    
     async def shutdown(self):
         """Shutdown the boat device and clean up resources."""
         logger.info("Shutting down boat device...")
         self.running = False
         
+        # Stop handling queued messages, so no command can move the motors after they are stopped
+        try:
+            await self.dispatcher.stop()
+        except Exception as e:
+            logger.error(f"Error stopping message dispatcher: {str(e)}")
+        
+        # Stop sampling telemetry
+        if self._telemetry_task is not None:
+            self._telemetry_task.cancel()
+            try:
+                await self._telemetry_task
+            except asyncio.CancelledError:
+                pass
+        
         # First, immediately stop the motors before any other shutdown steps
         # This ensures motors stop even if other shutdown steps fail
         if hasattr(self, 'command_handler') and hasattr(self.command_handler, 'motor_controller'):
@@ -266,7 +443,7 @@ class BoatDevice:
         # Try to shutdown other components with error handling
         try:
             # Shutdown video streaming
-            if hasattr(self, 'webrtc_handler'):
+            if self.webrtc_handler is not None:
                 if hasattr(self.webrtc_handler, 'shutdown'):
                     try:
                         await self.webrtc_handler.shutdown()
@@ -275,6 +452,23 @@ class BoatDevice:
                 else:
                     logger.warning("WebRTC handler has no shutdown method")
             
+            # Release the pre-warmed camera, peer connections and encoder
+            if self.warm_pool is not None:
+                try:
+                    # Let a warm-up still opening the camera finish, so stop() releases what it opened
+                    if self._warm_pool_task is not None:
+                        await self._warm_pool_task
+                    await self.warm_pool.stop()
+                except Exception as e:
+                    logger.error(f"Error stopping the warm pool: {str(e)}")
+            
+            # Finish the current recording segment
+            if self.recorder is not None:
+                try:
+                    self.recorder.stop()
+                except Exception as e:
+                    logger.error(f"Error stopping video recorder: {str(e)}")
+            
             # Cleanup telemetry resources
             try:
                 self.telemetry.shutdown()
@@ -0,0 +1,227 @@
+import asyncio
+import logging
+import time
+from collections import deque, namedtuple
+
+logger = logging.getLogger("MessageDispatcher")
+
+# Commands that move the boat; they get the highest priority lane
+CONTROL_COMMANDS = ("set_rudder", "set_throttle", "stop")
+
+# Lanes from highest to lowest priority, with the number of messages each may queue
+CONTROL_LANE = "control"
+PING_LANE = "ping"
+WEBRTC_LANE = "webrtc"
+COMMAND_LANE = "command"
+LANE_SIZES = {
+    CONTROL_LANE: 32,
+    PING_LANE: 4,
+    WEBRTC_LANE: 64,
+    COMMAND_LANE: 8,
+}
+
+# How a lane makes room for a new message. Queued messages that are dropped or
+# superseded are passed to the dispatcher's on_discard callback
+DROP_OLDEST = "drop_oldest"  # when full, drop the oldest queued message in favour of the new one
+REJECT = "reject"            # when full, refuse the new message; the sender is told
+COALESCE = "coalesce"        # the new message replaces any queued one with the same key; refused if still full
+LANE_OVERFLOW = {
+    CONTROL_LANE: COALESCE,
+    PING_LANE: DROP_OLDEST,
+    # Signaling is never dropped unseen: an offer or ICE candidate that does not fit is refused
+    WEBRTC_LANE: REJECT,
+    COMMAND_LANE: REJECT,
+}
+
+# Why a queued message was discarded, as passed to on_discard
+DROPPED = "dropped"
+SUPERSEDED = "superseded"
+
+Lane = namedtuple("Lane", ["name", "handler", "maxsize", "overflow", "key"], defaults=(DROP_OLDEST, None))
+
+
+def command_key(message, *args):
+    """Coalescing key of a command message: only the latest of each command matters."""
+    return message.get("command")
+
+
+def classify_message(message):
+    """
+    Get the lane a message from the server or a data channel belongs in.
+
+    Control commands (rudder, throttle, stop) get their own lane; slower
+    commands such as snapshots go in the lowest one, so a camera open
+    never holds up steering.
+
+    Returns:
+        Lane name, or None for unknown message types
+    """
+    message_type = message.get("type")
+    if message_type == "command":
+        return CONTROL_LANE if message.get("command") in CONTROL_COMMANDS else COMMAND_LANE
+    if message_type == "ping":
+        return PING_LANE
+    if message_type == "webrtc":
+        return WEBRTC_LANE
+    return None
+
+
+class _LaneQueue:
+    """A lane's bounded queue, its worker task and its counters."""
+    def __init__(self, lane):
+        self.lane = lane
+        self.items = deque()
+        # Set when the worker may be able to take a message: one was queued,
+        # or a higher priority lane ran out of waiting messages
+        self.wakeup = asyncio.Event()
+        self.task = None
+        self.busy = False
+        self.processed = 0
+        self.dropped = 0
+        self.rejected = 0
+        self.coalesced = 0
+        self.max_depth = 0
+        self.max_wait = 0.0
+
+
+class MessageDispatcher:
+    """
+    Runs incoming messages through typed lanes instead of handling them one
+    by one as they are received.
+
+    Each lane has its own worker, so a slow WebRTC negotiation or a slow send
+    never delays the next rudder or stop command, while messages within a lane
+    are still handled in arrival order. A lane does not start a message while
+    a higher priority lane has one waiting; its worker sleeps until woken.
+    Lanes are bounded, and each has an overflow policy: drop the oldest
+    message, reject the new one, or coalesce it with a queued message of the
+    same kind. Coalescing a newer message moves it to the back of the lane,
+    so the effect of the remaining sequence is the same as the original one.
+    Every queued message that is dropped or coalesced away is reported to
+    on_discard, so its sender can be told.
+    """
+    def __init__(self, lanes, on_discard=None):
+        """
+        Args:
+            lanes: List of Lane, highest priority first. Each handler is a
+                   coroutine function called with the dispatched arguments;
+                   a COALESCE lane's key function is called with them too.
+            on_discard: Function called as on_discard(lane_name, reason, *args)
+                        for each queued message that is DROPPED or SUPERSEDED
+        """
+        self._lanes = [_LaneQueue(lane) for lane in lanes]
+        self._by_name = {lane.lane.name: lane for lane in self._lanes}
+        self._on_discard = on_discard
+
+    def start(self):
+        """Start the lane workers."""
+        for index, lane in enumerate(self._lanes):
+            if lane.task is None or lane.task.done():
+                lane.task = asyncio.create_task(self._worker(lane, self._lanes[:index]))
+
+    async def stop(self):
+        """Stop the lane workers and drop the messages still queued."""
+        for lane in self._lanes:
+            if lane.task is not None:
+                lane.task.cancel()
+                try:
+                    await lane.task
+                except asyncio.CancelledError:
+                    pass
+                lane.task = None
+            lane.items.clear()
+            lane.busy = False
+
+    def dispatch(self, lane_name, *args):
+        """
+        Queue a message for a lane. Never blocks.
+
+        Args:
+            lane_name: Lane to queue in
+            *args: Arguments for the lane's handler
+
+        Returns:
+            True if queued, False if there is no such lane or the lane refused the message
+        """
+        lane = self._by_name.get(lane_name)
+        if lane is None:
+            return False
+
+        policy = lane.lane.overflow
+        if policy == COALESCE:
+            key = lane.lane.key(*args)
+            kept = deque()
+            for item in lane.items:
+                if lane.lane.key(*item[1]) != key:
+                    kept.append(item)
+                else:
+                    lane.coalesced += 1
+                    self._discard(lane_name, SUPERSEDED, item[1])
+            lane.items = kept
+
+        if len(lane.items) >= lane.lane.maxsize:
+            if policy == DROP_OLDEST:
+                _, dropped_args = lane.items.popleft()
+                lane.dropped += 1
+                logger.warning(f"Lane '{lane_name}' is full, dropped its oldest message")
+                self._discard(lane_name, DROPPED, dropped_args)
+            else:
+                lane.rejected += 1
+                logger.warning(f"Lane '{lane_name}' is full, rejected a new message")
+                return False
+
+        lane.items.append((time.monotonic(), args))
+        lane.max_depth = max(lane.max_depth, len(lane.items))
+        lane.wakeup.set()
+        return True
+
+    def _discard(self, lane_name, reason, args):
+        """Report a queued message that will not be handled."""
+        if self._on_discard is None:
+            return
+        try:
+            self._on_discard(lane_name, reason, *args)
+        except Exception as e:
+            logger.error(f"Error reporting a {reason} '{lane_name}' message: {str(e)}")
+
+    async def _worker(self, lane, higher):
+        """Handle one lane's messages in order, giving way to higher priority lanes."""
+        lower = self._lanes[len(higher) + 1:]
+        while True:
+            # Sleep until this lane has a message and no higher priority lane has one waiting
+            while not lane.items or any(h.items for h in higher):
+                lane.wakeup.clear()
+                await lane.wakeup.wait()
+
+            queued_at, args = lane.items.popleft()
+            if not lane.items:
+                # Lower priority lanes may have been giving way to this one
+                for other in lower:
+                    other.wakeup.set()
+
+            lane.max_wait = max(lane.max_wait, time.monotonic() - queued_at)
+            lane.busy = True
+            try:
+                await lane.lane.handler(*args)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error handling '{lane.lane.name}' message: {str(e)}")
+            finally:
+                lane.busy = False
+                lane.processed += 1
+
+    def get_stats(self):
+        """Get each lane's queue depth and counters."""
+        return {
+            lane.lane.name: {
+                'depth': len(lane.items) + (1 if lane.busy else 0),
+                'max_depth': lane.max_depth,
+                'processed': lane.processed,
+                'dropped': lane.dropped,
+                'rejected': lane.rejected,
+                'coalesced': lane.coalesced,
+                'max_wait_ms': round(lane.max_wait * 1000)
+            }
+            for lane in self._lanes
+        }
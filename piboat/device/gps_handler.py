@@ -31,6 +31,10 @@ class GPSHandler:
         self.satellites = None
         self.timestamp = None
         self.fix_quality = None
+        # Counts the fixes received (one per GGA sentence with a fix), so consumers can spot a new epoch
+        self.fix_epoch = 0
+        # Called from the reader thread after each new fix
+        self.fix_callback = None
         
         # Lock for thread safety when accessing GPS data
         self.lock = threading.Lock()
@@ -93,7 +97,8 @@ class GPSHandler:
                 # Try to parse the NMEA sentence
                 try:
                     msg = pynmea2.parse(line)
-                    self._process_nmea_message(msg)
+                    if self._process_nmea_message(msg) and self.fix_callback is not None:
+                        self.fix_callback()
                 except pynmea2.ParseError:
                     # Skip invalid sentences
                     continue
@@ -103,7 +108,11 @@ class GPSHandler:
                 time.sleep(1)
     
     def _process_nmea_message(self, msg):
-        """Process different types of NMEA messages."""
+        """
+        Process different types of NMEA messages.
+        Returns True if the message carried a new fix.
+        """
+        new_fix = False
         with self.lock:
             try:
                 if hasattr(msg, 'timestamp'):
@@ -124,6 +133,9 @@ class GPSHandler:
                         self.satellites = msg.num_sats
                     if hasattr(msg, 'gps_qual'):
                         self.fix_quality = msg.gps_qual
+                        if self.fix_quality is not None and int(self.fix_quality) > 0:
+                            self.fix_epoch += 1
+                            new_fix = True
                 
                 # RMC message - Recommended minimum navigation information
                 elif isinstance(msg, pynmea2.RMC):
@@ -148,6 +160,7 @@ class GPSHandler:
                 
             except Exception as e:
                 logger.error(f"Error processing NMEA message: {str(e)}")
+        return new_fix
     
     def _convert_decimal(self, value):
         """Convert Decimal to float if needed."""
@@ -171,9 +184,20 @@ class GPSHandler:
                 'timestamp': self.timestamp,
                 'fix_quality': self.fix_quality,
                 'has_fix': self.fix_quality is not None and int(self.fix_quality) > 0,
+                'fix_epoch': self.fix_epoch,
                 'running': self.running
             }
 
+    def set_fix_callback(self, callback):
+        """
+        Set a function to call whenever a new fix arrives.
+        
+        Args:
+            callback: Callable taking no arguments, called from the GPS reader thread,
+                      or None to stop the calls
+        """
+        self.fix_callback = callback
+
     def has_fix(self):
         """
         Check if the GPS has a fix.
@@ -8,6 +8,17 @@ from piboat.device.compass_handler import CompassHandler
 
 logger = logging.getLogger("Telemetry")
 
+# Time constants in seconds of the heading and speed smoothing. With samples a second
+# apart each moves 30% of the way to the new reading, whatever rate telemetry is sampled at
+HEADING_SMOOTHING_TAU = -1 / math.log(0.7)
+SPEED_SMOOTHING_TAU = -1 / math.log(0.7)
+
+
+def _smoothing_factor(dt, tau):
+    """Get the exponential smoothing factor for a sample dt seconds after the previous one."""
+    return 1 - math.exp(-max(dt, 0) / tau)
+
+
 class TelemetryGenerator:
     """
     Generates telemetry data for the boat using real GPS data.
@@ -19,7 +30,11 @@ class TelemetryGenerator:
         self.heading = None
         self.speed = 0
         self.battery = 100  # Battery percentage
+        self.last_battery_update = time.time()
         self.last_position_update = 0  # Timestamp of last position update
+        # Monotonic times of the last smoothed heading and speed updates
+        self.last_heading_update = None
+        self.last_speed_update = time.monotonic()
         
         # Store previous position for calculating speed and heading
         self.prev_latitude = None
@@ -32,6 +47,13 @@ class TelemetryGenerator:
         # Store reference to motor controller
         self.motor_controller = motor_controller
         
+        # Callable returning video viewer admission counters, set once WebRTC is up
+        self.viewer_stats_provider = None
+        # Callable returning the per-peer video stream health summary
+        self.video_stats_provider = None
+        # Callable returning the queue depth and counters of each incoming message lane
+        self.message_stats_provider = None
+        
         # Initialize GPS - always required
         self.gps = self._init_gps(gps_port)
         
@@ -123,17 +145,20 @@ class TelemetryGenerator:
         Keeps the last known position if no new GPS data is available.
         Uses ONLY GPS data for speed.
         Uses ONLY compass for heading, never GPS.
+        Heading and speed are smoothed by the time since their last update, not
+        per call, so the smoothing does not change with the sampling rate.
         """
         # Update compass heading if available
         if self.compass and self.compass.connected:
             compass_heading = self.compass.get_heading()
+            now = time.monotonic()
             
             if self.heading is None:
                 self.heading = compass_heading
                 logger.debug(f"Initial compass heading: {self.heading:.1f}°")
             else:
                 # Apply smoothing to compass heading
-                alpha = 0.3  # Smoothing factor (0-1)
+                alpha = _smoothing_factor(now - self.last_heading_update, HEADING_SMOOTHING_TAU)
                 
                 # Special handling for crossing 0/360 boundary
                 if abs(compass_heading - self.heading) > 180:
@@ -146,6 +171,7 @@ class TelemetryGenerator:
                 self.heading = self.heading % 360
                 
                 logger.debug(f"Updated compass heading: {self.heading:.1f}°")
+            self.last_heading_update = now
         
         # Update GPS position and speed
         if self.gps:
@@ -162,8 +188,10 @@ class TelemetryGenerator:
                 # Use GPS speed_knots value directly
                 if gps_data['speed_knots'] is not None:
                     # Apply some smoothing to avoid jumps
-                    alpha = 0.3  # Smoothing factor (0-1)
+                    now = time.monotonic()
+                    alpha = _smoothing_factor(now - self.last_speed_update, SPEED_SMOOTHING_TAU)
                     self.speed = (alpha * gps_data['speed_knots']) + ((1 - alpha) * self.speed)
+                    self.last_speed_update = now
                     logger.debug(f"Updated speed from GPS: {self.speed:.2f} knots")
                 
                 logger.debug(f"Updated GPS position: {self.latitude:.6f}, {self.longitude:.6f}")
@@ -173,7 +201,10 @@ class TelemetryGenerator:
             logger.warning("GPS handler not initialized, position data unavailable")
         
         # Battery drain - keep this as real battery monitoring will be added later
-        self.battery -= 0.01  # Very slow drain 
+        # Drain by time rather than per update, as updates come faster when telemetry is change-driven
+        now = time.time()
+        self.battery -= 0.01 * (now - self.last_battery_update)  # Very slow drain 
+        self.last_battery_update = now
         self.battery = max(0, self.battery)  # Don't go below 0
     
     def _convert_decimal_values(self, data):
@@ -224,6 +255,7 @@ class TelemetryGenerator:
                 'speed_knots': gps_data['speed_knots'],
                 'course': gps_data['course'],
                 'gps_timestamp': gps_data['timestamp'],
+                'fix_epoch': gps_data['fix_epoch'],
                 'running': gps_data['running'],
                 'status': 'fix_acquired' if gps_data['has_fix'] else ('acquiring' if acquiring_fix else 'inactive')
             }
@@ -272,7 +304,7 @@ class TelemetryGenerator:
         self.telemetry_sequence += 1
         return self.telemetry_sequence
     
-    def generate_server_telemetry_data(self, increment_sequence=True):
+    def generate_server_telemetry_data(self, increment_sequence=True, telemetry=None, include_stats=True):
         """
         Generate telemetry data in the format expected by the server.
         This restructures the data from generate_telemetry_data() to match
@@ -281,10 +313,15 @@ class TelemetryGenerator:
         Parameters:
             increment_sequence (bool): Whether to increment the sequence number.
                                       Defaults to True for backward compatibility.
+            telemetry (dict): Sample from generate_telemetry_data() to send, e.g. the one
+                              the telemetry scheduler checked. A new sample is taken if None.
+            include_stats (bool): Whether to add the viewer, video and message lane statistics.
+                                  They change slowly, so only heartbeats need to carry them.
         """
         # Get telemetry data without incrementing sequence here
         # We'll handle sequence incrementation separately
-        telemetry = self.generate_telemetry_data(increment_sequence=False)
+        if telemetry is None:
+            telemetry = self.generate_telemetry_data(increment_sequence=False)
         
         # Increment sequence if requested (default to True for backward compatibility)
         if increment_sequence:
@@ -321,6 +358,27 @@ class TelemetryGenerator:
             }
         }
         
+        if not include_stats:
+            return server_telemetry
+        
+        if self.viewer_stats_provider is not None:
+            try:
+                server_telemetry['data']['viewers'] = self.viewer_stats_provider()
+            except Exception as e:
+                logger.warning(f"Failed to get viewer statistics: {str(e)}")
+        
+        if self.video_stats_provider is not None:
+            try:
+                server_telemetry['data']['video'] = self.video_stats_provider()
+            except Exception as e:
+                logger.warning(f"Failed to get video statistics: {str(e)}")
+        
+        if self.message_stats_provider is not None:
+            try:
+                server_telemetry['data']['messages'] = self.message_stats_provider()
+            except Exception as e:
+                logger.warning(f"Failed to get message lane statistics: {str(e)}")
+        
         return server_telemetry
     
     def get_current_status(self):
@@ -363,4 +421,46 @@ class TelemetryGenerator:
         """
         self.motor_controller = motor_controller
         logger.info("Motor controller attached to telemetry system")
-        return True 
\ No newline at end of file
+        return True
+    
+    def set_fix_callback(self, callback):
+        """
+        Set a function to call from the GPS reader thread whenever a new fix arrives.
+        
+        Args:
+            callback: Callable taking no arguments, or None to stop the calls
+        """
+        if self.gps:
+            self.gps.set_fix_callback(callback)
+    
+    def set_viewer_stats_provider(self, provider):
+        """
+        Set the source of the video viewer counters included in server telemetry.
+        
+        Args:
+            provider: Callable returning a dict of viewer counters (WebRTCHandler.get_viewer_stats),
+                      or None to leave them out
+        """
+        self.viewer_stats_provider = provider
+    
+    def set_video_stats_provider(self, provider):
+        """
+        Set the source of the video stream health (RTT, loss, bitrate, frame rate,
+        NACK/PLI counts) included in server telemetry as "video".
+        
+        Args:
+            provider: Callable returning a dict (WebRTCHandler.get_video_stats),
+                      or None to leave it out
+        """
+        self.video_stats_provider = provider
+    
+    def set_message_stats_provider(self, provider):
+        """
+        Set the source of the incoming message lane statistics (queue depth,
+        processed, dropped, longest wait) included in server telemetry as "messages".
+        
+        Args:
+            provider: Callable returning a dict (MessageDispatcher.get_stats),
+                      or None to leave it out
+        """
+        self.message_stats_provider = provider 
\ No newline at end of file
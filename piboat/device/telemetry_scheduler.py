@@ -0,0 +1,121 @@
+import math
+
+# Metres per degree of latitude, for the flat-earth distance used by the position deadband
+METRES_PER_DEGREE = 111320.0
+
+
+def _heading_change(a, b):
+    """Smallest angle between two headings in degrees."""
+    return abs((a - b + 180) % 360 - 180)
+
+
+def _position_change(lat1, lon1, lat2, lon2):
+    """Approximate distance in metres between two nearby positions."""
+    dy = (lat2 - lat1) * METRES_PER_DEGREE
+    dx = (lon2 - lon1) * METRES_PER_DEGREE * math.cos(math.radians((lat1 + lat2) / 2))
+    return math.hypot(dx, dy)
+
+
+class TelemetryScheduler:
+    """
+    Decides when a telemetry sample is worth sending.
+
+    In change-driven mode a sample is sent as soon as a field moves past its
+    deadband relative to the last sample sent: heading, position, throttle or
+    rudder, a GPS fix status transition, or a new GPS fix epoch. A heartbeat
+    is sent when nothing changed for the heartbeat interval, and nothing is
+    sent more often than the maximum rate. Otherwise every sample is sent at
+    the fixed interval.
+    """
+    def __init__(self, heartbeat, on_change=True, max_rate=10.0, heading_deadband=2.0,
+                 position_deadband=2.0, control_deadband=1.0):
+        """
+        Args:
+            heartbeat: Longest time between messages in seconds (the fixed interval when not on_change)
+            on_change: Send on field changes instead of at the fixed interval
+            max_rate: Most messages per second in change-driven mode
+            heading_deadband: Heading change in degrees that triggers a message
+            position_deadband: Movement in metres that triggers a message
+            control_deadband: Throttle or rudder change that triggers a message
+        """
+        self.heartbeat = heartbeat
+        self.on_change = on_change
+        self.min_gap = 1.0 / max_rate if max_rate > 0 else 0.0
+        self.heading_deadband = heading_deadband
+        self.position_deadband = position_deadband
+        self.control_deadband = control_deadband
+        self._last_sent = None
+        self._last_time = None
+
+    @property
+    def sample_interval(self):
+        """How often the caller should take a sample, in seconds."""
+        if not self.on_change:
+            return self.heartbeat
+        return min(self.heartbeat, self.min_gap) if self.min_gap > 0 else self.heartbeat
+
+    def check(self, telemetry, now):
+        """
+        Check whether a sample should be sent.
+
+        Args:
+            telemetry (dict): Sample from TelemetryGenerator.generate_telemetry_data()
+            now: time.monotonic() of the sample
+
+        Returns:
+            Why the sample should be sent ("heartbeat", "heading", "position",
+            "control", "fix_status" or "fix_epoch"), or None to skip it
+        """
+        if self._last_sent is None:
+            return "heartbeat"
+        elapsed = now - self._last_time
+        if elapsed >= self.heartbeat:
+            return "heartbeat"
+        if not self.on_change or elapsed < self.min_gap:
+            return None
+        return self._change_reason(self._last_sent, telemetry)
+
+    def reset(self):
+        """Forget the last sample sent, so the next one is sent."""
+        self._last_sent = None
+        self._last_time = None
+
+    def mark_sent(self, telemetry, now):
+        """Record a sample as sent; later samples are compared with it."""
+        self._last_sent = telemetry
+        self._last_time = now
+
+    def _change_reason(self, last, current):
+        """Get the first field that moved past its deadband, or None."""
+        last_gps = last['status'].get('gps', {})
+        gps = current['status'].get('gps', {})
+        if gps.get('status') != last_gps.get('status'):
+            return "fix_status"
+        if gps.get('has_fix') and gps.get('fix_epoch') != last_gps.get('fix_epoch'):
+            return "fix_epoch"
+
+        if self._moved(last['navigation']['heading'], current['navigation']['heading'],
+                       _heading_change, self.heading_deadband):
+            return "heading"
+
+        last_position = last['position']
+        position = current['position']
+        if (last_position['latitude'] is None) != (position['latitude'] is None):
+            return "position"
+        if position['latitude'] is not None and _position_change(
+                last_position['latitude'], last_position['longitude'],
+                position['latitude'], position['longitude']) >= self.position_deadband:
+            return "position"
+
+        for field in ('throttle', 'rudder_position'):
+            if self._moved(last['navigation'][field], current['navigation'][field],
+                           lambda a, b: abs(a - b), self.control_deadband):
+                return "control"
+        return None
+
+    @staticmethod
+    def _moved(last, current, difference, deadband):
+        """Check whether a value appeared, disappeared or changed by at least the deadband."""
+        if last is None or current is None:
+            return (last is None) != (current is None)
+        return difference(last, current) >= deadband
@@ -0,0 +1,476 @@
+#!/usr/bin/env python3
+"""
+Video pipeline benchmark for PiBoat.
+Drives the capture -> convert -> resize -> overlay -> encode path used by the
+webcam and test pattern tracks from a synthetic pattern or a recorded video
+file, and reports per-stage timings, achieved fps, CPU use and allocation
+rate. Results can be written as JSON and compared against an earlier run.
+"""
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import statistics
+import tracemalloc
+from datetime import datetime
+
+import av
+import cv2
+import numpy
+
+# Add the project root to sys.path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from piboat.webrtc.overlay import OverlayCompositor
+from piboat.webrtc.pacing import VIDEO_CLOCK_RATE, VIDEO_TIME_BASE
+from piboat.webrtc.pixel_format import FrameConverter, FOURCC_MJPEG, FOURCC_YUYV, OUTPUT_FORMAT, to_output_frame
+from piboat.webrtc.relay import create_encoder
+from piboat.webrtc.video import _build_pattern_frames
+
+# Stages of the frame path, in pipeline order
+STAGES = ("capture", "convert", "resize", "overlay", "encode")
+
+# Distinct frames held in memory per source, looped over during a run
+SOURCE_FRAMES = 60
+
+# Pixel formats the sources can produce, keyed by command line name
+SOURCE_FORMATS = {'yuyv': FOURCC_YUYV, 'mjpeg': FOURCC_MJPEG, 'bgr': None}
+
+# Smallest relative fps or per-frame time change reported as a regression by --compare
+REGRESSION_THRESHOLD = 0.10
+
+# Timed runs per pipeline; speed and CPU figures are the median across them
+DEFAULT_REPEAT = 5
+
+# A change is only a regression beyond this many times the combined run-to-run noise
+NOISE_FACTOR = 3.0
+
+
+def encode_raw(bgr, fourcc):
+    """
+    Turn a BGR image into the raw buffer a camera would deliver in a pixel format.
+
+    Returns:
+        uint8 array (BGR image, packed YUYV, or JPEG bytes)
+    """
+    if fourcc == FOURCC_YUYV:
+        return cv2.cvtColor(bgr, cv2.COLOR_BGR2YUV_YUYV)
+    if fourcc == FOURCC_MJPEG:
+        ok, jpeg = cv2.imencode(".jpg", bgr, [cv2.IMWRITE_JPEG_QUALITY, 85])
+        if not ok:
+            raise RuntimeError("Failed to encode benchmark JPEG")
+        return jpeg
+    return bgr
+
+
+class BufferSource:
+    """
+    Replays a fixed set of raw camera buffers. Reading copies the buffer,
+    like OpenCV copying a frame out of the V4L2 queue.
+    """
+    def __init__(self, name, buffers, width, height, fourcc):
+        self.name = name
+        self.width = width
+        self.height = height
+        self.fourcc = fourcc
+        self._buffers = buffers
+        self._index = 0
+
+    def read(self):
+        buffer = self._buffers[self._index]
+        self._index = (self._index + 1) % len(self._buffers)
+        return buffer.copy()
+
+
+def make_pattern_source(width, height, fourcc, count=SOURCE_FRAMES):
+    """
+    Build a source from the moving test pattern (what TestPatternVideoTrack shows),
+    with text on it so the JPEG and encoder workloads are not trivially flat.
+    """
+    patterns = _build_pattern_frames(width, height)
+    step = max(1, len(patterns) // count)
+    buffers = []
+    for index in range(0, len(patterns), step)[:count]:
+        bgr = patterns[index].copy()
+        cv2.putText(bgr, "PiBoat benchmark", (40 + index, height // 2), cv2.FONT_HERSHEY_SIMPLEX, 2, (255, 255, 255), 3)
+        buffers.append(encode_raw(bgr, fourcc))
+    return BufferSource("pattern", buffers, width, height, fourcc)
+
+
+def make_file_source(path, width, height, fourcc, count=SOURCE_FRAMES):
+    """
+    Build a source from the first frames of a recorded video, scaled to the capture size.
+
+    Raises:
+        RuntimeError: If the file cannot be read
+    """
+    cap = cv2.VideoCapture(path)
+    if not cap.isOpened():
+        raise RuntimeError(f"Could not open video file {path}")
+
+    buffers = []
+    try:
+        while len(buffers) < count:
+            ret, bgr = cap.read()
+            if not ret:
+                break
+            if bgr.shape[1] != width or bgr.shape[0] != height:
+                bgr = cv2.resize(bgr, (width, height))
+            buffers.append(encode_raw(bgr, fourcc))
+    finally:
+        cap.release()
+
+    if not buffers:
+        raise RuntimeError(f"No frames could be read from {path}")
+    return BufferSource(os.path.basename(path), buffers, width, height, fourcc)
+
+
+class Pipeline:
+    """
+    One configuration of the frame path, run stage by stage so each stage can be
+    timed on its own. Mirrors what CameraSource, the tracks and the relay do per frame.
+    """
+    def __init__(self, source, width, height, fps, codec, bitrate, overlay=True):
+        self.source = source
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.codec = codec
+        self.bitrate = bitrate
+        self.name = (f"{source.name}:{'bgr' if source.fourcc is None else source.fourcc.lower()} "
+                     f"{source.width}x{source.height}->{width}x{height}@{fps} {codec or 'raw'}")
+
+        self._converter = FrameConverter(source.fourcc, source.width, source.height, source.width, source.height)
+        self._overlay = OverlayCompositor(hud_enabled=False) if overlay else None
+        self._encoder = create_encoder(codec, width, height, fps, bitrate) if codec else None
+        self._pts = 0
+
+    def stage_capture(self, _):
+        return self.source.read()
+
+    def stage_convert(self, raw):
+        # Decode or repack the buffer and construct the VideoFrame
+        return self._converter.convert(raw)
+
+    def stage_resize(self, frame):
+        frame = to_output_frame(frame, self.width, self.height)
+        frame.pts = self._pts
+        frame.time_base = VIDEO_TIME_BASE
+        self._pts += VIDEO_CLOCK_RATE // self.fps
+        return frame
+
+    def stage_overlay(self, frame):
+        if self._overlay is not None:
+            self._overlay.apply(frame)
+        return frame
+
+    def stage_encode(self, frame):
+        if self._encoder is not None:
+            self._encoder.encode(frame)
+        return frame
+
+    def run_frame(self, timings=None, allocations=None):
+        """
+        Push one frame through every stage.
+
+        Args:
+            timings: Optional dict of stage -> list, appended with seconds spent
+            allocations: Optional dict of stage -> list, appended with peak bytes
+                         allocated (requires tracemalloc to be running)
+        """
+        value = None
+        for stage in STAGES:
+            func = getattr(self, f"stage_{stage}")
+            if allocations is not None:
+                tracemalloc.reset_peak()
+                before = tracemalloc.get_traced_memory()[0]
+            start = time.perf_counter()
+            value = func(value)
+            elapsed = time.perf_counter() - start
+            if timings is not None:
+                timings[stage].append(elapsed)
+            if allocations is not None:
+                allocations[stage].append(tracemalloc.get_traced_memory()[1] - before)
+
+
+def summarize_ms(samples):
+    """Summarize stage durations in seconds as mean / p50 / p95 / max milliseconds."""
+    ordered = sorted(samples)
+    return {
+        'mean_ms': statistics.fmean(ordered) * 1000,
+        'p50_ms': ordered[len(ordered) // 2] * 1000,
+        'p95_ms': ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000,
+        'max_ms': ordered[-1] * 1000
+    }
+
+
+def relative_noise(samples):
+    """
+    Estimate run-to-run noise as the median absolute deviation relative to the
+    median, scaled to match a standard deviation for normally distributed runs.
+    """
+    if len(samples) < 2:
+        return 0.0
+    median = statistics.median(samples)
+    mad = statistics.median(abs(sample - median) for sample in samples)
+    return 1.4826 * mad / median if median else 0.0
+
+
+def run_pipeline(pipeline, frames, alloc_frames, repeat=DEFAULT_REPEAT):
+    """
+    Benchmark a pipeline: repeated timed runs for speed and CPU, then a shorter
+    run under tracemalloc for allocations (tracemalloc slows everything down, so
+    the two are kept apart). Allocation figures cover Python and numpy
+    buffers, not memory allocated inside libav.
+
+    Returns:
+        Result dictionary for the pipeline
+    """
+    # Warm up (encoder setup, decoder and scaler caches)
+    for _ in range(min(10, frames)):
+        pipeline.run_frame()
+
+    timings = {stage: [] for stage in STAGES}
+    runs = []
+    for _ in range(max(1, repeat)):
+        cpu_start = time.process_time()
+        wall_start = time.perf_counter()
+        for _ in range(frames):
+            pipeline.run_frame(timings=timings)
+        wall = time.perf_counter() - wall_start
+        cpu = time.process_time() - cpu_start
+        runs.append({'fps': frames / wall, 'cpu_ms_per_frame': cpu * 1000 / frames,
+                     'wall_ms_per_frame': wall * 1000 / frames, 'cpu_percent': cpu / wall * 100})
+
+    fps = statistics.median(run['fps'] for run in runs)
+    result = {
+        'name': pipeline.name,
+        'source': pipeline.source.name,
+        'pixel_format': pipeline.source.fourcc or "BGR",
+        'capture_size': [pipeline.source.width, pipeline.source.height],
+        'output_size': [pipeline.width, pipeline.height],
+        'codec': pipeline.codec,
+        'bitrate': pipeline.bitrate,
+        'frames': frames,
+        'repeat': len(runs),
+        'fps': fps,
+        'cpu_percent': statistics.median(run['cpu_percent'] for run in runs),
+        'cpu_ms_per_frame': statistics.median(run['cpu_ms_per_frame'] for run in runs),
+        'wall_ms_per_frame': statistics.median(run['wall_ms_per_frame'] for run in runs),
+        'fps_noise': relative_noise([run['fps'] for run in runs]),
+        'cpu_ms_noise': relative_noise([run['cpu_ms_per_frame'] for run in runs]),
+        'runs': runs,
+        'stages': {stage: summarize_ms(samples) for stage, samples in timings.items()}
+    }
+
+    if alloc_frames > 0:
+        allocations = {stage: [] for stage in STAGES}
+        tracemalloc.start()
+        try:
+            for _ in range(alloc_frames):
+                pipeline.run_frame(allocations=allocations)
+        finally:
+            tracemalloc.stop()
+        per_frame = 0
+        for stage, samples in allocations.items():
+            stage_kb = statistics.fmean(samples) / 1024
+            result['stages'][stage]['alloc_kb_per_frame'] = stage_kb
+            per_frame += stage_kb
+        result['alloc_kb_per_frame'] = per_frame
+        result['alloc_mb_per_s'] = per_frame * fps / 1024
+
+    return result
+
+
+def legacy_convert(buffers, fourcc, width, height):
+    """OpenCV decode/convert to BGR, bgr24 frame, encoder-side BGR -> yuv420p."""
+    if fourcc == FOURCC_MJPEG:
+        img = cv2.imdecode(buffers[fourcc], cv2.IMREAD_COLOR)
+    else:
+        img = cv2.cvtColor(buffers[fourcc], cv2.COLOR_YUV2BGR_YUYV)
+    frame = FrameConverter(None, width, height, width, height).convert(img)
+    return frame.reformat(format=OUTPUT_FORMAT)
+
+
+def benchmark_pixel_formats(width, height, frames):
+    """
+    Compare the legacy BGR conversion paths with the native YUV paths.
+
+    Returns:
+        List of result dictionaries, one per path
+    """
+    bgr = _build_pattern_frames(width, height)[0].copy()
+    buffers = {fourcc: encode_raw(bgr, fourcc) for fourcc in (FOURCC_YUYV, FOURCC_MJPEG)}
+    converters = {fourcc: FrameConverter(fourcc, width, height, width, height) for fourcc in buffers}
+
+    paths = []
+    for fourcc in (FOURCC_YUYV, FOURCC_MJPEG):
+        paths.append((f"legacy {fourcc} -> BGR -> {OUTPUT_FORMAT}",
+                      lambda fourcc=fourcc: legacy_convert(buffers, fourcc, width, height)))
+        paths.append((f"native {fourcc} -> {OUTPUT_FORMAT}",
+                      lambda fourcc=fourcc: converters[fourcc].convert(buffers[fourcc])))
+
+    results = []
+    for name, func in paths:
+        for _ in range(min(5, frames)):
+            func()
+        cpu_start = time.process_time()
+        wall_start = time.perf_counter()
+        for _ in range(frames):
+            frame = func()
+        results.append({
+            'path': name,
+            'output_format': frame.format.name,
+            'cpu_ms_per_frame': (time.process_time() - cpu_start) * 1000 / frames,
+            'wall_ms_per_frame': (time.perf_counter() - wall_start) * 1000 / frames
+        })
+    return results
+
+
+def get_environment():
+    """Describe the machine and library versions, so results from different runs can be told apart."""
+    return {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'hostname': platform.node(),
+        'machine': platform.machine(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'python': platform.python_version(),
+        'opencv': cv2.__version__,
+        'pyav': av.__version__,
+        'numpy': numpy.__version__
+    }
+
+
+def regression_threshold(result, old, key):
+    """
+    Get the relative change that counts as a regression for a figure: the
+    combined run-to-run noise of both runs times NOISE_FACTOR, but never less
+    than REGRESSION_THRESHOLD. Runs without repetitions only use the floor.
+    """
+    noise = (result.get(key, 0.0) ** 2 + old.get(key, 0.0) ** 2) ** 0.5
+    return max(REGRESSION_THRESHOLD, NOISE_FACTOR * noise)
+
+
+def compare_results(results, baseline):
+    """
+    Compare pipeline results against a baseline run, matched by pipeline name.
+    Figures are medians over repeated runs and only changes beyond the runs'
+    measured noise are reported as regressions.
+
+    Returns:
+        List of (name, baseline fps, fps, fps change, baseline ms, ms, ms change, regressed)
+    """
+    previous = {result['name']: result for result in baseline.get('pipelines', [])}
+    rows = []
+    for result in results['pipelines']:
+        old = previous.get(result['name'])
+        if old is None:
+            continue
+        fps_change = result['fps'] / old['fps'] - 1
+        ms_change = result['cpu_ms_per_frame'] / old['cpu_ms_per_frame'] - 1
+        regressed = (fps_change < -regression_threshold(result, old, 'fps_noise')
+                     or ms_change > regression_threshold(result, old, 'cpu_ms_noise'))
+        rows.append((result['name'], old['fps'], result['fps'], fps_change,
+                     old['cpu_ms_per_frame'], result['cpu_ms_per_frame'], ms_change, regressed))
+    return rows
+
+
+def print_pipeline(result):
+    print(f"\n{result['name']}")
+    print(f"  {result['fps']:.1f} fps (+/-{result['fps_noise']:.1%} over {result['repeat']} runs), "
+          f"{result['cpu_percent']:.0f}% CPU, {result['cpu_ms_per_frame']:.2f} CPU ms/frame", end="")
+    if 'alloc_mb_per_s' in result:
+        print(f", {result['alloc_kb_per_frame']:.0f} KB/frame ({result['alloc_mb_per_s']:.1f} MB/s) allocated")
+    else:
+        print()
+    print(f"  {'Stage':<9} {'mean ms':>8} {'p50 ms':>8} {'p95 ms':>8} {'max ms':>8} {'alloc KB':>9}")
+    for stage, stats in result['stages'].items():
+        alloc = f"{stats['alloc_kb_per_frame']:>9.0f}" if 'alloc_kb_per_frame' in stats else f"{'-':>9}"
+        print(f"  {stage:<9} {stats['mean_ms']:>8.2f} {stats['p50_ms']:>8.2f} "
+              f"{stats['p95_ms']:>8.2f} {stats['max_ms']:>8.2f} {alloc}")
+
+
+def parse_size(value):
+    width, height = (int(v) for v in value.lower().split("x"))
+    return width, height
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the PiBoat video frame pipeline')
+    parser.add_argument('--width', type=int, default=1280, help='Output (encoded) width')
+    parser.add_argument('--height', type=int, default=720, help='Output (encoded) height')
+    parser.add_argument('--capture-size', type=parse_size, default=None,
+                        help='Capture size as WIDTHxHEIGHT (default: the output size)')
+    parser.add_argument('--fps', type=int, default=30, help='Frame rate the encoder is configured for')
+    parser.add_argument('--frames', type=int, default=200, help='Frames to process per timed run')
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT,
+                        help='Timed runs per pipeline; the median is reported and compared')
+    parser.add_argument('--alloc-frames', type=int, default=30,
+                        help='Frames to trace for allocations per pipeline (0 to skip)')
+    parser.add_argument('--file', help='Recorded video to use as the source instead of the test pattern')
+    parser.add_argument('--formats', default='yuyv,mjpeg,bgr',
+                        help='Comma-separated capture pixel formats to run (yuyv, mjpeg, bgr)')
+    parser.add_argument('--codecs', default='VP8,H264',
+                        help='Comma-separated codecs to encode with (VP8, H264, or none)')
+    parser.add_argument('--bitrate', type=int, default=1500, help='Encoder bitrate in kbps')
+    parser.add_argument('--no-overlay', action='store_true', help='Skip the timestamp overlay stage')
+    parser.add_argument('--skip-formats', action='store_true', help='Skip the legacy vs native pixel format comparison')
+    parser.add_argument('--json', help='Write the results to this JSON file')
+    parser.add_argument('--compare', help='Compare against the results of an earlier --json run')
+    args = parser.parse_args()
+
+    capture_width, capture_height = args.capture_size or (args.width, args.height)
+    codecs = [None if c.strip().lower() == 'none' else c.strip().upper() for c in args.codecs.split(',')]
+
+    results = {
+        'environment': get_environment(),
+        'arguments': vars(args),
+        'pixel_formats': [],
+        'pipelines': []
+    }
+
+    if not args.skip_formats:
+        print(f"Pixel format conversion at {capture_width}x{capture_height}, {args.frames} frames per path")
+        print(f"{'Path':<34} {'Output':<9} {'CPU ms/frame':>13} {'Wall ms/frame':>14}")
+        for result in benchmark_pixel_formats(capture_width, capture_height, args.frames):
+            results['pixel_formats'].append(result)
+            print(f"{result['path']:<34} {result['output_format']:<9} "
+                  f"{result['cpu_ms_per_frame']:>13.2f} {result['wall_ms_per_frame']:>14.2f}")
+
+    for format_name in args.formats.split(','):
+        fourcc = SOURCE_FORMATS[format_name.strip().lower()]
+        if args.file:
+            source = make_file_source(args.file, capture_width, capture_height, fourcc)
+        else:
+            source = make_pattern_source(capture_width, capture_height, fourcc)
+
+        for codec in codecs:
+            pipeline = Pipeline(source, args.width, args.height, args.fps, codec,
+                                args.bitrate * 1000, overlay=not args.no_overlay)
+            result = run_pipeline(pipeline, args.frames, args.alloc_frames, args.repeat)
+            results['pipelines'].append(result)
+            print_pipeline(result)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults written to {args.json}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        rows = compare_results(results, baseline)
+        print(f"\nCompared with {args.compare} ({baseline.get('environment', {}).get('timestamp', 'unknown date')})")
+        print(f"{'Pipeline':<48} {'fps':>15} {'change':>8} {'CPU ms/frame':>15} {'change':>8}")
+        for name, old_fps, fps, fps_change, old_ms, ms, ms_change, regressed in rows:
+            print(f"{name:<48} {old_fps:>6.1f} -> {fps:>5.1f} {fps_change:>+8.1%} "
+                  f"{old_ms:>6.2f} -> {ms:>5.2f} {ms_change:>+8.1%}{'  REGRESSION' if regressed else ''}")
+        if any(row[-1] for row in rows):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,225 @@
+import logging
+import time
+from collections import namedtuple
+
+from piboat.config import (
+    VIDEO_WIDTH, VIDEO_HEIGHT, VIDEO_FPS, VIDEO_LADDER, VIDEO_PEER_MAX_KBPS, VIDEO_PEER_MAX_FPS
+)
+
+logger = logging.getLogger("AdaptiveBitrate")
+
+# Step down after DEGRADE_SAMPLES consecutive reports with this much loss or delay
+DEGRADE_LOSS = 0.08
+DEGRADE_RTT = 0.6
+DEGRADE_SAMPLES = 2
+
+# Step up only after UPGRADE_SAMPLES consecutive clean reports, and not
+# sooner than MIN_RUNG_HOLD seconds after the previous change
+UPGRADE_LOSS = 0.02
+UPGRADE_RTT = 0.3
+UPGRADE_SAMPLES = 8
+MIN_RUNG_HOLD = 10.0
+
+Rung = namedtuple("Rung", ["width", "height", "fps", "bitrate"])
+
+
+def parse_ladder(spec, max_width=VIDEO_WIDTH, max_height=VIDEO_HEIGHT, max_fps=VIDEO_FPS):
+    """
+    Parse a ladder specification such as "1280x720@30:1500,640x360@20:500".
+
+    Each rung is WIDTHxHEIGHT@FPS:KBPS. Rungs are sorted from best to worst and
+    clipped to the configured capture size and frame rate.
+
+    Returns:
+        List of Rung, best first
+    """
+    rungs = []
+    for item in spec.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        try:
+            size, rest = item.split("@")
+            fps, kbps = rest.split(":")
+            width, height = (int(v) for v in size.lower().split("x"))
+            rungs.append(Rung(width, height, int(fps), int(kbps) * 1000))
+        except ValueError:
+            logger.warning(f"Ignoring invalid ladder rung: {item}")
+
+    rungs = [r for r in rungs if r.width <= max_width and r.height <= max_height]
+    rungs = [r._replace(fps=min(r.fps, max_fps)) for r in rungs]
+    rungs.sort(key=lambda r: (r.width * r.height, r.fps, r.bitrate), reverse=True)
+
+    if not rungs:
+        logger.warning("No usable ladder rungs, streaming at the capture size only")
+        rungs = [Rung(max_width, max_height, max_fps, 1500000)]
+    return rungs
+
+
+def apply_peer_budget(ladder, max_bitrate=0, max_fps=0):
+    """
+    Cap every rung of a ladder to a per-viewer budget.
+
+    Args:
+        ladder: List of Rung, best first
+        max_bitrate: Highest bitrate a viewer may get in bits per second (0 for no cap)
+        max_fps: Highest frame rate a viewer may get (0 for no cap)
+
+    Returns:
+        List of Rung, best first, without rungs that became duplicates
+    """
+    budgeted = []
+    for rung in ladder:
+        if max_bitrate > 0:
+            rung = rung._replace(bitrate=min(rung.bitrate, max_bitrate))
+        if max_fps > 0:
+            rung = rung._replace(fps=min(rung.fps, max_fps))
+        if rung not in budgeted:
+            budgeted.append(rung)
+    return budgeted
+
+
+def get_video_sender(pc):
+    """Get the RTCRtpSender carrying video on a peer connection, if any."""
+    for sender in pc.getSenders():
+        if sender.track is not None and sender.track.kind == "video":
+            return sender
+    return None
+
+
+def get_sender_encoder(sender):
+    """
+    Get the encoder aiortc created for a sender.
+    aiortc does not expose it publicly; it is only available once the first frame was encoded.
+    """
+    return getattr(sender, "_RTCRtpSender__encoder", None)
+
+
+class AdaptiveBitrateController:
+    """
+    Moves one peer up and down a ladder of resolution, frame rate and target
+    bitrate based on the RTCP receiver reports of its video sender.
+
+    Rungs are applied by scaling and decimating frames in the peer's track (or
+    moving it to another relay encoding layer) and by capping the encoder
+    bitrate, so no renegotiation is needed.
+    """
+    def __init__(self, client_id, pc, ladder):
+        """
+        Args:
+            client_id (str): Client the peer connection belongs to
+            pc: The RTCPeerConnection to adapt
+            ladder: List of Rung, best first
+        """
+        self.client_id = client_id
+        self.pc = pc
+        self.ladder = ladder
+        self.rung_index = 0
+        self.rung_changes = 0
+        self._bad_samples = 0
+        self._good_samples = 0
+        self._last_change = time.monotonic()
+        self._last_report = None
+        # Rung last pushed to the track and encoder
+        self._applied = None
+
+    @property
+    def rung(self):
+        return self.ladder[self.rung_index]
+
+    def _sample(self, report):
+        """
+        Extract (loss fraction, round-trip time) from a new receiver report.
+
+        Returns:
+            Tuple of (loss, rtt) or None if no new report arrived since the last sample
+        """
+        for stats in report.values():
+            if stats.type != "remote-inbound-rtp" or stats.kind != "video":
+                continue
+            if stats.timestamp == self._last_report:
+                return None
+            self._last_report = stats.timestamp
+            # fractionLost is the raw 8-bit fixed point value from the receiver report
+            loss = (stats.fractionLost or 0) / 256.0
+            rtt = stats.roundTripTime or 0.0
+            return loss, rtt
+        return None
+
+    def _step(self, loss, rtt):
+        """Update the hysteresis counters and change rung if warranted."""
+        if loss >= DEGRADE_LOSS or rtt >= DEGRADE_RTT:
+            self._bad_samples += 1
+            self._good_samples = 0
+        elif loss <= UPGRADE_LOSS and rtt <= UPGRADE_RTT:
+            self._good_samples += 1
+            self._bad_samples = 0
+        else:
+            self._bad_samples = 0
+            self._good_samples = 0
+
+        now = time.monotonic()
+        if self._bad_samples >= DEGRADE_SAMPLES and self.rung_index < len(self.ladder) - 1:
+            self._change_rung(self.rung_index + 1, now, f"loss {loss:.1%}, rtt {rtt * 1000:.0f}ms")
+        elif (self._good_samples >= UPGRADE_SAMPLES and self.rung_index > 0
+              and now - self._last_change >= MIN_RUNG_HOLD):
+            self._change_rung(self.rung_index - 1, now, f"link clean for {self._good_samples} reports")
+
+    def _change_rung(self, index, now, reason):
+        self.rung_index = index
+        self.rung_changes += 1
+        self._last_change = now
+        self._bad_samples = 0
+        self._good_samples = 0
+        rung = self.rung
+        logger.info(f"Client {self.client_id}: switching to {rung.width}x{rung.height}@{rung.fps} "
+                    f"{rung.bitrate // 1000}kbps ({reason})")
+
+    def _apply(self):
+        """Push the current rung to the track and cap the encoder bitrate."""
+        sender = get_video_sender(self.pc)
+        if sender is None:
+            return
+
+        rung = self.rung
+        encoder = get_sender_encoder(sender)
+        has_bitrate = encoder is not None and hasattr(encoder, "target_bitrate")
+
+        if self._applied != rung:
+            if hasattr(sender.track, "set_output"):
+                sender.track.set_output(rung.width, rung.height, rung.fps, rung.bitrate)
+            if has_bitrate:
+                encoder.target_bitrate = rung.bitrate
+                self._applied = rung
+        elif has_bitrate and encoder.target_bitrate > rung.bitrate:
+            # Receiver bandwidth estimates (REMB) may lower the bitrate further, but never raise it past the rung
+            encoder.target_bitrate = rung.bitrate
+
+    def update(self, report):
+        """
+        Evaluate the latest link statistics and apply the resulting rung.
+
+        Args:
+            report: RTCStatsReport of the peer connection, collected by the handler's statistics loop
+        """
+        sample = self._sample(report)
+        if sample is not None:
+            self._step(*sample)
+        self._apply()
+
+    def get_status(self):
+        """Get the current rung and adaptation state."""
+        rung = self.rung
+        return {
+            'rung': self.rung_index,
+            'width': rung.width,
+            'height': rung.height,
+            'fps': rung.fps,
+            'bitrate': rung.bitrate,
+            'rung_changes': self.rung_changes
+        }
+
+
+def get_default_ladder():
+    """Get the ladder configured by VIDEO_LADDER, clipped to the capture settings and the per-viewer budget."""
+    return apply_peer_budget(parse_ladder(VIDEO_LADDER), VIDEO_PEER_MAX_KBPS * 1000, VIDEO_PEER_MAX_FPS)
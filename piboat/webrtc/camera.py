@@ -0,0 +1,730 @@
+import asyncio
+import logging
+import threading
+import time
+
+import cv2
+
+from piboat.config import (
+    VIDEO_WIDTH, VIDEO_HEIGHT, VIDEO_FPS, VIDEO_PIXEL_FORMAT, VIDEO_IDLE_FPS, CAMERA_IDLE_TIMEOUT,
+    VIDEO_PREPROCESS_WORKERS
+)
+from piboat.webrtc.overlay import OverlayCompositor
+from piboat.webrtc.pacing import clock_pts, VIDEO_CLOCK_RATE, VIDEO_TIME_BASE
+from piboat.webrtc.pixel_format import (
+    FrameConverter, negotiate_fourcc, fourcc_code, fourcc_name, to_output_frame, encode_jpeg
+)
+from piboat.webrtc.preprocess import FramePreprocessor
+from piboat.webrtc.scene import SceneChangeDetector
+from piboat.webrtc.webcam_utils import get_best_webcam_device, get_capability_cache, fourccs_for_resolution
+
+logger = logging.getLogger("CameraSource")
+
+# Oldest driver buffer timestamp accepted as a frame's capture time, in seconds
+MAX_BUFFER_AGE = 1.0
+
+# Process-wide capture source shared by every video track
+_shared_source = None
+
+
+class CameraSource:
+    """
+    Owns the webcam capture device for the whole process.
+    Video tracks subscribe to the source instead of opening the device themselves,
+    so every viewer is fed from the same captured (and already resized) frames.
+
+    The device is opened on the first subscription. When the last subscriber
+    leaves it is kept open in a warm standby for idle_timeout seconds, so a
+    returning viewer gets frames at once, and only then released.
+
+    With preprocess_workers, captured buffers are decoded and converted in
+    worker processes and the capture thread only reads and hands them over.
+    """
+    def __init__(self, device_id=None, width=VIDEO_WIDTH, height=VIDEO_HEIGHT, fps=VIDEO_FPS,
+                 idle_timeout=CAMERA_IDLE_TIMEOUT, preprocess_workers=VIDEO_PREPROCESS_WORKERS):
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.idle_timeout = idle_timeout
+        self.preprocess_workers = preprocess_workers
+        self._device_id = device_id
+        self._cap = None
+        self._subscribers = 0
+
+        # Warm standby between the last subscriber leaving and the device being released
+        self._standby = False
+        self._release_timer = None
+
+        # Subscribers may come from the event loop and from worker threads (the recorder)
+        self._subscribe_lock = threading.Lock()
+
+        # Negotiated capture pixel format and the converter for its buffers
+        self._fourcc = None
+        self._converter = None
+
+        # Worker processes converting captured buffers, if enabled
+        self._preprocessor = None
+
+        # Timestamp banner and HUD drawn into every captured frame
+        self._overlay = OverlayCompositor()
+
+        # Detects a static scene so live tracks can drop to VIDEO_IDLE_FPS
+        self._scene = SceneChangeDetector() if VIDEO_IDLE_FPS > 0 else None
+
+        # Timestamp of the last frame, kept so timestamps are strictly increasing
+        self._last_pts = None
+
+        # Latest captured frame and its sequence number, written by the capture thread
+        self._lock = threading.Lock()
+        self._frame_ready = threading.Condition(self._lock)
+        self._frame = None
+        self._frame_seq = 0
+        self._frame_consumed = True
+        self._frame_static = False
+        self._error = None
+
+        # Capture statistics
+        self.frames_captured = 0
+        self.frames_static = 0
+        self.frames_dropped = 0
+        self.frames_corrupt = 0
+
+        # Background capture thread. If it is still inside a read or reconnect when the
+        # device is released, the release is handed to the thread to do once it exits
+        self._running = False
+        self._thread = None
+        self._release_lock = threading.Lock()
+        self._capture_done = True
+        self._release_pending = False
+
+        # Coroutines waiting for a new frame, resolved from the capture thread
+        self._loop = None
+        self._waiters = []
+
+        # Latest frame scaled to each size requested by a subscriber: {(width, height): (seq, future)}
+        self._scaled = {}
+
+        # JPEG of the latest snapshot: (seq, quality, frame, future)
+        self._jpeg = None
+
+    @property
+    def device_id(self):
+        return self._device_id
+
+    @property
+    def subscribers(self):
+        return self._subscribers
+
+    @property
+    def scene_static(self):
+        """Whether the latest frame is part of a static scene."""
+        return self._frame_static
+
+    def effective_fps(self, fps):
+        """
+        Get the frame rate a live track should send at: its own rate, or
+        VIDEO_IDLE_FPS while the scene is static.
+        """
+        if self._frame_static:
+            return min(fps, VIDEO_IDLE_FPS)
+        return fps
+
+    def is_open(self):
+        """Check whether the capture device is currently open."""
+        return self._cap is not None and self._cap.isOpened()
+
+    def is_standby(self):
+        """Check whether the device is open with no subscribers, waiting to be released."""
+        return self._standby
+
+    def subscribe(self):
+        """
+        Register a new consumer of the capture, opening the device on first use.
+
+        Raises:
+            RuntimeError: If the webcam could not be opened
+        """
+        with self._subscribe_lock:
+            self._cancel_release()
+            self._reclaim_capture()
+            if not self.is_open():
+                self._initialize_webcam()
+            elif self._standby:
+                logger.info("Resuming webcam from standby")
+            self._standby = False
+            self._start_capture()
+            self._subscribers += 1
+            logger.info(f"Camera subscriber added ({self._subscribers} active)")
+
+    def unsubscribe(self):
+        """
+        Remove a consumer. Once nobody is watching the device goes into warm
+        standby, and is released if nobody subscribes within idle_timeout.
+        """
+        with self._subscribe_lock:
+            if self._subscribers == 0:
+                return
+            self._subscribers -= 1
+            logger.info(f"Camera subscriber removed ({self._subscribers} active)")
+            if self._subscribers == 0:
+                if self.idle_timeout > 0 and self.is_open():
+                    self._enter_standby()
+                else:
+                    self.release()
+
+    def _enter_standby(self):
+        """Keep the device open without processing frames, and schedule its release."""
+        self._standby = True
+        with self._lock:
+            # A returning subscriber must wait for a fresh frame, not get one from before the standby
+            self._frame = None
+
+        self._release_timer = threading.Timer(self.idle_timeout, self._release_if_idle)
+        self._release_timer.daemon = True
+        self._release_timer.start()
+        logger.info(f"No camera subscribers, keeping the webcam warm for {self.idle_timeout:.0f}s")
+
+    def _release_if_idle(self):
+        """Release the device if the standby was not ended by a new subscriber. Runs on the timer thread."""
+        with self._subscribe_lock:
+            if self._subscribers == 0 and self._standby:
+                logger.info("Webcam idle timeout reached")
+                self.release()
+
+    def _cancel_release(self):
+        if self._release_timer is not None:
+            self._release_timer.cancel()
+            self._release_timer = None
+
+    def release(self):
+        """
+        Stop the capture thread and release the capture device. If the thread
+        does not stop in time, it releases the device itself when it exits,
+        so the device is never released under a running read.
+        """
+        self._cancel_release()
+        self._standby = False
+        self._stop_capture()
+        with self._release_lock:
+            if not self._capture_done:
+                self._release_pending = True
+                logger.warning("Capture thread is still busy, it will release the webcam when it stops")
+                return
+        self._release_device()
+
+    def _reclaim_capture(self):
+        """
+        Take back the device from a capture thread that is still stopping after
+        a release timed out: cancel the handed-over release and wait for the
+        thread to finish. A device it released meanwhile is opened again.
+        """
+        with self._release_lock:
+            self._release_pending = False
+        if self._thread is not None and not self._running:
+            self._thread.join()
+            self._thread = None
+
+    def _release_device(self):
+        """Release the capture device and the preprocessing workers."""
+        self._stop_preprocessor()
+        if self._cap is not None:
+            self._cap.release()
+            self._cap = None
+            self._frame = None
+            self._error = None
+            self._scaled.clear()
+            self._jpeg = None
+            logger.info("Webcam released")
+
+    def _initialize_webcam(self):
+        """Attempt to initialize the webcam with retry logic and device discovery."""
+        # Pick the best device once, on first open
+        if self._device_id is None:
+            logger.info("No device ID provided, searching for best webcam device...")
+            self._device_id = get_best_webcam_device(self.width, self.height)
+            logger.info(f"Selected best webcam device ID: {self._device_id}")
+
+        logger.info(f"Attempting to open webcam with device ID: {self._device_id}")
+
+        # Release any existing capture if it exists
+        if self._cap is not None:
+            self._cap.release()
+            logger.info("Released existing webcam capture")
+
+        # Try to connect with the specified device ID
+        self._cap = cv2.VideoCapture(self._device_id)
+
+        # If that fails, try to find an available webcam by scanning other device IDs
+        if not self._cap.isOpened():
+            logger.warning(f"Failed to open webcam with device ID: {self._device_id}")
+
+            # Try a few different device IDs
+            for device_id in range(10):  # Try devices 0-9
+                if device_id == self._device_id:
+                    continue  # Skip the one we already tried
+
+                logger.info(f"Trying alternative webcam device ID: {device_id}")
+                self._cap = cv2.VideoCapture(device_id)
+
+                if self._cap.isOpened():
+                    logger.info(f"Successfully opened webcam with alternative device ID: {device_id}")
+                    self._device_id = device_id
+                    break
+                else:
+                    self._cap.release()
+
+        # If we still couldn't open a webcam, raise an error
+        if not self._cap.isOpened():
+            logger.error("Failed to open any webcam device")
+            self._cap = None
+            raise RuntimeError("Could not open webcam with any available device ID")
+
+        # Add a small delay after opening to ensure the device is ready
+        time.sleep(1.0)
+
+        # Negotiate the pixel format before the resolution, as it limits the available sizes
+        self._fourcc = self._negotiate_pixel_format()
+
+        # Set webcam properties
+        self._cap.set(cv2.CAP_PROP_FRAME_WIDTH, self.width)
+        self._cap.set(cv2.CAP_PROP_FRAME_HEIGHT, self.height)
+        self._cap.set(cv2.CAP_PROP_FPS, self.fps)
+
+        # Try to read a test frame to ensure the camera is working
+        for _ in range(3):  # Try multiple times to get a frame
+            ret, _ = self._cap.read()
+            if ret:
+                break
+            time.sleep(0.2)  # Short delay between attempts
+
+        if not ret:
+            logger.error("Webcam opened but failed to capture test frame")
+            self._cap.release()
+            self._cap = None
+            raise RuntimeError("Webcam opened but failed to capture test frame")
+
+        # Get actual properties (may differ from requested)
+        actual_width = int(self._cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        actual_height = int(self._cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        actual_fps = self._cap.get(cv2.CAP_PROP_FPS)
+
+        self._converter = FrameConverter(self._fourcc, actual_width, actual_height, self.width, self.height)
+
+        logger.info(f"Webcam initialized with device ID {self._device_id}")
+        logger.info(f"Requested resolution: {self.width}x{self.height}, fps: {self.fps}")
+        logger.info(f"Actual resolution: {actual_width}x{actual_height}, fps: {actual_fps}")
+        logger.info(f"Capture pixel format: {self._fourcc or 'BGR (OpenCV conversion)'}")
+
+        self._start_preprocessor(actual_width, actual_height)
+
+    def _start_preprocessor(self, capture_width, capture_height):
+        """
+        Start the preprocessing workers for the capture format, reusing running
+        workers if the format is unchanged (e.g. after a reconnect). If they
+        cannot be started, frames are converted on the capture thread.
+        """
+        if self.preprocess_workers <= 0:
+            return
+
+        args = (self._fourcc, capture_width, capture_height, self.width, self.height)
+        if self._preprocessor is not None:
+            if self._preprocessor.is_running() and self._preprocessor.matches(*args):
+                return
+            self._stop_preprocessor()
+
+        preprocessor = FramePreprocessor(*args, workers=self.preprocess_workers, callback=self._on_preprocessed)
+        try:
+            preprocessor.start()
+            self._preprocessor = preprocessor
+        except Exception as e:
+            logger.warning(f"Could not start frame preprocessing workers, converting on the capture thread: {e}")
+
+    def _stop_preprocessor(self):
+        if self._preprocessor is not None:
+            self._preprocessor.close()
+            self._preprocessor = None
+
+    def _negotiate_pixel_format(self):
+        """
+        Ask the camera for a native pixel format so frames can be handed to
+        the encoder as planar YUV without converting through BGR.
+
+        Returns:
+            The FOURCC in use, or None if falling back to OpenCV's BGR conversion
+        """
+        supported = None
+        capabilities = get_capability_cache().get_cached_device(self._device_id)
+        if capabilities and capabilities.get('fourccs'):
+            # Only the formats the camera delivers this resolution in
+            supported = fourccs_for_resolution(capabilities, self.width, self.height)
+
+        fourcc = negotiate_fourcc(self.width, self.height, supported, VIDEO_PIXEL_FORMAT)
+        if fourcc is None:
+            self._cap.set(cv2.CAP_PROP_CONVERT_RGB, 1)
+            return None
+
+        self._cap.set(cv2.CAP_PROP_FOURCC, fourcc_code(fourcc))
+        if fourcc_name(self._cap.get(cv2.CAP_PROP_FOURCC)) != fourcc or not self._cap.set(cv2.CAP_PROP_CONVERT_RGB, 0):
+            logger.warning(f"Camera did not accept {fourcc} raw capture, falling back to BGR conversion")
+            self._cap.set(cv2.CAP_PROP_CONVERT_RGB, 1)
+            return None
+
+        return fourcc
+
+    def _read_frame(self):
+        """
+        Read one frame from the device, reconnecting if the read fails.
+        The frame is converted, scaled and overlaid here so subscribers can use it as-is.
+
+        Returns:
+            VideoFrame in yuv420p (native capture) or bgr24 (OpenCV conversion),
+            or None if the captured buffer could not be decoded
+        """
+        raw, capture_time = self._read_raw()
+        try:
+            frame = self._converter.convert(raw)
+        except Exception as e:
+            # A corrupt buffer (e.g. a truncated MJPEG image) only costs this frame
+            logger.debug(f"Skipping undecodable frame: {e}")
+            self.frames_corrupt += 1
+            return None
+        return self._finish_frame(frame, capture_time)
+
+    def _read_raw(self):
+        """
+        Read one raw buffer from the device, reconnecting if the read fails.
+
+        Returns:
+            Tuple of (raw buffer, capture time in time.monotonic() seconds)
+        """
+        if not self.is_open():
+            logger.warning("Webcam connection lost, attempting to reconnect...")
+            self._reconnect()
+
+        ret, raw = self._cap.read()
+
+        if not ret:
+            logger.warning("Failed to capture frame, attempting to reconnect...")
+            self._reconnect()
+            ret, raw = self._cap.read()
+            if not ret:
+                raise RuntimeError("Still failed to capture frame after reconnect")
+
+        return raw, self._buffer_timestamp(time.monotonic())
+
+    def _reconnect(self):
+        """
+        Reopen the device from the capture thread. This holds the subscribe lock,
+        so a subscribe() cannot see the device closed and open it at the same time.
+        The lock is polled so a release that is stopping this thread is not held up.
+
+        Raises:
+            RuntimeError: If the capture is stopped meanwhile, or the webcam cannot be opened
+        """
+        while not self._subscribe_lock.acquire(timeout=0.1):
+            if not self._running:
+                raise RuntimeError("Capture stopped while waiting to reconnect")
+        try:
+            if not self._running:
+                raise RuntimeError("Capture stopped while waiting to reconnect")
+            self._initialize_webcam()
+        finally:
+            self._subscribe_lock.release()
+
+    def _finish_frame(self, frame, capture_time):
+        """
+        Run scene detection, draw the overlay and stamp a converted frame.
+        Frames must be finished in capture order.
+        """
+        # Look for changes before the overlay adds its ticking timestamp
+        if self._scene is not None:
+            self._scene.update(frame, capture_time)
+        self._overlay.apply(frame)
+
+        pts = clock_pts(capture_time)
+        if self._last_pts is not None and pts <= self._last_pts:
+            pts = self._last_pts + 1
+        self._last_pts = pts
+        frame.pts = pts
+        frame.time_base = VIDEO_TIME_BASE
+        return frame
+
+    def _buffer_timestamp(self, read_time):
+        """
+        Get the time the driver filled the last buffer.
+
+        V4L2 stamps buffers on the monotonic clock when the frame is captured,
+        which is earlier and steadier than when read() returns. The read time
+        is used when the backend reports no usable timestamp.
+
+        Args:
+            read_time: time.monotonic() just after read() returned
+
+        Returns:
+            Capture time in time.monotonic() seconds
+        """
+        buffer_time = self._cap.get(cv2.CAP_PROP_POS_MSEC) / 1000.0
+        if buffer_time > 0 and 0 <= read_time - buffer_time < MAX_BUFFER_AGE:
+            return buffer_time
+        return read_time
+
+    def _start_capture(self):
+        """Start the background capture thread if it is not already running."""
+        if self._thread and self._thread.is_alive():
+            return
+
+        self._running = True
+        self._capture_done = False
+        self._thread = threading.Thread(target=self._capture_loop, name="CameraCapture")
+        self._thread.daemon = True
+        self._thread.start()
+        logger.info("Camera capture thread started")
+
+    def _stop_capture(self):
+        """Stop the background capture thread, waiting up to 2s for it to finish its current read."""
+        self._running = False
+        if self._thread:
+            self._thread.join(timeout=2.0)
+            if self._thread.is_alive():
+                return
+            self._thread = None
+            logger.info("Camera capture thread stopped")
+
+    def _capture_loop(self):
+        """
+        Background thread that reads frames as fast as the camera delivers them.
+        Only the newest frame is kept; a frame replaced before any subscriber
+        picked it up is counted as dropped.
+        """
+        try:
+            self._run_capture()
+        finally:
+            with self._release_lock:
+                self._capture_done = True
+                release = self._release_pending
+                self._release_pending = False
+            if release:
+                self._release_device()
+
+    def _run_capture(self):
+        """Read frames until the capture is stopped."""
+        while self._running:
+            if self._standby:
+                # Keep the device streaming so a returning subscriber gets a fresh frame
+                # within one frame interval, but skip retrieving and converting frames
+                if not self._cap.grab():
+                    time.sleep(0.1)
+                continue
+
+            try:
+                if self._preprocessor is not None and self._preprocessor.is_running():
+                    # Workers convert the buffer; the collector thread publishes it
+                    raw, capture_time = self._read_raw()
+                    if not self._preprocessor.submit(raw, capture_time):
+                        with self._lock:
+                            self.frames_dropped += 1
+                    continue
+                frame = self._read_frame()
+            except Exception as e:
+                logger.error(f"Error capturing webcam frame: {e}")
+                with self._lock:
+                    self._error = e
+                    self._frame_ready.notify_all()
+                self._notify_waiters()
+                time.sleep(1)  # Give the device time before retrying
+                continue
+
+            if frame is None or self._standby:
+                continue
+            self._publish(frame)
+
+    def _on_preprocessed(self, frame, capture_time):
+        """Finish and publish a frame converted by the preprocessing workers. Runs on the collector thread."""
+        if frame is None:
+            self.frames_corrupt += 1
+            return
+        frame = self._finish_frame(frame, capture_time)
+        if not self._standby:
+            self._publish(frame)
+
+    def _publish(self, frame):
+        """Make a finished frame the latest one and wake everything waiting for it."""
+        with self._lock:
+            if not self._frame_consumed:
+                self.frames_dropped += 1
+            self._frame = frame
+            self._frame_seq += 1
+            self._frame_consumed = False
+            self._frame_static = self._scene is not None and self._scene.static
+            self._error = None
+            self.frames_captured += 1
+            if self._frame_static:
+                self.frames_static += 1
+            self._frame_ready.notify_all()
+        self._notify_waiters()
+
+    def _notify_waiters(self):
+        """Wake coroutines waiting in get_frame(). Safe to call from any thread."""
+        loop = self._loop
+        if loop is not None and not loop.is_closed():
+            loop.call_soon_threadsafe(self._wake_waiters)
+
+    def _wake_waiters(self):
+        """Resolve every pending get_frame() future. Runs on the event loop."""
+        waiters, self._waiters = self._waiters, []
+        for waiter in waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+
+    def _take_frame(self, last_seq):
+        """Return (seq, frame) if a frame newer than last_seq is buffered, else None."""
+        with self._lock:
+            if self._frame is not None and self._frame_seq > last_seq:
+                self._frame_consumed = True
+                return self._frame_seq, self._frame
+            if self._error is not None:
+                raise RuntimeError(f"Webcam capture failed: {self._error}")
+            return None
+
+    def wait_frame(self, last_seq=0, timeout=None):
+        """
+        Blocking counterpart of get_frame() for worker threads.
+        Frames taken this way do not count as consumed for the dropped-frame
+        statistics, which describe the live tracks.
+
+        Args:
+            last_seq (int): Sequence number of the last frame the caller received
+            timeout (float, optional): Seconds to wait for a new frame
+
+        Returns:
+            Tuple of (sequence number, VideoFrame), or None on timeout. The frame
+            is shared and must not be modified.
+
+        Raises:
+            RuntimeError: If the capture thread is failing to read frames
+        """
+        def ready():
+            return (self._frame is not None and self._frame_seq > last_seq) or self._error is not None
+
+        with self._frame_ready:
+            if not self._frame_ready.wait_for(ready, timeout):
+                return None
+            if self._frame is not None and self._frame_seq > last_seq:
+                return self._frame_seq, self._frame
+            raise RuntimeError(f"Webcam capture failed: {self._error}")
+
+    async def get_scaled_frame(self, seq, frame, width, height):
+        """
+        Get a captured frame scaled to another size, scaling it only once for
+        all subscribers that asked for the same size. Scaling runs in the
+        default executor so it does not block the event loop.
+
+        Args:
+            seq (int): Sequence number of the frame
+            frame: The frame as returned by get_frame()
+            width: Output width
+            height: Output height
+
+        Returns:
+            yuv420p VideoFrame with the same timestamp
+        """
+        key = (width, height)
+        cached = self._scaled.get(key)
+        if cached is None or cached[0] != seq:
+            loop = asyncio.get_running_loop()
+            future = loop.run_in_executor(None, to_output_frame, frame, width, height)
+            cached = (seq, future)
+            self._scaled[key] = cached
+        return await asyncio.shield(cached[1])
+
+    async def get_snapshot(self, quality):
+        """
+        Get the latest captured frame as a JPEG. The encoding runs in the
+        default executor and is cached, so any number of requests for the
+        same frame encode it only once.
+
+        Args:
+            quality: JPEG quality (0-100)
+
+        Returns:
+            Tuple of (VideoFrame, JPEG bytes)
+
+        Raises:
+            RuntimeError: If the capture thread is failing to read frames
+        """
+        with self._lock:
+            seq, frame = self._frame_seq, self._frame
+        if frame is None:
+            seq, frame = await self.get_frame(seq)
+
+        cached = self._jpeg
+        if cached is None or cached[0] != seq or cached[1] != quality:
+            loop = asyncio.get_running_loop()
+            cached = (seq, quality, frame, loop.run_in_executor(None, encode_jpeg, frame, quality))
+            self._jpeg = cached
+        return cached[2], await asyncio.shield(cached[3])
+
+    def get_stats(self):
+        """Get capture statistics."""
+        with self._lock:
+            return {
+                'frames_captured': self.frames_captured,
+                'frames_dropped': self.frames_dropped,
+                'frames_corrupt': self.frames_corrupt,
+                'frames_static': self.frames_static,
+                'open': self.is_open(),
+                'standby': self._standby,
+                'subscribers': self._subscribers,
+                'preprocess': self._preprocessor.get_stats() if self._preprocessor is not None else None
+            }
+
+    async def get_frame(self, last_seq=0):
+        """
+        Wait for a frame newer than the one a subscriber has already seen.
+
+        Frames are produced by the capture thread, so this never blocks the
+        event loop; it only waits until a fresh frame is available.
+
+        Args:
+            last_seq (int): Sequence number of the last frame the caller received
+
+        Returns:
+            Tuple of (sequence number, VideoFrame). The frame, including its
+            capture timestamp, is shared between subscribers and must not be
+            modified.
+
+        Raises:
+            RuntimeError: If the capture thread is failing to read frames
+        """
+        self._loop = asyncio.get_running_loop()
+
+        while True:
+            result = self._take_frame(last_seq)
+            if result is not None:
+                return result
+
+            waiter = self._loop.create_future()
+            self._waiters.append(waiter)
+            # Re-check in case a frame arrived before the waiter was registered
+            result = self._take_frame(last_seq)
+            if result is not None:
+                waiter.cancel()
+                return result
+            await waiter
+
+
+def get_camera_source(device_id=None):
+    """
+    Get the process-wide camera source, creating it on first use.
+
+    Args:
+        device_id: Webcam device ID to use when the source is first created.
+                   If None, the best device is detected when the camera is opened.
+
+    Returns:
+        The shared CameraSource instance
+    """
+    global _shared_source
+    if _shared_source is None:
+        _shared_source = CameraSource(device_id=device_id)
+    return _shared_source
@@ -0,0 +1,69 @@
+import logging
+
+logger = logging.getLogger("DataChannel")
+
+# Labels of the data channels negotiated alongside the video track
+COMMAND_CHANNEL = "commands"
+TELEMETRY_CHANNEL = "telemetry"
+
+# Largest message sent over a data channel (aiortc's SCTP limit); larger ones go over the websocket
+MAX_MESSAGE_SIZE = 65536
+
+# Telemetry is dropped rather than queued while this many bytes are still waiting on a channel
+TELEMETRY_MAX_BUFFERED = 16384
+
+
+def create_data_channels(pc):
+    """
+    Create the command and telemetry channels on a peer connection.
+
+    Commands are reliable and ordered. Telemetry is unordered and never
+    retransmitted, so a lost sample is skipped instead of holding back the
+    newer ones behind it.
+
+    Returns:
+        List of the created RTCDataChannels
+    """
+    return [
+        pc.createDataChannel(COMMAND_CHANNEL, ordered=True),
+        pc.createDataChannel(TELEMETRY_CHANNEL, ordered=False, maxRetransmits=0)
+    ]
+
+
+def fits_channel(channel, message):
+    """Check whether a message can be sent on a data channel right now."""
+    return channel.readyState == "open" and len(message.encode("utf-8")) <= MAX_MESSAGE_SIZE
+
+
+def channel_sender(channel, fallback):
+    """
+    Get a send function that uses a data channel while it is open and the
+    message fits, and a fallback (the websocket) otherwise.
+
+    Args:
+        channel: RTCDataChannel to prefer
+        fallback: Coroutine function sending a message another way
+
+    Returns:
+        Coroutine function send(message)
+    """
+    async def send(message):
+        if fits_channel(channel, message):
+            channel.send(message)
+        else:
+            await fallback(message)
+
+    return send
+
+
+def send_unreliable(channel, message):
+    """
+    Send a message on an unreliable channel unless it is backed up.
+
+    Returns:
+        True if the message was sent, False if it was dropped
+    """
+    if not fits_channel(channel, message) or channel.bufferedAmount > TELEMETRY_MAX_BUFFERED:
+        return False
+    channel.send(message)
+    return True
@@ -0,0 +1,68 @@
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+from piboat.config import VIDEO_SETUP_TIMEOUT
+
+logger = logging.getLogger("DeviceExecutor")
+
+# A single thread runs every blocking video device call (probing, opening, releasing)
+# so they happen in the order they were requested and never on the event loop
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="VideoDevice")
+
+
+def submit_blocking(func, *args):
+    """
+    Queue a blocking video device call without waiting for it, e.g. from a
+    synchronous stop(). Errors are logged.
+    """
+    def log_error(future):
+        if not future.cancelled() and future.exception() is not None:
+            logger.error(f"Error in {getattr(func, '__qualname__', func)}: {future.exception()}")
+
+    _executor.submit(func, *args).add_done_callback(log_error)
+
+
+async def subscribe_source(source, timeout=VIDEO_SETUP_TIMEOUT):
+    """
+    Subscribe to a CameraSource on the device thread, opening the webcam if needed.
+
+    If the open takes longer than timeout the caller gets an error straight
+    away, and the subscription is handed back as soon as the open completes,
+    so a slow camera cannot leak a subscriber.
+
+    Raises:
+        RuntimeError: If the webcam could not be opened in time
+    """
+    future = _executor.submit(source.subscribe)
+    try:
+        await asyncio.wait_for(asyncio.wrap_future(future), timeout)
+    except asyncio.TimeoutError:
+        _release_late(source, future)
+        raise RuntimeError(f"Timed out after {timeout:g}s opening the webcam")
+
+
+def subscribe_source_blocking(source, timeout=VIDEO_SETUP_TIMEOUT):
+    """
+    Subscribe to a CameraSource on the device thread from another thread
+    (e.g. the recorder), waiting for the open like subscribe_source().
+
+    Raises:
+        RuntimeError: If the webcam could not be opened in time
+    """
+    future = _executor.submit(source.subscribe)
+    try:
+        future.result(timeout)
+    except FutureTimeoutError:
+        _release_late(source, future)
+        raise RuntimeError(f"Timed out after {timeout:g}s opening the webcam")
+
+
+def _release_late(source, future):
+    """Hand back a subscription whose open completes after the caller gave up on it."""
+    def release(done):
+        if not done.cancelled() and done.exception() is None:
+            logger.info("Webcam opened after the setup timed out, releasing the subscription")
+            submit_blocking(source.unsubscribe)
+
+    future.add_done_callback(release)
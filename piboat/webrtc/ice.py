@@ -0,0 +1,163 @@
+import asyncio
+import fnmatch
+import ipaddress
+import logging
+
+import ifaddr
+from aiortc.sdp import candidate_from_sdp, candidate_to_sdp
+
+from piboat.config import VIDEO_ICE_EXCLUDE_INTERFACES, VIDEO_ICE_LINK_LOCAL
+
+logger = logging.getLogger("ICE")
+
+
+def get_interface_addresses():
+    """
+    Map every local IP address to the name of its network interface.
+
+    Returns:
+        Dict of {address: interface name}
+    """
+    addresses = {}
+    for adapter in ifaddr.get_adapters():
+        for ip in adapter.ips:
+            address = ip.ip if isinstance(ip.ip, str) else ip.ip[0]
+            addresses[address] = adapter.nice_name
+    return addresses
+
+
+def is_excluded_address(address, interfaces, exclude_patterns=VIDEO_ICE_EXCLUDE_INTERFACES,
+                        allow_link_local=VIDEO_ICE_LINK_LOCAL):
+    """
+    Check whether candidates on a local address should be dropped.
+
+    Args:
+        address: Local IP address of the candidate
+        interfaces: Address to interface name map from get_interface_addresses()
+        exclude_patterns: Interface name patterns to drop (e.g. "docker*")
+        allow_link_local: Whether to keep link-local addresses (169.254.0.0/16, fe80::/10)
+    """
+    try:
+        if not allow_link_local and ipaddress.ip_address(address.split("%")[0]).is_link_local:
+            return True
+    except ValueError:
+        return False
+
+    name = interfaces.get(address)
+    return name is not None and any(fnmatch.fnmatch(name, pattern) for pattern in exclude_patterns)
+
+
+def _ice_gatherers(pc):
+    """Get the distinct ICE gatherers of a peer connection's transports."""
+    gatherers = []
+    transports = [t.sender.transport for t in pc.getTransceivers()]
+    if pc.sctp is not None:
+        transports.append(pc.sctp.transport)
+    for transport in transports:
+        gatherer = transport.transport.iceGatherer
+        if gatherer not in gatherers:
+            gatherers.append(gatherer)
+    return gatherers
+
+
+async def gather_candidates(pc):
+    """
+    Gather a peer connection's local ICE candidates ahead of setLocalDescription
+    and drop those on excluded interfaces (container bridges, link-local addresses).
+
+    aiortc gathers every host address and sends all candidates in the SDP, so
+    a Pi with docker bridges and a USB modem advertises, and runs connectivity
+    checks on, addresses the viewer can never reach. Pruning them here removes
+    them from both. setLocalDescription then finds gathering already complete.
+
+    Returns:
+        Tuple (candidates kept, candidates dropped)
+    """
+    gatherers = _ice_gatherers(pc)
+    await asyncio.gather(*(gatherer.gather() for gatherer in gatherers))
+
+    interfaces = get_interface_addresses()
+    kept = dropped = 0
+    for gatherer in gatherers:
+        try:
+            dropped += _prune_candidates(gatherer, interfaces)
+        except Exception as e:
+            # Filtering relies on aioice internals (pinned in requirements.txt); never let it break an offer
+            logger.warning(f"Could not filter ICE candidates, keeping them all: {e}")
+        kept += len(gatherer.getLocalCandidates())
+
+    if dropped:
+        logger.info(f"Dropped {dropped} ICE candidates on excluded interfaces, kept {kept}")
+    return kept, dropped
+
+
+def _prune_candidates(gatherer, interfaces):
+    """
+    Drop a gatherer's candidates on excluded interfaces and close their sockets.
+
+    aiortc does not expose candidate filtering, so this prunes the aioice
+    connection's candidate and protocol lists directly.
+
+    Returns:
+        Number of candidates dropped
+    """
+    connection = gatherer._connection
+    candidates = connection._local_candidates
+    protocols = connection._protocols
+    if not isinstance(candidates, list) or not isinstance(protocols, list):
+        raise TypeError("unexpected aioice connection layout")
+
+    excluded = set()
+    for candidate in candidates:
+        base = candidate.host if candidate.type == "host" else candidate.related_address
+        if candidate.type != "relay" and base and is_excluded_address(base, interfaces):
+            excluded.add(base)
+
+    if excluded and all(c.host in excluded or c.related_address in excluded for c in candidates):
+        # Better a bridge address than no way to connect at all
+        logger.warning("Every ICE candidate is on an excluded interface, keeping them all")
+        return 0
+    if not excluded:
+        return 0
+
+    remaining = [c for c in candidates if (c.host if c.type == "host" else c.related_address) not in excluded]
+    closing = [p for p in protocols if p.local_candidate.host in excluded]
+    connection._local_candidates = remaining
+
+    # Close the sockets bound to the excluded addresses so they are not used for checks
+    for protocol in closing:
+        protocols.remove(protocol)
+        protocol.transport.close()
+    return len(candidates) - len(remaining)
+
+
+def parse_candidate(data):
+    """
+    Convert a candidate received from a browser into an RTCIceCandidate.
+
+    Args:
+        data: Dict with "candidate", "sdpMid" and "sdpMLineIndex" as produced
+              by RTCIceCandidate.toJSON() in the browser
+
+    Returns:
+        RTCIceCandidate, or None for an end-of-candidates marker
+    """
+    sdp = (data.get("candidate") or "").strip()
+    if not sdp:
+        return None
+    if sdp.startswith("candidate:"):
+        sdp = sdp[len("candidate:"):]
+
+    candidate = candidate_from_sdp(sdp)
+    candidate.sdpMid = data.get("sdpMid")
+    candidate.sdpMLineIndex = data.get("sdpMLineIndex")
+    return candidate
+
+
+def candidate_to_json(candidate):
+    """Convert an RTCIceCandidate into the dict form browsers accept."""
+    return {
+        "candidate": f"candidate:{candidate_to_sdp(candidate)}",
+        "sdpMid": candidate.sdpMid or "",
+        "sdpMLineIndex": candidate.sdpMLineIndex or 0
+    }
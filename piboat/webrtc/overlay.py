@@ -0,0 +1,189 @@
+import logging
+import time
+from datetime import datetime
+
+import cv2
+import numpy
+
+from piboat.config import VIDEO_HUD
+from piboat.webrtc.pixel_format import plane_view
+
+logger = logging.getLogger("VideoOverlay")
+
+# How often the telemetry HUD polls for new values, in seconds
+HUD_POLL_INTERVAL = 0.2
+
+OVERLAY_FONT = cv2.FONT_HERSHEY_SIMPLEX
+
+# Callable returning the boat status for the HUD (TelemetryGenerator.get_current_status)
+_telemetry_provider = None
+
+
+def set_telemetry_provider(provider):
+    """
+    Set the source of the values shown by the telemetry HUD.
+
+    Args:
+        provider: Callable returning a dict with heading, speed, throttle and
+                  rudder_position, or None to blank the HUD
+    """
+    global _telemetry_provider
+    _telemetry_provider = provider
+
+
+def format_hud(status):
+    """
+    Format boat status for the HUD line.
+    Values are rounded to what is displayed, so the text (and the cached
+    raster) only changes when a visible digit changes.
+    """
+    def fmt(value, spec):
+        return "---" if value is None else format(value, spec)
+
+    return (f"HDG {fmt(status.get('heading'), '03.0f')}  "
+            f"SPD {fmt(status.get('speed'), '.1f')}kn  "
+            f"THR {fmt(status.get('throttle'), '.0f')}%  "
+            f"RUD {fmt(status.get('rudder_position'), '+.0f')}")
+
+
+class TextOverlay:
+    """
+    A line of text rasterized once per text change and alpha-blended into
+    the matching region of each frame. Works on bgr24 and yuv420p frames.
+    """
+    def __init__(self, origin, font_scale=0.8, thickness=2, color=(255, 255, 255)):
+        """
+        Args:
+            origin: Bottom-left corner of the text, as for cv2.putText
+            font_scale: Font scale
+            thickness: Stroke thickness
+            color: Text colour (BGR)
+        """
+        self.origin = origin
+        self.font_scale = font_scale
+        self.thickness = thickness
+        self.color = color
+        self.text = None
+        self.renders = 0
+        self._raster = None
+
+    def set_text(self, text):
+        """Change the text, re-rasterizing only if it differs."""
+        if text == self.text:
+            return
+        self.text = text
+        self._raster = self._rasterize(text) if text else None
+        self.renders += 1
+
+    def _rasterize(self, text):
+        """
+        Render the text into an alpha mask and precompute the blend terms
+        for every supported frame format.
+        """
+        (text_width, text_height), baseline = cv2.getTextSize(text, OVERLAY_FONT, self.font_scale, self.thickness)
+        pad = self.thickness + 1
+
+        # Keep the region on even coordinates so it maps exactly onto 4:2:0 chroma
+        x = max(0, (self.origin[0] - pad) & ~1)
+        y = max(0, (self.origin[1] - text_height - pad) & ~1)
+        width = (self.origin[0] - x + text_width + pad + 1) & ~1
+        height = (self.origin[1] - y + baseline + pad + 1) & ~1
+
+        mask = numpy.zeros((height, width), dtype=numpy.uint8)
+        cv2.putText(mask, text, (self.origin[0] - x, self.origin[1] - y),
+                    OVERLAY_FONT, self.font_scale, 255, self.thickness, cv2.LINE_AA)
+
+        # Blend terms: out = (fg * alpha + bg * (255 - alpha)) / 255, all within uint16
+        alpha = mask.astype(numpy.uint16)
+        bgr = numpy.array(self.color, dtype=numpy.uint16)
+        yuv = cv2.cvtColor(numpy.array([[self.color]], dtype=numpy.uint8), cv2.COLOR_BGR2YUV)[0, 0].astype(numpy.uint16)
+        chroma_alpha = alpha.reshape(height // 2, 2, width // 2, 2).mean(axis=(1, 3)).astype(numpy.uint16)
+
+        return {
+            'x': x,
+            'y': y,
+            'width': width,
+            'height': height,
+            'bgr_fg': alpha[:, :, None] * bgr,
+            'bgr_inv': (255 - alpha)[:, :, None],
+            'y_fg': alpha * yuv[0],
+            'y_inv': 255 - alpha,
+            'u_fg': chroma_alpha * yuv[1],
+            'v_fg': chroma_alpha * yuv[2],
+            'uv_inv': 255 - chroma_alpha
+        }
+
+    @staticmethod
+    def _blend(region, fg, inv):
+        """Alpha-blend precomputed foreground terms into a region of a plane, in place."""
+        h, w = region.shape[:2]
+        fg = fg[:h, :w]
+        inv = inv[:h, :w]
+        region[:] = (region * inv + fg + 127) // 255
+
+    def blend(self, frame):
+        """Composite the text into a VideoFrame in place."""
+        raster = self._raster
+        if raster is None:
+            return
+
+        x, y, width, height = raster['x'], raster['y'], raster['width'], raster['height']
+        if x >= frame.width or y >= frame.height:
+            return
+
+        format_name = frame.format.name
+        if format_name == "bgr24":
+            plane = plane_view(frame.planes[0], channels=3)
+            self._blend(plane[y:y + height, x:x + width], raster['bgr_fg'], raster['bgr_inv'])
+        elif format_name == "yuv420p":
+            y_plane, u_plane, v_plane = (plane_view(p) for p in frame.planes)
+            self._blend(y_plane[y:y + height, x:x + width], raster['y_fg'], raster['y_inv'])
+            cx, cy, cw, ch = x // 2, y // 2, width // 2, height // 2
+            self._blend(u_plane[cy:cy + ch, cx:cx + cw], raster['u_fg'], raster['uv_inv'])
+            self._blend(v_plane[cy:cy + ch, cx:cx + cw], raster['v_fg'], raster['uv_inv'])
+        else:
+            logger.debug(f"Overlay not supported for {format_name} frames")
+
+
+class OverlayCompositor:
+    """
+    Draws the "PiBoat - timestamp" banner and the optional telemetry HUD.
+    Text is only re-rasterized when it changes (once per second for the
+    banner); each frame just blends the cached rasters into their regions.
+    """
+    def __init__(self, hud_enabled=VIDEO_HUD):
+        self._banner = TextOverlay((20, 40))
+        self._banner_second = None
+        self._hud = TextOverlay((20, 70), font_scale=0.6, thickness=2) if hud_enabled else None
+        self._hud_polled = 0
+
+    def _update_banner(self, now):
+        second = int(now)
+        if second != self._banner_second:
+            self._banner_second = second
+            timestamp = datetime.fromtimestamp(second).strftime("%Y-%m-%d %H:%M:%S")
+            self._banner.set_text(f"PiBoat - {timestamp}")
+
+    def _update_hud(self, now):
+        if now - self._hud_polled < HUD_POLL_INTERVAL:
+            return
+        self._hud_polled = now
+
+        provider = _telemetry_provider
+        if provider is None:
+            self._hud.set_text(None)
+            return
+        try:
+            self._hud.set_text(format_hud(provider()))
+        except Exception as e:
+            logger.warning(f"Failed to update telemetry HUD: {e}")
+
+    def apply(self, frame):
+        """Composite all overlay layers into a VideoFrame in place."""
+        now = time.time()
+        self._update_banner(now)
+        self._banner.blend(frame)
+
+        if self._hud is not None:
+            self._update_hud(now)
+            self._hud.blend(frame)
@@ -0,0 +1,157 @@
+import asyncio
+import fractions
+import logging
+import time
+
+logger = logging.getLogger("FramePacing")
+
+# RTP video clock used for frame timestamps
+VIDEO_CLOCK_RATE = 90000
+VIDEO_TIME_BASE = fractions.Fraction(1, VIDEO_CLOCK_RATE)
+
+# Process-wide epoch of the media clock, so every track stamps frames on one timeline
+CLOCK_START = time.monotonic()
+
+# Weight of each new sample in the smoothed jitter and latency (as in RFC 3550)
+SMOOTHING = 1 / 16
+
+# Fraction of a frame interval that must separate kept frames when decimating a capture,
+# so capture jitter does not halve the frame rate
+DECIMATION_SLACK = 0.9
+
+
+def clock_pts(timestamp=None):
+    """
+    Convert a time.monotonic() timestamp to a 90 kHz media clock timestamp.
+
+    Args:
+        timestamp: Monotonic time in seconds (defaults to now)
+    """
+    if timestamp is None:
+        timestamp = time.monotonic()
+    return int((timestamp - CLOCK_START) * VIDEO_CLOCK_RATE)
+
+
+def pts_to_monotonic(pts):
+    """Convert a media clock timestamp back to time.monotonic() seconds."""
+    return CLOCK_START + pts / VIDEO_CLOCK_RATE
+
+
+def frame_due(pts, last_pts, fps, capture_fps=None):
+    """
+    Check whether a captured frame should be kept when reducing the capture to a lower frame rate.
+
+    Args:
+        pts: Media clock timestamp of the captured frame
+        last_pts: Timestamp of the last frame kept, or None if none was
+        fps: Frame rate to reduce to
+        capture_fps: Frame rate of the capture; at or below fps every frame is kept
+
+    Returns:
+        True if the frame should be kept
+    """
+    if last_pts is None or (capture_fps is not None and fps >= capture_fps):
+        return True
+    return pts - last_pts >= DECIMATION_SLACK * VIDEO_CLOCK_RATE / fps
+
+
+class FramePacer:
+    """
+    Releases frames at a fixed rate on the monotonic clock. A consumer that
+    falls more than a frame behind is resynchronised instead of being sent a
+    burst of catch-up frames.
+    """
+    def __init__(self, fps):
+        self.fps = fps
+        self.late_frames = 0
+        self._interval = 1.0 / fps
+        self._next = None
+
+    async def wait(self):
+        """
+        Sleep until the next frame is due.
+
+        Returns:
+            Media clock timestamp of the moment the frame was released
+        """
+        now = time.monotonic()
+        if self._next is None:
+            self._next = now
+
+        delay = self._next - now
+        if delay > 0:
+            await asyncio.sleep(delay)
+        elif -delay > self._interval:
+            self.late_frames += 1
+            self._next = now
+
+        self._next += self._interval
+        return clock_pts()
+
+
+class FrameTimingStats:
+    """
+    Tracks how frames leave a track compared to when they were captured:
+    inter-arrival jitter, capture-to-delivery latency, and drift of that
+    latency above its best value.
+    """
+    def __init__(self):
+        self.frames = 0
+        self.jitter = 0.0
+        self.latency = 0.0
+        self.min_latency = None
+        self.max_latency = 0.0
+        self.drift = 0.0
+        self._first = None
+        self._last = None
+        # Called once when the first frame is recorded
+        self.on_first_frame = None
+
+    def record(self, pts, now=None):
+        """
+        Record a frame handed to the encoder.
+
+        Args:
+            pts: Capture timestamp of the frame on the media clock
+            now: Monotonic delivery time (defaults to now)
+        """
+        if now is None:
+            now = time.monotonic()
+        latency = now - pts_to_monotonic(pts)
+
+        if self._first is None:
+            self._first = (pts, now)
+            self.latency = latency
+            if self.on_first_frame is not None:
+                self.on_first_frame()
+        else:
+            last_pts, last_now = self._last
+            # Difference between the delivery interval and the capture interval
+            deviation = (now - last_now) - (pts - last_pts) / VIDEO_CLOCK_RATE
+            self.jitter += (abs(deviation) - self.jitter) * SMOOTHING
+            self.latency += (latency - self.latency) * SMOOTHING
+
+        # Drift is how far latency has crept above the best seen; a growing value
+        # means frames are delivered progressively later than they were captured
+        if self.min_latency is None or latency < self.min_latency:
+            self.min_latency = latency
+        self.drift = self.latency - self.min_latency
+        self.max_latency = max(self.max_latency, latency)
+        self._last = (pts, now)
+        self.frames += 1
+
+    def get_stats(self):
+        """Get the timing statistics, with times in milliseconds."""
+        fps = 0.0
+        if self.frames > 1:
+            elapsed = self._last[1] - self._first[1]
+            if elapsed > 0:
+                fps = (self.frames - 1) / elapsed
+        return {
+            'frames': self.frames,
+            'fps': round(fps, 2),
+            'jitter_ms': round(self.jitter * 1000, 2),
+            'drift_ms': round(self.drift * 1000, 2),
+            'latency_ms': round(self.latency * 1000, 2),
+            'max_latency_ms': round(self.max_latency * 1000, 2)
+        }
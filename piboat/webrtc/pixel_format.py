@@ -0,0 +1,241 @@
+import logging
+
+import av
+import cv2
+import numpy
+from av import VideoFrame
+
+logger = logging.getLogger("PixelFormat")
+
+# Capture pixel formats (V4L2 FOURCCs) understood by the native pipeline
+FOURCC_MJPEG = "MJPG"
+FOURCC_YUYV = "YUYV"
+
+# Frame area at or above which MJPEG is preferred: raw YUYV at 720p and up
+# exceeds USB 2.0 bandwidth at 30fps, while smaller frames are cheaper to repack than to decode
+MJPEG_MIN_PIXELS = 1280 * 720
+
+# Pixel format handed to the encoders (what VP8/H.264 consume natively)
+OUTPUT_FORMAT = "yuv420p"
+
+
+def negotiate_fourcc(width, height, supported=None, preference="auto"):
+    """
+    Choose the capture pixel format for a resolution.
+
+    Args:
+        width: Capture width
+        height: Capture height
+        supported: FOURCCs the device is known to accept, or None if unknown
+        preference: "auto", "mjpeg", "yuyv" or "bgr" (let OpenCV convert to BGR)
+
+    Returns:
+        FOURCC string, or None to use OpenCV's BGR conversion
+    """
+    preference = preference.lower()
+    if preference == "bgr":
+        return None
+
+    if preference == "mjpeg":
+        candidates = [FOURCC_MJPEG, FOURCC_YUYV]
+    elif preference == "yuyv":
+        candidates = [FOURCC_YUYV, FOURCC_MJPEG]
+    elif width * height >= MJPEG_MIN_PIXELS:
+        candidates = [FOURCC_MJPEG, FOURCC_YUYV]
+    else:
+        candidates = [FOURCC_YUYV, FOURCC_MJPEG]
+
+    for fourcc in candidates:
+        if supported is None or fourcc in supported:
+            return fourcc
+    return None
+
+
+def fourcc_code(fourcc):
+    """Convert a FOURCC string to the integer OpenCV uses."""
+    return cv2.VideoWriter_fourcc(*fourcc)
+
+
+def fourcc_name(code):
+    """Convert an OpenCV FOURCC integer back to its string form."""
+    code = int(code)
+    return "".join(chr((code >> (8 * i)) & 0xFF) for i in range(4))
+
+
+def plane_view(plane, channels=1):
+    """
+    Get a writable numpy view of a VideoFrame plane, without its line padding.
+    Writing through the view fills the frame directly, with no intermediate copy.
+
+    Args:
+        plane: VideoFrame plane
+        channels: Bytes per pixel in the plane (1 for planar YUV, 3 for bgr24)
+
+    Returns:
+        (height, width) array, or (height, width, channels) for packed formats
+    """
+    if channels == 1:
+        return numpy.ndarray((plane.height, plane.width), dtype=numpy.uint8,
+                             buffer=plane, strides=(plane.line_size, 1))
+    return numpy.ndarray((plane.height, plane.width, channels), dtype=numpy.uint8,
+                         buffer=plane, strides=(plane.line_size, channels, 1))
+
+
+def yuyv_to_frame(raw, width, height):
+    """
+    Repack a raw YUYV (4:2:2 packed) buffer into a yuv420p VideoFrame.
+
+    The luma is copied as-is and chroma is taken from every other line,
+    writing straight into the frame planes.
+
+    Args:
+        raw: Raw YUYV buffer as returned by OpenCV with CAP_PROP_CONVERT_RGB disabled
+        width: Frame width
+        height: Frame height
+
+    Returns:
+        VideoFrame in yuv420p
+    """
+    packed = numpy.asarray(raw).reshape(height, width, 2)
+    frame = VideoFrame(width, height, OUTPUT_FORMAT)
+    y_plane, u_plane, v_plane = (plane_view(p) for p in frame.planes)
+
+    # Each YUYV pixel pair is laid out as Y0 U Y1 V
+    y_plane[:] = packed[:, :, 0]
+    u_plane[:] = packed[0::2, 0::2, 1]
+    v_plane[:] = packed[0::2, 1::2, 1]
+    return frame
+
+
+def bgr_to_frame(img, width, height):
+    """
+    Build a VideoFrame from a BGR image (the legacy OpenCV-converted path).
+
+    Args:
+        img: BGR image
+        width: Output width
+        height: Output height
+
+    Returns:
+        VideoFrame in bgr24
+    """
+    if img.shape[1] != width or img.shape[0] != height:
+        img = cv2.resize(img, (width, height))
+    return VideoFrame.from_ndarray(img, format="bgr24")
+
+
+def to_output_frame(frame, width, height):
+    """
+    Scale and convert a decoded frame to the encoder format in a single libswscale pass.
+    Frames that are already yuv420p at the right size are returned unchanged.
+    """
+    if frame.format.name == OUTPUT_FORMAT and frame.width == width and frame.height == height:
+        return frame
+    return frame.reformat(width=width, height=height, format=OUTPUT_FORMAT)
+
+
+def copy_frame(frame):
+    """
+    Copy a bgr24 or planar YUV VideoFrame, including its timestamp, so it can be
+    modified without affecting other users of the original.
+    """
+    channels = 3 if frame.format.name == "bgr24" else 1
+    copy = VideoFrame(frame.width, frame.height, frame.format.name)
+    for src, dst in zip(frame.planes, copy.planes):
+        numpy.copyto(plane_view(dst, channels), plane_view(src, channels))
+    copy.pts = frame.pts
+    copy.time_base = frame.time_base
+    return copy
+
+
+def encode_jpeg(frame, quality):
+    """
+    Encode a VideoFrame as a JPEG image.
+
+    Args:
+        frame: VideoFrame in any format PyAV can convert to bgr24
+        quality: JPEG quality (0-100)
+
+    Returns:
+        JPEG bytes
+
+    Raises:
+        RuntimeError: If encoding fails
+    """
+    ok, jpeg = cv2.imencode(".jpg", frame.to_ndarray(format="bgr24"), [cv2.IMWRITE_JPEG_QUALITY, int(quality)])
+    if not ok:
+        raise RuntimeError("Failed to encode JPEG")
+    return jpeg.tobytes()
+
+
+class MjpegDecoder:
+    """
+    Decodes MJPEG capture buffers straight to planar YUV with libavcodec,
+    skipping OpenCV's JPEG -> BGR conversion.
+    """
+    def __init__(self):
+        self._codec = av.CodecContext.create("mjpeg", "r")
+
+    def decode(self, data):
+        """
+        Decode one JPEG image.
+
+        Args:
+            data: JPEG bytes (or a uint8 array holding them)
+
+        Returns:
+            Decoded VideoFrame (usually yuvj422p or yuvj420p), or None if nothing was decoded
+        """
+        if isinstance(data, numpy.ndarray):
+            data = data.tobytes()
+        frames = self._codec.decode(av.Packet(data))
+        return frames[-1] if frames else None
+
+
+class FrameConverter:
+    """
+    Turns raw capture buffers into VideoFrames ready for the encoder,
+    according to the negotiated capture pixel format.
+    """
+    def __init__(self, fourcc, capture_width, capture_height, width, height):
+        """
+        Args:
+            fourcc: Negotiated FOURCC, or None when OpenCV delivers BGR images
+            capture_width: Width the camera actually delivers
+            capture_height: Height the camera actually delivers
+            width: Output width
+            height: Output height
+        """
+        self.fourcc = fourcc
+        self.capture_width = capture_width
+        self.capture_height = capture_height
+        self.width = width
+        self.height = height
+        self._mjpeg = MjpegDecoder() if fourcc == FOURCC_MJPEG else None
+
+    @property
+    def native(self):
+        """Whether raw buffers are converted without going through BGR."""
+        return self.fourcc is not None
+
+    def convert(self, raw):
+        """
+        Convert one captured buffer.
+
+        Raises:
+            RuntimeError: If the buffer cannot be decoded
+        """
+        if self.fourcc == FOURCC_MJPEG:
+            frame = self._mjpeg.decode(raw)
+            if frame is None:
+                raise RuntimeError("Failed to decode MJPEG frame")
+            return to_output_frame(frame, self.width, self.height)
+
+        if self.fourcc == FOURCC_YUYV:
+            expected = self.capture_width * self.capture_height * 2
+            if raw.size != expected:
+                raise RuntimeError(f"Unexpected YUYV buffer size {raw.size} (expected {expected})")
+            frame = yuyv_to_frame(raw, self.capture_width, self.capture_height)
+            return to_output_frame(frame, self.width, self.height)
+
+        return bgr_to_frame(raw, self.width, self.height)
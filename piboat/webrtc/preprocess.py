@@ -0,0 +1,334 @@
+import logging
+import multiprocessing
+import queue
+import threading
+import time
+from multiprocessing import shared_memory
+
+import numpy
+from av import VideoFrame
+
+from piboat.webrtc.pixel_format import FrameConverter, plane_view
+
+logger = logging.getLogger("FramePreprocessor")
+
+# Frames a worker may take before its result is given up on and the frame skipped
+RESULT_TIMEOUT = 1.0
+
+# Seconds to wait for worker processes to start or stop
+WORKER_START_TIMEOUT = 30.0
+WORKER_STOP_TIMEOUT = 2.0
+
+
+def _plane_layout(width, height, format_name):
+    """
+    Get the (height, width, channels) of each plane of a frame as stored in a slot.
+    Planes are stored back to back without line padding.
+    """
+    channels = 3 if format_name == "bgr24" else 1
+    frame = VideoFrame(width, height, format_name)
+    return [(plane.height, plane.width, channels) for plane in frame.planes]
+
+
+def _slot_planes(buffer, offset, layout):
+    """Get numpy views of the planes stored in a slot's output region."""
+    planes = []
+    for plane_height, plane_width, channels in layout:
+        size = plane_height * plane_width * channels
+        view = numpy.ndarray((plane_height, plane_width, channels), dtype=numpy.uint8, buffer=buffer, offset=offset)
+        planes.append(view if channels > 1 else view[:, :, 0])
+        offset += size
+    return planes
+
+
+def _worker_main(shm_name, slot_size, input_size, converter_args, tasks, results):
+    """
+    Worker process: convert raw capture buffers in shared memory slots into
+    encoder-ready planes written back into the same slot.
+    """
+    # Spawned workers share the parent's resource tracker, which unlinks the segment if the parent dies
+    shm = shared_memory.SharedMemory(name=shm_name)
+
+    converter = FrameConverter(*converter_args)
+    layouts = {}
+    results.put(("ready", None, None, None))
+
+    try:
+        while True:
+            task = tasks.get()
+            if task is None:
+                break
+            ticket, slot, shape = task
+            base = slot * slot_size
+            try:
+                raw = numpy.ndarray(shape, dtype=numpy.uint8, buffer=shm.buf, offset=base)
+                frame = converter.convert(raw)
+                format_name = frame.format.name
+                if format_name not in layouts:
+                    layouts[format_name] = _plane_layout(frame.width, frame.height, format_name)
+                channels = 3 if format_name == "bgr24" else 1
+                outputs = _slot_planes(shm.buf, base + input_size, layouts[format_name])
+                for plane, output in zip(frame.planes, outputs):
+                    numpy.copyto(output, plane_view(plane, channels))
+                del raw, outputs
+                results.put((ticket, slot, format_name, None))
+            except Exception as e:
+                results.put((ticket, slot, None, str(e)))
+    finally:
+        shm.close()
+
+
+class FramePreprocessor:
+    """
+    Converts raw capture buffers to encoder-ready frames in worker processes,
+    so decoding and colour conversion use the Pi's other cores instead of
+    competing with the event loop for the interpreter.
+
+    Buffers are passed through a ring of shared memory slots: the capture
+    thread copies each raw buffer into a free slot, a worker converts it and
+    writes the planes back into the slot, and only slot numbers travel through
+    the queues. Results are handed to the callback strictly in capture order
+    from a collector thread, however the workers finish.
+    """
+    def __init__(self, fourcc, capture_width, capture_height, width, height, workers, callback, slots=None):
+        """
+        Args:
+            fourcc: Negotiated FOURCC, or None when OpenCV delivers BGR images
+            capture_width: Width the camera actually delivers
+            capture_height: Height the camera actually delivers
+            width: Output width
+            height: Output height
+            workers: Number of worker processes
+            callback: Called in capture order as callback(frame, context), with
+                      frame None if the buffer could not be converted
+            slots: Number of shared memory slots (defaults to two per worker)
+        """
+        self.converter_args = (fourcc, capture_width, capture_height, width, height)
+        self.workers = workers
+        self.slots = slots or workers * 2
+        self._callback = callback
+
+        # Raw buffers are at most a YUYV/BGR frame; outputs are at most a bgr24 frame
+        self.input_size = capture_width * capture_height * 3
+        self.slot_size = self.input_size + width * height * 3
+
+        self._shm = None
+        self._processes = []
+        self._ctx = multiprocessing.get_context("spawn")
+        self._tasks = None
+        self._results = None
+        self._free_slots = queue.Queue()
+
+        # Frames in flight, by ticket: (slot, context, submit time)
+        self._pending = {}
+        self._pending_lock = threading.Lock()
+        self._next_ticket = 0
+        self._layouts = {}
+
+        self._running = False
+        self._collector = None
+
+        # Preprocessing statistics
+        self.frames_processed = 0
+        self.frames_failed = 0
+        self.frames_timed_out = 0
+        self.slot_waits = 0
+
+    def matches(self, fourcc, capture_width, capture_height, width, height):
+        """Check whether this preprocessor converts the given capture format."""
+        return self.converter_args == (fourcc, capture_width, capture_height, width, height)
+
+    def is_running(self):
+        return self._running
+
+    def start(self):
+        """
+        Create the shared memory ring and start the worker processes.
+
+        Raises:
+            RuntimeError: If the workers do not start
+        """
+        if self._running:
+            return
+
+        self._shm = shared_memory.SharedMemory(create=True, size=self.slot_size * self.slots)
+        self._tasks = self._ctx.Queue()
+        self._results = self._ctx.Queue()
+        for slot in range(self.slots):
+            self._free_slots.put(slot)
+
+        for index in range(self.workers):
+            process = self._ctx.Process(
+                target=_worker_main,
+                args=(self._shm.name, self.slot_size, self.input_size, self.converter_args, self._tasks, self._results),
+                name=f"FramePreprocess-{index}",
+                daemon=True
+            )
+            process.start()
+            self._processes.append(process)
+
+        try:
+            for _ in range(self.workers):
+                self._results.get(timeout=WORKER_START_TIMEOUT)
+        except queue.Empty:
+            self.close()
+            raise RuntimeError("Frame preprocessing workers did not start")
+
+        self._running = True
+        self._collector = threading.Thread(target=self._collect_loop, name="FramePreprocessCollector")
+        self._collector.daemon = True
+        self._collector.start()
+        logger.info(f"Frame preprocessing started with {self.workers} worker processes and {self.slots} slots")
+
+    def close(self):
+        """Stop the workers and free the shared memory."""
+        self._running = False
+        if self._collector is not None:
+            self._collector.join(timeout=WORKER_STOP_TIMEOUT)
+            self._collector = None
+
+        for _ in self._processes:
+            self._tasks.put(None)
+        for process in self._processes:
+            process.join(timeout=WORKER_STOP_TIMEOUT)
+            if process.is_alive():
+                process.terminate()
+        if self._processes:
+            logger.info("Frame preprocessing workers stopped")
+        self._processes = []
+
+        with self._pending_lock:
+            self._pending.clear()
+        self._free_slots = queue.Queue()
+        if self._shm is not None:
+            self._shm.close()
+            self._shm.unlink()
+            self._shm = None
+
+    def submit(self, raw, context=None):
+        """
+        Hand a raw capture buffer to the workers. Blocks while every slot is in use.
+
+        Args:
+            raw: Buffer as returned by cv2.VideoCapture.read()
+            context: Passed back to the callback with the converted frame
+
+        Returns:
+            True if the buffer was queued, False if it did not fit or the
+            preprocessor is stopped
+        """
+        if not self._running:
+            return False
+        if raw.nbytes > self.input_size:
+            logger.warning(f"Capture buffer of {raw.nbytes} bytes does not fit a preprocessing slot")
+            return False
+
+        try:
+            slot = self._free_slots.get_nowait()
+        except queue.Empty:
+            self.slot_waits += 1
+            try:
+                slot = self._free_slots.get(timeout=RESULT_TIMEOUT)
+            except queue.Empty:
+                return False
+
+        # The one copy of the pixels: from OpenCV's buffer into the slot
+        base = slot * self.slot_size
+        target = numpy.ndarray(raw.shape, dtype=numpy.uint8, buffer=self._shm.buf, offset=base)
+        numpy.copyto(target, raw)
+        del target
+
+        with self._pending_lock:
+            ticket = self._next_ticket
+            self._next_ticket += 1
+            self._pending[ticket] = (slot, context, time.monotonic())
+        self._tasks.put((ticket, slot, raw.shape))
+        return True
+
+    def _collect_loop(self):
+        """Background thread that hands finished frames to the callback in submission order."""
+        done = {}
+        # Slots of frames skipped after a timeout, freed if their result still arrives
+        abandoned = {}
+        next_ticket = 0
+
+        while self._running:
+            try:
+                ticket, slot, format_name, error = self._results.get(timeout=0.1)
+                if ticket in abandoned:
+                    self._free_slots.put(abandoned.pop(ticket))
+                else:
+                    done[ticket] = (format_name, error)
+            except queue.Empty:
+                if not any(process.is_alive() for process in self._processes):
+                    logger.error("All frame preprocessing workers exited")
+                    self._running = False
+                    break
+            except (EOFError, OSError):
+                break
+
+            while True:
+                with self._pending_lock:
+                    entry = self._pending.get(next_ticket)
+                if entry is None:
+                    break
+                slot, context, submitted = entry
+
+                if next_ticket in done:
+                    format_name, error = done.pop(next_ticket)
+                    frame = None
+                    if error is None:
+                        frame = self._read_slot(slot, format_name)
+                        self.frames_processed += 1
+                    else:
+                        logger.debug(f"Skipping undecodable frame: {error}")
+                        self.frames_failed += 1
+                elif time.monotonic() - submitted > RESULT_TIMEOUT:
+                    # A worker died or stalled; skip the frame rather than hold back the ones after it.
+                    # The slot is not reused until its result arrives, as the worker may still write to it.
+                    logger.warning("Frame preprocessing timed out, skipping frame")
+                    self.frames_timed_out += 1
+                    with self._pending_lock:
+                        self._pending.pop(next_ticket, None)
+                    abandoned[next_ticket] = slot
+                    next_ticket += 1
+                    continue
+                else:
+                    break
+
+                with self._pending_lock:
+                    self._pending.pop(next_ticket, None)
+                self._free_slots.put(slot)
+                next_ticket += 1
+
+                try:
+                    self._callback(frame, context)
+                except Exception as e:
+                    logger.error(f"Error handling preprocessed frame: {e}")
+
+    def _read_slot(self, slot, format_name):
+        """Copy a slot's converted planes into a new VideoFrame owned by the caller."""
+        width, height = self.converter_args[3], self.converter_args[4]
+        if format_name not in self._layouts:
+            self._layouts[format_name] = _plane_layout(width, height, format_name)
+        channels = 3 if format_name == "bgr24" else 1
+
+        frame = VideoFrame(width, height, format_name)
+        outputs = _slot_planes(self._shm.buf, slot * self.slot_size + self.input_size, self._layouts[format_name])
+        for plane, output in zip(frame.planes, outputs):
+            numpy.copyto(plane_view(plane, channels), output)
+        del outputs
+        return frame
+
+    def get_stats(self):
+        """Get preprocessing statistics."""
+        with self._pending_lock:
+            in_flight = len(self._pending)
+        return {
+            'workers': sum(1 for p in self._processes if p.is_alive()),
+            'frames_processed': self.frames_processed,
+            'frames_failed': self.frames_failed,
+            'frames_timed_out': self.frames_timed_out,
+            'slot_waits': self.slot_waits,
+            'in_flight': in_flight
+        }
@@ -0,0 +1,326 @@
+import logging
+import os
+import shutil
+import threading
+import time
+from datetime import datetime
+
+import av
+
+from piboat.config import (
+    RECORDING_DIR, RECORDING_FORMAT, RECORDING_SEGMENT_SECONDS, RECORDING_MAX_MB,
+    RECORDING_MIN_FREE_MB, RECORDING_CODEC, RECORDING_BITRATE, RECORDING_FPS
+)
+from piboat.webrtc.camera import get_camera_source
+from piboat.webrtc.device_executor import subscribe_source_blocking, submit_blocking
+from piboat.webrtc.pacing import VIDEO_CLOCK_RATE, VIDEO_TIME_BASE, frame_due
+from piboat.webrtc.pixel_format import OUTPUT_FORMAT, to_output_frame
+
+logger = logging.getLogger("VideoRecorder")
+
+# Prefix of segment file names; only files with this prefix are ever deleted
+SEGMENT_PREFIX = "piboat_"
+
+# Seconds to wait before retrying when the camera cannot be opened
+OPEN_RETRY_INTERVAL = 5.0
+
+# Seconds between free space checks while recording
+DISK_CHECK_INTERVAL = 5.0
+
+
+def list_segments(directory):
+    """
+    List recorded segments, oldest first.
+
+    Returns:
+        List of (path, size in bytes)
+    """
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return []
+
+    segments = []
+    for name in names:
+        path = os.path.join(directory, name)
+        if name.startswith(SEGMENT_PREFIX) and os.path.isfile(path):
+            stat = os.stat(path)
+            segments.append((stat.st_mtime, path, stat.st_size))
+    segments.sort()
+    return [(path, size) for _, path, size in segments]
+
+
+def enforce_disk_limit(directory, max_bytes, min_free_bytes, keep=None):
+    """
+    Delete the oldest segments until the recordings fit in max_bytes and the
+    disk has at least min_free_bytes free.
+
+    Args:
+        directory: Recording directory
+        max_bytes: Maximum total size of all segments
+        min_free_bytes: Free space to leave on the disk
+        keep: Path of a segment that must not be deleted (the one being written)
+
+    Returns:
+        Number of segments deleted
+    """
+    segments = [(path, size) for path, size in list_segments(directory) if path != keep]
+    total = sum(size for _, size in list_segments(directory))
+    deleted = 0
+
+    while segments:
+        free = shutil.disk_usage(directory).free
+        if total <= max_bytes and free >= min_free_bytes:
+            break
+        path, size = segments.pop(0)
+        try:
+            os.remove(path)
+            total -= size
+            deleted += 1
+            logger.info(f"Deleted old recording {os.path.basename(path)} to stay within the disk limit")
+        except OSError as e:
+            logger.warning(f"Failed to delete old recording {path}: {e}")
+    return deleted
+
+
+class VideoRecorder:
+    """
+    Records the shared camera capture to fixed-length segments on disk.
+
+    The recorder runs in its own thread and reads frames from the CameraSource
+    directly, so encoding and disk writes never run on the event loop. It only
+    ever takes the newest frame: if encoding falls behind, frames are skipped
+    in the recording rather than delaying the capture or the live tracks.
+    Opening and releasing the camera go through the video device thread like
+    every other subscriber. Recording pauses while the disk has less than the
+    minimum free space, even after all old segments have been deleted.
+    """
+    def __init__(self, source=None, directory=RECORDING_DIR, segment_seconds=RECORDING_SEGMENT_SECONDS,
+                 container_format=RECORDING_FORMAT, codec=RECORDING_CODEC, bitrate=RECORDING_BITRATE,
+                 fps=RECORDING_FPS, max_mb=RECORDING_MAX_MB, min_free_mb=RECORDING_MIN_FREE_MB):
+        """
+        Args:
+            source: CameraSource to record (defaults to the process-wide source)
+            directory: Directory segments are written to
+            segment_seconds: Length of each segment
+            container_format: "mkv" or "mp4"
+            codec: Encoder name (e.g. libx264, or h264_v4l2m2m for the Pi's hardware encoder)
+            bitrate: Target bitrate in bits per second
+            fps: Recorded frame rate (captured frames are skipped to match)
+            max_mb: Maximum total size of all segments in MB
+            min_free_mb: Free disk space to leave, in MB
+        """
+        self._source = source if source is not None else get_camera_source()
+        self.directory = directory
+        self.segment_seconds = segment_seconds
+        self.container_format = container_format
+        self.codec = codec
+        self.bitrate = bitrate
+        self.fps = fps
+        self.max_bytes = max_mb * 1024 * 1024
+        self.min_free_bytes = min_free_mb * 1024 * 1024
+
+        self._running = False
+        self._thread = None
+        self._subscribed = False
+
+        # Paused while the disk is below the minimum free space
+        self._low_disk = False
+        self._next_disk_check = 0.0
+
+        # Segment being written
+        self._container = None
+        self._stream = None
+        self._segment_path = None
+        self._segment_start = None
+
+        # Recorder statistics
+        self.frames_recorded = 0
+        self.frames_skipped = 0
+        self.frames_dropped_low_disk = 0
+        self.segments_written = 0
+
+    def is_recording(self):
+        """Check whether a segment is currently being written."""
+        return self._container is not None
+
+    def start(self):
+        """Start recording in the background. The camera is opened by the recorder thread."""
+        if self._thread and self._thread.is_alive():
+            return
+
+        os.makedirs(self.directory, exist_ok=True)
+        self._running = True
+        self._thread = threading.Thread(target=self._record_loop, name="VideoRecorder")
+        self._thread.daemon = True
+        self._thread.start()
+        logger.info(f"Video recorder started, writing {self.segment_seconds}s {self.container_format} "
+                    f"segments to {self.directory}")
+
+    def stop(self):
+        """Stop recording, finish the current segment and release the camera subscription."""
+        self._running = False
+        if self._thread:
+            self._thread.join(timeout=5.0)
+            self._thread = None
+            logger.info("Video recorder stopped")
+
+    def _subscribe(self):
+        """Subscribe to the camera, retrying until it opens or the recorder is stopped."""
+        while self._running and not self._subscribed:
+            try:
+                subscribe_source_blocking(self._source)
+                self._subscribed = True
+            except Exception as e:
+                logger.warning(f"Recorder could not open the camera, retrying in {OPEN_RETRY_INTERVAL}s: {e}")
+                time.sleep(OPEN_RETRY_INTERVAL)
+
+    def _record_loop(self):
+        """Background thread that encodes the newest captured frames into segments."""
+        self._subscribe()
+
+        last_seq = 0
+        last_pts = None
+
+        try:
+            while self._running:
+                try:
+                    result = self._source.wait_frame(last_seq, timeout=1.0)
+                except RuntimeError as e:
+                    logger.warning(f"Recorder waiting for the camera: {e}")
+                    time.sleep(1)
+                    continue
+                if result is None:
+                    continue
+
+                seq, frame = result
+                if last_seq and seq > last_seq + 1:
+                    self.frames_skipped += seq - last_seq - 1
+                last_seq = seq
+                if not frame_due(frame.pts, last_pts, self.fps):
+                    continue
+                last_pts = frame.pts
+
+                try:
+                    self._write_frame(frame)
+                except Exception as e:
+                    logger.error(f"Error recording frame, starting a new segment: {e}")
+                    self._close_segment()
+        finally:
+            self._close_segment()
+            if self._subscribed:
+                self._subscribed = False
+                submit_blocking(self._source.unsubscribe)
+
+    def _check_disk(self):
+        """
+        Make room for recording every DISK_CHECK_INTERVAL, and pause recording
+        (finishing the current segment) while the disk stays below the minimum
+        free space with nothing left to delete.
+
+        Returns:
+            True if recording can continue
+        """
+        now = time.monotonic()
+        if now < self._next_disk_check:
+            return not self._low_disk
+        self._next_disk_check = now + DISK_CHECK_INTERVAL
+
+        keep = self._segment_path if self._container is not None else None
+        enforce_disk_limit(self.directory, self.max_bytes, self.min_free_bytes, keep=keep)
+        low_disk = shutil.disk_usage(self.directory).free < self.min_free_bytes
+        if low_disk and not self._low_disk:
+            logger.warning(f"Less than {self.min_free_bytes // (1024 * 1024)} MB free on the recording disk, "
+                           f"pausing recording")
+            self._close_segment()
+        elif self._low_disk and not low_disk:
+            logger.info("Recording disk has free space again, resuming recording")
+        self._low_disk = low_disk
+        return not low_disk
+
+    def _write_frame(self, frame):
+        """Encode a frame into the current segment, starting a new segment when due."""
+        if not self._check_disk():
+            self.frames_dropped_low_disk += 1
+            return
+        if self._container is not None and frame.pts - self._segment_start >= self.segment_seconds * VIDEO_CLOCK_RATE:
+            self._close_segment()
+        if self._container is None:
+            self._open_segment(frame)
+
+        # Frames are shared with the live tracks: convert if needed, but never modify them
+        frame = to_output_frame(frame, self._stream.width, self._stream.height)
+        for packet in self._stream.encode(frame):
+            self._mux(packet)
+        self.frames_recorded += 1
+
+    def _mux(self, packet):
+        """Write a packet with timestamps relative to the start of the segment."""
+        packet.pts -= self._segment_start
+        packet.dts -= self._segment_start
+        self._container.mux(packet)
+
+    def _segment_name(self):
+        """Name a new segment after the current time, never reusing an existing file."""
+        stamp = datetime.now().strftime('%Y%m%d_%H%M%S_%f')[:-3]
+        name = f"{SEGMENT_PREFIX}{stamp}.{self.container_format}"
+        suffix = 1
+        while os.path.exists(os.path.join(self.directory, name)):
+            name = f"{SEGMENT_PREFIX}{stamp}_{suffix}.{self.container_format}"
+            suffix += 1
+        return name
+
+    def _open_segment(self, frame):
+        """Start a new segment file. Every segment starts with a keyframe and plays on its own."""
+        enforce_disk_limit(self.directory, self.max_bytes, self.min_free_bytes)
+
+        name = self._segment_name()
+        self._segment_path = os.path.join(self.directory, name)
+        self._container = av.open(self._segment_path, mode="w")
+
+        stream = self._container.add_stream(self.codec, rate=self.fps)
+        stream.width = frame.width
+        stream.height = frame.height
+        stream.pix_fmt = OUTPUT_FORMAT
+        stream.bit_rate = self.bitrate
+        # Capture timestamps are on the 90 kHz media clock; matching it keeps the shared frames untouched
+        stream.codec_context.time_base = VIDEO_TIME_BASE
+        if self.codec == "libx264":
+            stream.options = {"preset": "veryfast", "tune": "zerolatency"}
+        self._stream = stream
+        self._segment_start = frame.pts
+        logger.info(f"Recording segment {name}")
+
+    def _close_segment(self):
+        """Flush the encoder and finish the current segment file."""
+        if self._container is None:
+            return
+
+        try:
+            for packet in self._stream.encode(None):
+                self._mux(packet)
+        except Exception as e:
+            logger.warning(f"Error flushing recording encoder: {e}")
+        try:
+            self._container.close()
+            self.segments_written += 1
+            logger.info(f"Finished recording segment {os.path.basename(self._segment_path)}")
+        except Exception as e:
+            logger.warning(f"Error closing recording segment: {e}")
+
+        self._container = None
+        self._stream = None
+        enforce_disk_limit(self.directory, self.max_bytes, self.min_free_bytes)
+
+    def get_stats(self):
+        """Get recorder statistics."""
+        return {
+            'recording': self.is_recording(),
+            'segment': os.path.basename(self._segment_path) if self._segment_path else None,
+            'frames_recorded': self.frames_recorded,
+            'frames_skipped': self.frames_skipped,
+            'frames_dropped_low_disk': self.frames_dropped_low_disk,
+            'paused_low_disk': self._low_disk,
+            'segments_written': self.segments_written,
+            'disk_used_mb': round(sum(size for _, size in list_segments(self.directory)) / (1024 * 1024), 1)
+        }
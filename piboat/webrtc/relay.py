@@ -0,0 +1,299 @@
+import asyncio
+import fractions
+import logging
+import multiprocessing
+import threading
+from collections import namedtuple
+
+import av
+from aiortc.codecs.vpx import number_of_threads
+
+from piboat.webrtc.camera import get_camera_source
+from piboat.webrtc.pacing import VIDEO_CLOCK_RATE, VIDEO_TIME_BASE, frame_due
+from piboat.webrtc.pixel_format import OUTPUT_FORMAT, copy_frame
+
+logger = logging.getLogger("VideoRelay")
+
+# Codecs the relay can encode, by RTP codec name
+RELAY_CODECS = ("VP8", "H264")
+
+# Encoded packets buffered for a viewer before it is considered stalled and resynchronised on a keyframe
+MAX_PENDING_PACKETS = 30
+
+LayerKey = namedtuple("LayerKey", ["codec", "width", "height", "fps", "bitrate"])
+
+# Process-wide relay shared by every relayed track
+_shared_relay = None
+
+
+def create_encoder(codec_name, width, height, fps, bitrate):
+    """
+    Create a libavcodec encoder set up like aiortc's own VP8 and H.264 encoders,
+    but returning raw packets that aiortc only has to packetize for each peer.
+
+    Args:
+        codec_name: "VP8" or "H264"
+        width: Frame width
+        height: Frame height
+        fps: Frame rate the layer is fed at
+        bitrate: Target bitrate in bits per second
+
+    Returns:
+        Opened av CodecContext
+    """
+    if codec_name == "VP8":
+        codec = av.CodecContext.create("libvpx", "w")
+        codec.gop_size = 3000  # keyframes are only sent when a viewer needs one
+        codec.qmin = 2
+        codec.qmax = 56
+        codec.options = {
+            "bufsize": str(bitrate),
+            "cpu-used": "-6",
+            "deadline": "realtime",
+            "lag-in-frames": "0",
+            "minrate": str(bitrate),
+            "maxrate": str(bitrate),
+            "noise-sensitivity": "4",
+            "overshoot-pct": "15",
+            "partitions": "0",
+            "static-thresh": "1",
+            "undershoot-pct": "100",
+        }
+        codec.thread_count = number_of_threads(width * height, multiprocessing.cpu_count())
+    elif codec_name == "H264":
+        codec = av.CodecContext.create("libx264", "w")
+        codec.options = {
+            "level": "31",
+            "tune": "zerolatency",
+        }
+        codec.profile = "Baseline"
+    else:
+        raise ValueError(f"Codec {codec_name} cannot be relayed")
+
+    codec.width = width
+    codec.height = height
+    codec.bit_rate = bitrate
+    codec.pix_fmt = OUTPUT_FORMAT
+    codec.framerate = fractions.Fraction(fps, 1)
+    codec.time_base = VIDEO_TIME_BASE
+    return codec
+
+
+class EncodingLayer:
+    """
+    One encoder for a codec, resolution, frame rate and bitrate, fed from the
+    shared capture. Every packet it produces is handed to all of its subscribers,
+    so viewers on the same layer cost one encode between them.
+    """
+    def __init__(self, key, source):
+        """
+        Args:
+            key: LayerKey describing the encoded stream
+            source: CameraSource the frames are taken from
+        """
+        self.key = key
+        self._source = source
+        self._subscribers = set()
+        self._codec = None
+        # The encoder may be primed from one executor thread while a viewer's first frame is encoded in another
+        self._codec_lock = threading.Lock()
+        self._keyframe_requested = True
+        self._task = None
+
+        # Layer statistics
+        self.frames_encoded = 0
+        self.keyframes = 0
+
+    @property
+    def subscribers(self):
+        return len(self._subscribers)
+
+    def add(self, subscriber):
+        """
+        Start relaying packets to a subscriber. A keyframe is forced so the
+        new viewer can start decoding straight away.
+        """
+        self._subscribers.add(subscriber)
+        self.request_keyframe()
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    def remove(self, subscriber):
+        """Stop relaying to a subscriber, stopping the encoder once nobody is left."""
+        self._subscribers.discard(subscriber)
+        if not self._subscribers and self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def request_keyframe(self):
+        """Make the next encoded frame a keyframe."""
+        self._keyframe_requested = True
+
+    async def _next_frame(self, last_seq, last_pts):
+        """
+        Get the next captured frame, skipping frames to honour the layer frame
+        rate, or the idle frame rate while the scene is static.
+        """
+        while True:
+            last_seq, frame = await self._source.get_frame(last_seq)
+            fps = self._source.effective_fps(self.key.fps)
+            if frame_due(frame.pts, last_pts, fps, self._source.fps):
+                return last_seq, frame
+
+    async def _run(self):
+        """Encode frames for as long as the layer has subscribers."""
+        loop = asyncio.get_running_loop()
+        last_seq = 0
+        last_pts = None
+
+        logger.info(f"Started {self.key.codec} encoder for {self.key.width}x{self.key.height}"
+                    f"@{self.key.fps} {self.key.bitrate // 1000}kbps")
+        try:
+            while self._subscribers:
+                last_seq, frame = await self._next_frame(last_seq, last_pts)
+                last_pts = frame.pts
+
+                if (frame.format.name != OUTPUT_FORMAT or frame.width != self.key.width
+                        or frame.height != self.key.height):
+                    frame = await self._source.get_scaled_frame(last_seq, frame, self.key.width, self.key.height)
+
+                force_keyframe = self._keyframe_requested
+                self._keyframe_requested = False
+                packets = await loop.run_in_executor(None, self._encode, frame, force_keyframe)
+
+                for packet in packets:
+                    for subscriber in list(self._subscribers):
+                        subscriber.push(packet)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Error encoding {self.key.codec} layer: {e}")
+            for subscriber in list(self._subscribers):
+                subscriber.fail(e)
+        finally:
+            logger.info(f"Stopped {self.key.codec} encoder for {self.key.width}x{self.key.height}@{self.key.fps}")
+
+    def _encode(self, frame, force_keyframe):
+        """
+        Encode one yuv420p frame. Runs in the default executor.
+
+        Returns:
+            List of av.Packet carrying the frame's capture timestamp
+        """
+        if force_keyframe:
+            # The captured frame is shared, so mark a private copy rather than the original
+            frame = copy_frame(frame)
+            frame.pict_type = av.video.frame.PictureType.I
+
+        with self._codec_lock:
+            if self._codec is None:
+                self._codec = create_encoder(*self.key)
+            packets = self._codec.encode(frame)
+        for packet in packets:
+            packet.pts = frame.pts
+            packet.time_base = VIDEO_TIME_BASE
+            if packet.is_keyframe:
+                self.keyframes += 1
+        self.frames_encoded += 1
+        return packets
+
+    def prime(self):
+        """
+        Open the encoder and run a blank keyframe through it, so the first
+        viewer does not wait for libvpx/libx264 to set up. Blocking; runs in
+        the default executor.
+        """
+        with self._codec_lock:
+            if self._codec is not None:
+                return
+            codec = create_encoder(*self.key)
+            frame = av.VideoFrame(self.key.width, self.key.height, OUTPUT_FORMAT)
+            for plane in frame.planes:
+                plane.update(bytes(plane.buffer_size))
+            frame.pts = 0
+            frame.pict_type = av.video.frame.PictureType.I
+            codec.encode(frame)
+            self._codec = codec
+
+    def get_stats(self):
+        """Get the layer description and statistics."""
+        return {
+            'codec': self.key.codec,
+            'width': self.key.width,
+            'height': self.key.height,
+            'fps': self.key.fps,
+            'bitrate': self.key.bitrate,
+            'subscribers': len(self._subscribers),
+            'frames_encoded': self.frames_encoded,
+            'keyframes': self.keyframes
+        }
+
+
+class VideoRelay:
+    """
+    Keeps one EncodingLayer per codec and ladder rung in use, creating layers
+    when the first viewer joins them and dropping them when the last one leaves.
+    Primed layers are kept, with their encoder open, while nobody watches.
+    """
+    def __init__(self, source=None):
+        self._source = source if source is not None else get_camera_source()
+        self._layers = {}
+        self._primed = set()
+
+    @property
+    def source(self):
+        return self._source
+
+    def subscribe(self, subscriber, key):
+        """
+        Add a subscriber to the layer for a key, creating the layer if needed.
+
+        Returns:
+            The EncodingLayer the subscriber was added to
+        """
+        layer = self._get_layer(key)
+        layer.add(subscriber)
+        return layer
+
+    def _get_layer(self, key):
+        layer = self._layers.get(key)
+        if layer is None:
+            layer = EncodingLayer(key, self._source)
+            self._layers[key] = layer
+        return layer
+
+    async def prime(self, key):
+        """Open the encoder for a layer ahead of its first viewer and keep it open between viewers."""
+        self._primed.add(key)
+        layer = self._get_layer(key)
+        await asyncio.get_running_loop().run_in_executor(None, layer.prime)
+
+    def unprime(self, key):
+        """Stop keeping a primed layer, dropping it if nobody is watching it."""
+        self._primed.discard(key)
+        layer = self._layers.get(key)
+        if layer is not None and layer.subscribers == 0:
+            del self._layers[key]
+
+    def unsubscribe(self, subscriber, layer):
+        """Remove a subscriber from a layer, dropping the layer once it is unused."""
+        layer.remove(subscriber)
+        if layer.subscribers == 0 and self._layers.get(layer.key) is layer and layer.key not in self._primed:
+            del self._layers[layer.key]
+
+    def get_stats(self):
+        """Get statistics for every active layer."""
+        return [layer.get_stats() for layer in self._layers.values() if layer.subscribers]
+
+
+def get_video_relay():
+    """
+    Get the process-wide video relay, creating it on first use.
+
+    Returns:
+        The shared VideoRelay instance
+    """
+    global _shared_relay
+    if _shared_relay is None:
+        _shared_relay = VideoRelay()
+    return _shared_relay
@@ -0,0 +1,85 @@
+import logging
+import time
+
+import numpy
+
+from piboat.config import VIDEO_STATIC_THRESHOLD, VIDEO_STATIC_SECONDS
+from piboat.webrtc.pixel_format import plane_view
+
+logger = logging.getLogger("SceneDetector")
+
+# Sample every SAMPLE_STEP-th pixel in both directions (3600 samples at 1280x720)
+SAMPLE_STEP = 16
+
+# Luma difference above which a sampled pixel counts as changed; lower differences are sensor noise
+PIXEL_THRESHOLD = 12
+
+
+def sample_luma(frame, step=SAMPLE_STEP):
+    """
+    Take a sparse grid of luma samples from a frame without converting it.
+
+    Args:
+        frame: VideoFrame in a planar YUV format or bgr24
+        step: Distance between samples in pixels
+
+    Returns:
+        2D int16 array of samples
+    """
+    if frame.format.name == "bgr24":
+        # Green carries most of the luma and is enough to detect change
+        samples = plane_view(frame.planes[0], channels=3)[::step, ::step, 1]
+    else:
+        samples = plane_view(frame.planes[0])[::step, ::step]
+    return samples.astype(numpy.int16)
+
+
+class SceneChangeDetector:
+    """
+    Detects a static scene (e.g. the boat moored or holding a waypoint) by
+    comparing a sparse luma grid of each frame with the last frame that changed.
+    Comparing against the last change rather than the previous frame means slow
+    drifts such as changing daylight still register once they add up.
+    """
+    def __init__(self, threshold=VIDEO_STATIC_THRESHOLD, static_seconds=VIDEO_STATIC_SECONDS):
+        """
+        Args:
+            threshold: Fraction of sampled pixels that must change for the scene to count as moving
+            static_seconds: How long the scene must stay unchanged before it is reported static
+        """
+        self.threshold = threshold
+        self.static_seconds = static_seconds
+        self.static = False
+        self.change = 0.0
+        self._reference = None
+        self._last_change = time.monotonic()
+
+    def update(self, frame, now=None):
+        """
+        Compare a new frame with the reference.
+
+        Args:
+            frame: Captured VideoFrame, before any overlay is drawn
+            now: Monotonic time of the frame (defaults to now)
+
+        Returns:
+            True if the scene has been static for at least static_seconds
+        """
+        if now is None:
+            now = time.monotonic()
+        samples = sample_luma(frame)
+
+        if self._reference is None or self._reference.shape != samples.shape:
+            self.change = 1.0
+        else:
+            self.change = numpy.count_nonzero(numpy.abs(samples - self._reference) > PIXEL_THRESHOLD) / samples.size
+
+        if self.change >= self.threshold:
+            self._reference = samples
+            self._last_change = now
+
+        static = now - self._last_change >= self.static_seconds
+        if static != self.static:
+            logger.info("Scene is static, lowering the frame rate" if static else "Scene changed, restoring the frame rate")
+            self.static = static
+        return static
@@ -0,0 +1,204 @@
+import logging
+from collections import namedtuple
+
+from aiortc import RTCRtpSender
+
+from piboat.config import VIDEO_CODEC_PREFERENCE
+
+logger = logging.getLogger("SDP")
+
+# Video codecs the boat can send (aiortc's encoders and the relay)
+SUPPORTED_VIDEO_CODECS = ("VP8", "H264")
+
+Codec = namedtuple("Codec", ["payload_type", "name", "clock_rate", "channels", "parameters"])
+
+
+class MediaSection:
+    """One m= section of a session description."""
+    def __init__(self, kind, port, protocol, payload_types):
+        self.kind = kind
+        self.port = port
+        self.protocol = protocol
+        self.payload_types = payload_types
+        self.mid = None
+        self.direction = "sendrecv"
+        self.codecs = []
+
+    @property
+    def codec_names(self):
+        """Codec names in the order the remote side prefers them, without retransmission/FEC entries."""
+        names = []
+        for codec in self.codecs:
+            if codec.name not in ("RTX", "RED", "ULPFEC", "FLEXFEC-03") and codec.name not in names:
+                names.append(codec.name)
+        return names
+
+    def get_codec(self, payload_type):
+        for codec in self.codecs:
+            if codec.payload_type == payload_type:
+                return codec
+        return None
+
+
+class SessionDescription:
+    """
+    Structured view of an SDP blob: the media sections and their codecs,
+    parsed once and shared by everything that needs to inspect an offer.
+    """
+    def __init__(self, media):
+        self.media = media
+
+    @property
+    def video(self):
+        """The first video section, or None if there is none."""
+        for section in self.media:
+            if section.kind == "video":
+                return section
+        return None
+
+
+def _parse_fmtp(value):
+    """Parse "key=value;key=value" fmtp parameters into a dict."""
+    parameters = {}
+    for item in value.split(";"):
+        key, _, param = item.strip().partition("=")
+        if key:
+            parameters[key] = param
+    return parameters
+
+
+def parse_sdp(sdp):
+    """
+    Parse a session description into media sections and codecs in a single pass.
+    Lines the model does not use are ignored, so unusual offers still parse.
+
+    Args:
+        sdp (str): Raw SDP
+
+    Returns:
+        SessionDescription
+    """
+    media = []
+    current = None
+    rtpmaps = {}
+    fmtps = {}
+
+    def finish(section):
+        # Build codecs in m= line order, which is the remote side's preference
+        for payload_type in section.payload_types:
+            if payload_type not in rtpmaps:
+                continue
+            name, clock_rate, channels = rtpmaps[payload_type]
+            section.codecs.append(Codec(payload_type, name, clock_rate, channels, fmtps.get(payload_type, {})))
+
+    for line in sdp.splitlines():
+        line = line.strip()
+        if line.startswith("m="):
+            if current is not None:
+                finish(current)
+            fields = line[2:].split()
+            if len(fields) < 3:
+                current = None
+                continue
+            payload_types = [int(pt) for pt in fields[3:] if pt.isdigit()]
+            current = MediaSection(fields[0], fields[1], fields[2], payload_types)
+            media.append(current)
+            rtpmaps = {}
+            fmtps = {}
+        elif current is None:
+            continue
+        elif line.startswith("a=rtpmap:"):
+            payload_type, _, encoding = line[9:].partition(" ")
+            parts = encoding.split("/")
+            if payload_type.isdigit() and parts[0]:
+                clock_rate = int(parts[1]) if len(parts) > 1 and parts[1].isdigit() else None
+                channels = int(parts[2]) if len(parts) > 2 and parts[2].isdigit() else None
+                rtpmaps[int(payload_type)] = (parts[0].upper(), clock_rate, channels)
+        elif line.startswith("a=fmtp:"):
+            payload_type, _, value = line[7:].partition(" ")
+            if payload_type.isdigit():
+                fmtps[int(payload_type)] = _parse_fmtp(value)
+        elif line.startswith("a=mid:"):
+            current.mid = line[6:]
+        elif line in ("a=sendrecv", "a=sendonly", "a=recvonly", "a=inactive"):
+            current.direction = line[2:]
+
+    if current is not None:
+        finish(current)
+    return SessionDescription(media)
+
+
+def check_video_compatibility(description):
+    """
+    Check whether a remote description can receive video the boat can send.
+
+    Args:
+        description: Parsed SessionDescription
+
+    Returns:
+        Tuple (compatible, message)
+    """
+    video = description.video
+    if video is None:
+        return (False, "No video section in remote SDP")
+    if video.direction in ("sendonly", "inactive"):
+        return (False, f"Remote video section is {video.direction}")
+
+    remote_codecs = video.codec_names
+    logger.debug(f"Remote video codecs: {', '.join(remote_codecs)}")
+    if not remote_codecs:
+        # Most browsers support at least H.264 or VP8
+        return (True, "No video codecs listed in remote SDP, assuming default compatibility")
+
+    compatible_codecs = [c for c in remote_codecs if c in SUPPORTED_VIDEO_CODECS]
+    if compatible_codecs:
+        return (True, f"Found compatible codecs: {', '.join(compatible_codecs)}")
+    return (False, f"Found incompatible codecs: {', '.join(remote_codecs)}")
+
+
+def get_codec_preferences(description=None, preference=VIDEO_CODEC_PREFERENCE):
+    """
+    Order aiortc's video codec capabilities by the configured preference.
+
+    Args:
+        description: Parsed remote SessionDescription; if given, codecs it does
+                     not offer are left out
+        preference: Codec names, most preferred first
+
+    Returns:
+        List of RTCRtpCodecCapability for RTCRtpTransceiver.setCodecPreferences
+    """
+    capabilities = RTCRtpSender.getCapabilities("video").codecs
+    remote = description.video.codec_names if description is not None and description.video else None
+
+    ordered = []
+    for name in preference:
+        if name not in SUPPORTED_VIDEO_CODECS or (remote and name not in remote):
+            continue
+        ordered.extend(c for c in capabilities if c.mimeType.split("/")[1].upper() == name)
+
+    # Keep retransmission available for the chosen codecs
+    if ordered:
+        ordered.extend(c for c in capabilities if c.mimeType.lower() == "video/rtx")
+    return ordered
+
+
+def apply_codec_preferences(pc, description=None):
+    """
+    Set the configured video codec preference on a peer connection's video transceivers.
+    Must be called before the offer or answer is created.
+
+    Returns:
+        The preferred codec names in order
+    """
+    preferences = get_codec_preferences(description)
+    for transceiver in pc.getTransceivers():
+        if transceiver.kind == "video":
+            transceiver.setCodecPreferences(preferences)
+
+    names = []
+    for codec in preferences:
+        name = codec.mimeType.split("/")[1].upper()
+        if name != "RTX" and name not in names:
+            names.append(name)
+    return names
@@ -0,0 +1,193 @@
+import inspect
+import logging
+import time
+from collections import deque, namedtuple
+
+from aiortc.rtp import RtcpPsfbPacket, RtcpRtpfbPacket, RTCP_PSFB_PLI, RTCP_PSFB_FIR, RTCP_RTPFB_NACK
+
+from piboat.webrtc.adaptive import get_video_sender
+
+logger = logging.getLogger("StreamStats")
+
+# How often every peer's statistics are collected (and its adaptive bitrate controller evaluated), in seconds
+STATS_INTERVAL = 1.0
+
+# Samples the rolling aggregates cover
+STATS_WINDOW = 10
+
+Sample = namedtuple("Sample", ["rtt", "loss", "bitrate", "fps"])
+
+# Set once the RTCP hook is found missing, so an aiortc without it is only reported once
+_rtcp_hook_disabled = False
+
+
+def watch_sender_rtcp(sender, on_packet):
+    """
+    Call on_packet(packet) for every RTCP packet a sender receives, before aiortc handles it.
+
+    aiortc's getStats() does not count NACKs or PLI/FIR and there is no public
+    hook for them, so this wraps the sender's private _handle_rtcp_packet. If
+    an aiortc version lacks it, the hook logs a warning and stays disabled.
+
+    Args:
+        sender: RTCRtpSender to watch
+        on_packet: Function called with each RTCP packet
+
+    Returns:
+        True if the hook was installed
+    """
+    global _rtcp_hook_disabled
+    if _rtcp_hook_disabled:
+        return False
+
+    handle_rtcp_packet = getattr(sender, "_handle_rtcp_packet", None)
+    if handle_rtcp_packet is None or not inspect.iscoroutinefunction(handle_rtcp_packet):
+        _rtcp_hook_disabled = True
+        logger.warning("aiortc has no RTCP packet handler to hook, NACK and PLI/FIR counts are unavailable")
+        return False
+
+    async def watched_handle_rtcp_packet(packet):
+        try:
+            on_packet(packet)
+        except Exception as e:
+            logger.debug(f"Error counting RTCP packet: {str(e)}")
+        await handle_rtcp_packet(packet)
+
+    sender._handle_rtcp_packet = watched_handle_rtcp_packet
+    return True
+
+
+class PeerStats:
+    """
+    Rolling link and stream statistics of one peer's video sender.
+
+    Each update takes the getStats() report the handler already collected
+    and turns the cumulative counters into per-interval rates, so reading
+    the aggregates costs nothing extra. NACK and PLI/FIR counts, which
+    aiortc handles without counting, are taken from the sender's RTCP by
+    watch_sender_rtcp, and are None where that hook is unavailable.
+    """
+    def __init__(self, client_id, pc, window=STATS_WINDOW):
+        """
+        Args:
+            client_id (str): Client the peer connection belongs to
+            pc: The RTCPeerConnection carrying the video track
+            window: Number of samples the aggregates cover
+        """
+        self.client_id = client_id
+        self.pc = pc
+        self._samples = deque(maxlen=window)
+        # Counters at the previous sample: (time, bytes sent, frames delivered to the sender)
+        self._last = None
+        self._sender = None
+
+        # Cumulative counters
+        self.packets_sent = 0
+        self.packets_lost = 0
+        self.nacks = 0
+        self.nacked_packets = 0
+        self.keyframe_requests = 0
+        self.rtcp_counted = False
+        self._find_sender()
+
+    def _find_sender(self):
+        """Find the video sender once the track has been added, and start counting its RTCP feedback."""
+        if self._sender is None:
+            self._sender = get_video_sender(self.pc)
+            if self._sender is not None:
+                self.rtcp_counted = watch_sender_rtcp(self._sender, self._count_rtcp)
+
+    def _count_rtcp(self, packet):
+        """Count the NACK and PLI/FIR feedback the sender receives."""
+        if isinstance(packet, RtcpRtpfbPacket) and packet.fmt == RTCP_RTPFB_NACK:
+            self.nacks += 1
+            self.nacked_packets += len(packet.lost)
+        elif isinstance(packet, RtcpPsfbPacket) and packet.fmt in (RTCP_PSFB_PLI, RTCP_PSFB_FIR):
+            self.keyframe_requests += 1
+
+    def update(self, report, now=None):
+        """
+        Add a sample from a getStats() report of the peer connection.
+
+        Args:
+            report: RTCStatsReport returned by pc.getStats()
+            now: time.monotonic() of the report (defaults to now)
+        """
+        now = now if now is not None else time.monotonic()
+        self._find_sender()
+
+        outbound = remote = None
+        for stats in report.values():
+            if getattr(stats, "kind", None) != "video":
+                continue
+            if stats.type == "outbound-rtp":
+                outbound = stats
+            elif stats.type == "remote-inbound-rtp":
+                remote = stats
+        if outbound is None:
+            return
+
+        track = self._sender.track if self._sender is not None else None
+        timing = getattr(track, "timing", None)
+        frames = timing.frames if timing is not None else 0
+
+        self.packets_sent = outbound.packetsSent
+        rtt = loss = None
+        if remote is not None:
+            self.packets_lost = remote.packetsLost
+            rtt = remote.roundTripTime
+            # fractionLost is the raw 8-bit fixed point value from the receiver report
+            loss = (remote.fractionLost or 0) / 256.0
+
+        if self._last is not None:
+            last_time, last_bytes, last_frames = self._last
+            elapsed = now - last_time
+            if elapsed > 0:
+                bitrate = (outbound.bytesSent - last_bytes) * 8 / elapsed
+                fps = (frames - last_frames) / elapsed
+                self._samples.append(Sample(rtt, loss, bitrate, fps))
+        self._last = (now, outbound.bytesSent, frames)
+
+    def get_stats(self):
+        """Get the rolling averages and cumulative counters, rounded for telemetry."""
+        rtts = [s.rtt for s in self._samples if s.rtt is not None]
+        losses = [s.loss for s in self._samples if s.loss is not None]
+        samples = len(self._samples)
+        return {
+            'rtt_ms': round(sum(rtts) / len(rtts) * 1000) if rtts else None,
+            'rtt_max_ms': round(max(rtts) * 1000) if rtts else None,
+            'loss_pct': round(sum(losses) / len(losses) * 100, 1) if losses else None,
+            'kbps': round(sum(s.bitrate for s in self._samples) / samples / 1000) if samples else 0,
+            'fps': round(sum(s.fps for s in self._samples) / samples, 1) if samples else 0,
+            'packets_sent': self.packets_sent,
+            'packets_lost': self.packets_lost,
+            'nacks': self.nacks if self.rtcp_counted else None,
+            'plis': self.keyframe_requests if self.rtcp_counted else None
+        }
+
+
+def summarize_peer_stats(peers):
+    """
+    Combine the statistics of every peer into the compact video section of telemetry.
+
+    Args:
+        peers: Dict of {client_id: PeerStats}
+
+    Returns:
+        Dict with totals and worst-case link figures across peers, and each peer's own figures
+    """
+    per_peer = {client_id: stats.get_stats() for client_id, stats in peers.items()}
+    rtts = [s['rtt_ms'] for s in per_peer.values() if s['rtt_ms'] is not None]
+    losses = [s['loss_pct'] for s in per_peer.values() if s['loss_pct'] is not None]
+    nacks = [s['nacks'] for s in per_peer.values() if s['nacks'] is not None]
+    plis = [s['plis'] for s in per_peer.values() if s['plis'] is not None]
+    return {
+        'peers': len(per_peer),
+        'kbps': sum(s['kbps'] for s in per_peer.values()),
+        'fps': max((s['fps'] for s in per_peer.values()), default=0),
+        'rtt_ms': max(rtts) if rtts else None,
+        'loss_pct': max(losses) if losses else None,
+        'nacks': sum(nacks) if nacks else None,
+        'plis': sum(plis) if plis else None,
+        'by_peer': per_peer
+    }
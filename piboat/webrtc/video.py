@@ -1,18 +1,107 @@
-import fractions
+import asyncio
 import logging
 import math
-from datetime import datetime
 
-import cv2
 import numpy
-from aiortc import VideoStreamTrack
+from aiortc import RTCRtpSender, VideoStreamTrack
+from aiortc.mediastreams import MediaStreamError
 from av import VideoFrame
 
 from piboat.config import VIDEO_WIDTH, VIDEO_HEIGHT, VIDEO_FPS
-from piboat.webrtc.webcam_utils import get_best_webcam_device
+from piboat.webrtc.camera import get_camera_source
+from piboat.webrtc.device_executor import subscribe_source, submit_blocking
+from piboat.webrtc.pacing import FramePacer, FrameTimingStats, VIDEO_TIME_BASE, frame_due
+from piboat.webrtc.overlay import OverlayCompositor
+from piboat.webrtc.pixel_format import copy_frame, plane_view
+from piboat.webrtc.relay import get_video_relay, LayerKey, MAX_PENDING_PACKETS
 
 logger = logging.getLogger("VideoTrack")
 
+# Bitrate used by relayed tracks until the adaptive bitrate controller picks a rung
+RELAY_DEFAULT_BITRATE = 1000000
+
+# Number of distinct frames in the test pattern (one per hue step)
+PATTERN_PERIOD = 180
+
+# Name aiortc's RTCRtpSender keeps its pending keyframe request under (private, pinned in requirements.txt)
+_FORCE_KEYFRAME_ATTR = "_RTCRtpSender__force_keyframe"
+
+
+def negotiated_codec_name(transceiver):
+    """
+    Get the codec negotiated for a transceiver's sender, e.g. "VP8" or "H264".
+    
+    Uses the sender's parameters where aiortc exposes them, otherwise the
+    transceiver's negotiated codec list, falling back to aiortc's preferred
+    video codec if neither is available.
+    """
+    codecs = None
+    get_parameters = getattr(transceiver.sender, "getParameters", None)
+    if get_parameters is not None:
+        codecs = getattr(get_parameters(), "codecs", None)
+    if not codecs:
+        codecs = getattr(transceiver, "_codecs", None)
+    if not codecs:
+        codecs = RTCRtpSender.getCapabilities("video").codecs
+    return codecs[0].mimeType.split("/")[1].upper()
+
+
+def take_keyframe_request(sender):
+    """
+    Check for and clear a picture loss / full intra request the peer sent to a sender.
+    
+    aiortc has no public hook for these, so the flag its encoder loop reads is
+    taken over instead. If it is missing, requests are ignored and peers
+    recover at the encoder's next periodic keyframe.
+    """
+    if not getattr(sender, _FORCE_KEYFRAME_ATTR, False):
+        return False
+    setattr(sender, _FORCE_KEYFRAME_ATTR, False)
+    return True
+
+
+def _build_hue_lut():
+    """
+    Build the BGR colour for each of the PATTERN_PERIOD hue steps
+    used by the test pattern gradient.
+    """
+    hue = numpy.arange(PATTERN_PERIOD, dtype=numpy.float64)
+    
+    # Red -> yellow -> green -> cyan, matching the original per-pixel formula
+    r = numpy.select([hue < 60, hue < 120], [255, (120 - hue) * 4.25], 0)
+    g = numpy.where(hue < 60, hue * 4.25, 255)
+    b = numpy.where(hue >= 120, (hue - 120) * 4.25, 0)
+    return numpy.stack([b, g, r], axis=1).astype(numpy.uint8)  # OpenCV uses BGR
+
+
+def _build_pattern_frames(width, height):
+    """
+    Precompute all PATTERN_PERIOD test pattern frames.
+    
+    The hue of pixel (x, y) in frame n is (n + x + y) % PATTERN_PERIOD, so every
+    frame is a diagonal window onto one colour strip. Each frame is returned as a
+    read-only strided view into that strip, which caches all of them in a few KB
+    instead of hundreds of MB.
+    
+    Returns:
+        List of (height, width, 3) BGR views, indexed by frame counter
+    """
+    lut = _build_hue_lut()
+    strip_length = PATTERN_PERIOD + height + width
+    strip = numpy.ascontiguousarray(lut[numpy.arange(strip_length) % PATTERN_PERIOD])
+    strip.flags.writeable = False
+    
+    pixel_stride, channel_stride = strip.strides
+    frames = []
+    for counter in range(PATTERN_PERIOD):
+        frames.append(numpy.lib.stride_tricks.as_strided(
+            strip[counter:],
+            shape=(height, width, 3),
+            strides=(pixel_stride, pixel_stride, channel_stride),
+            writeable=False
+        ))
+    return frames
+
 
 class TestPatternVideoTrack(VideoStreamTrack):
     """
@@ -24,72 +113,28 @@ class TestPatternVideoTrack(VideoStreamTrack):
         self._fps = VIDEO_FPS
         self.width = VIDEO_WIDTH
         self.height = VIDEO_HEIGHT
-        self._timestamp = 0
         self.kind = "video"
-        self._time_base = fractions.Fraction(1, 90000)
         
-        # Define supported codecs to ensure compatibility
-        self._supported_codecs = ["VP8", "H264"]
-        logger.info(f"Video track initialized with supported codecs: {', '.join(self._supported_codecs)}")
+        # Release frames on the monotonic clock and record how they are delivered
+        self._pacer = FramePacer(self._fps)
+        self.timing = FrameTimingStats()
         
         # Set up a simple static image for fallback
         self._static_image = numpy.zeros((self.height, self.width, 3), dtype=numpy.uint8)
         self._static_image[:, :, 0] = 255  # Make it red for easy identification
         
-        logger.info(f"Using test pattern video stream with {self.width}x{self.height} resolution at {self._fps}fps")
-        
-    def get_codec_compatibility(self, remote_sdp):
-        """
-        Check if the remote SDP offer contains compatible codecs.
-        Returns a tuple (compatible, message) where compatible is a boolean
-        and message contains details if not compatible.
-        """
-        if not remote_sdp:
-            return (False, "No remote SDP provided")
-            
-        # Simple SDP parsing to check for codecs
-        remote_codecs = []
+        # Precompute the pattern once; every frame is a view into it
+        self._pattern_frames = _build_pattern_frames(self.width, self.height)
+        self._overlay = OverlayCompositor()
         
-        # Look for codec information in the SDP
-        lines = remote_sdp.split("\n")
-        for line in lines:
-            # Check for rtpmap entries (which define codecs)
-            if line.startswith("a=rtpmap:"):
-                # Extract codec name from rtpmap
-                codec_info = line.split(" ")[1].split("/")[0].upper()
-                remote_codecs.append(codec_info)
-                logger.info(f"Found codec in SDP: {codec_info}")
-                
-            # Also check for fmtp lines which might contain specific codec parameters
-            elif line.startswith("a=fmtp:") and "profile-level-id" in line:
-                remote_codecs.append("H264")  # H.264 specific parameters 
-                logger.info("Detected H.264 parameters in SDP")
-                
-        # If no specific codec info was found but we see a video section,
-        # assume basic compatibility rather than rejecting
-        if not remote_codecs and "m=video" in remote_sdp:
-            logger.info("No specific codec info found, but video section exists. Assuming compatibility.")
-            return (True, "Assuming compatibility based on video section presence")
-                
-        # Check if we found any compatible codecs
-        compatible_codecs = [c for c in remote_codecs if c in self._supported_codecs or c in ["H264", "VP8"]]
+        logger.info(f"Using test pattern video stream with {self.width}x{self.height} resolution at {self._fps}fps")
         
-        if compatible_codecs:
-            return (True, f"Found compatible codecs: {', '.join(compatible_codecs)}")
-        elif remote_codecs:
-            # If we found codecs but none are compatible, return false
-            return (False, f"Found incompatible codecs: {', '.join(remote_codecs)}")
-        else:
-            # More permissive: if we have a video section but couldn't parse codecs, assume it's OK
-            # Most browsers will support at least H.264 or VP8
-            return (True, "No video codecs explicitly found in remote SDP, assuming default compatibility")
-    
     async def recv(self):
         pts, time_base = await self._next_timestamp()
         
         try:
             # Create a test pattern
-            return await self._create_pattern_frame(pts, time_base)
+            frame = await self._create_pattern_frame(pts, time_base)
                 
         except Exception as e:
             logger.error(f"Error in video frame generation: {e}")
@@ -97,298 +142,283 @@ class TestPatternVideoTrack(VideoStreamTrack):
             frame = VideoFrame.from_ndarray(self._static_image, format="bgr24")
             frame.pts = pts
             frame.time_base = time_base
-            return frame
+        
+        self.timing.record(pts)
+        return frame
     
     async def _create_pattern_frame(self, pts, time_base):
         """Create a simple color pattern."""
-        # Create a simple color pattern
-        img = numpy.zeros((self.height, self.width, 3), dtype=numpy.uint8)
-        
-        # Increment counter
-        self._counter = (self._counter + 1) % 360
+        # The pattern repeats every PATTERN_PERIOD frames
+        self._counter = (self._counter + 1) % PATTERN_PERIOD
         
-        # Simple color gradient
-        for y in range(self.height):
-            for x in range(self.width):
-                hue = (self._counter + y + x) % 180
-                if hue < 60:
-                    r, g, b = 255, int(hue * 4.25), 0
-                elif hue < 120:
-                    r, g, b = int((120 - hue) * 4.25), 255, 0
-                else:
-                    r, g, b = 0, 255, int((hue - 120) * 4.25)
-                img[y, x] = [b, g, r]  # OpenCV uses BGR
+        # Copy the cached pattern straight into the frame and composite the banner over it
+        frame = VideoFrame(self.width, self.height, "bgr24")
+        numpy.copyto(plane_view(frame.planes[0], channels=3), self._pattern_frames[self._counter])
+        self._overlay.apply(frame)
         
-        # Add timestamp to the frame
-        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        cv2.putText(
-            img, 
-            f"PiBoat - {timestamp}", 
-            (20, 40), 
-            cv2.FONT_HERSHEY_SIMPLEX, 
-            0.8, 
-            (255, 255, 255), 
-            2
-        )
-        
-        # Create VideoFrame from numpy array
-        frame = VideoFrame.from_ndarray(img, format="bgr24")
         frame.pts = pts
         frame.time_base = time_base
         return frame
             
     async def _next_timestamp(self):
-        """Generate the next frame timestamp."""
-        self._timestamp += int(90000 / self._fps)
-        return self._timestamp, self._time_base 
+        """
+        Wait until the next frame is due and timestamp it with the time it was
+        actually released, so timestamps follow the wall clock instead of
+        counting frames.
+        """
+        pts = await self._pacer.wait()
+        return pts, VIDEO_TIME_BASE
+    
+    def get_timing_stats(self):
+        """Get frame delivery jitter, drift and latency for this track."""
+        stats = self.timing.get_stats()
+        stats['late_frames'] = self._pacer.late_frames
+        return stats
 
 
 class WebcamVideoTrack(VideoStreamTrack):
     """
-    A video track that captures frames from a USB webcam.
+    A video track that streams frames from the shared USB webcam capture.
+    Each peer gets its own lightweight track; the device itself is owned
+    by the process-wide CameraSource.
     """
-    def __init__(self, device_id=None):
+    def __init__(self, device_id=None, source=None):
         super().__init__()
         self._fps = VIDEO_FPS
         self.width = VIDEO_WIDTH
         self.height = VIDEO_HEIGHT
-        self._timestamp = 0
         self.kind = "video"
-        self._time_base = fractions.Fraction(1, 90000)
         
-        # If no device_id is provided, try to find the best one
-        if device_id is None:
-            logger.info(f"No device ID provided, searching for best webcam device...")
-            self._device_id = get_best_webcam_device(VIDEO_WIDTH, VIDEO_HEIGHT)
-            logger.info(f"Selected best webcam device ID: {self._device_id}")
-        else:
-            self._device_id = device_id
-            
-        self._cap = None
+        # Shared capture, subscribed to in start()
+        self._source = source if source is not None else get_camera_source(device_id)
+        self._subscribed = False
+        self._device_id = self._source.device_id
+        self._last_seq = 0
         
-        # Define supported codecs to ensure compatibility
-        self._supported_codecs = ["VP8", "H264"]
+        # Output size and frame rate, lowered by the adaptive bitrate controller
+        self._output_width = self.width
+        self._output_height = self.height
+        self._output_fps = self._fps
+        self._last_pts = None
         
-        # Set up a simple static image for fallback
-        self._static_image = numpy.zeros((self.height, self.width, 3), dtype=numpy.uint8)
-        self._static_image[:, :, 0] = 255  # Make it red for easy identification
-        
-        # Initialize webcam with retry logic
-        self._initialize_webcam()
-        
-    def _initialize_webcam(self):
-        """Attempt to initialize the webcam with retry logic and device discovery."""
-        # First try the specified device ID
-        logger.info(f"Attempting to open webcam with device ID: {self._device_id}")
-        
-        # Release any existing capture if it exists
-        if self._cap is not None:
-            self._cap.release()
-            logger.info("Released existing webcam capture")
-        
-        # Try to connect with the specified device ID
-        self._cap = cv2.VideoCapture(self._device_id)
+        # Delivery timing of frames against their capture timestamps
+        self.timing = FrameTimingStats()
+    
+    def set_output(self, width, height, fps, bitrate=None):
+        """
+        Change the resolution and frame rate sent to this peer.
+        The encoder picks up the new size on the next frame, so no renegotiation is needed.
+        The bitrate is set on this peer's own encoder by the caller and is ignored here.
+        """
+        self._output_width = width
+        self._output_height = height
+        self._output_fps = fps
+    
+    async def start(self):
+        """
+        Subscribe to the shared capture, opening the device if nobody else has.
+        The open runs on the video device thread, not the event loop.
         
-        # If that fails, try to find an available webcam by scanning other device IDs
-        if not self._cap.isOpened():
-            logger.warning(f"Failed to open webcam with device ID: {self._device_id}")
+        Raises:
+            RuntimeError: If the webcam could not be opened in time
+        """
+        await subscribe_source(self._source)
+        self._subscribed = True
+        self._device_id = self._source.device_id
+    
+    def stop(self):
+        """Stop the track and drop its subscription to the shared capture."""
+        if self._subscribed:
+            self._subscribed = False
+            # Releasing the device joins the capture thread, so keep it off the event loop
+            submit_blocking(self._source.unsubscribe)
+        super().stop()
+    
+    async def recv(self):
+        try:
+            # Get the next frame from the shared capture; it already carries its
+            # capture timestamp and is in the encoder's pixel format
+            frame = await self._next_frame()
             
-            # Try a few different device IDs
-            for device_id in range(10):  # Try devices 0-9
-                if device_id == self._device_id:
-                    continue  # Skip the one we already tried
-                
-                logger.info(f"Trying alternative webcam device ID: {device_id}")
-                self._cap = cv2.VideoCapture(device_id)
+            if frame.width != self._output_width or frame.height != self._output_height:
+                frame = await self._source.get_scaled_frame(
+                    self._last_seq, frame, self._output_width, self._output_height
+                )
+            # The captured and scaled frames are shared by every peer, and aiortc's encoder
+            # sets pict_type on the frame it encodes to force keyframes: give it this peer's own copy
+            frame = copy_frame(frame)
+            self.timing.record(frame.pts)
+            return frame
                 
-                if self._cap.isOpened():
-                    logger.info(f"Successfully opened webcam with alternative device ID: {device_id}")
-                    self._device_id = device_id
-                    break
-                else:
-                    self._cap.release()
-        
-        # If we still couldn't open a webcam, raise an error
-        if not self._cap.isOpened():
-            logger.error(f"Failed to open any webcam device")
-            raise RuntimeError("Could not open webcam with any available device ID")
-        
-        # Add a small delay after opening to ensure the device is ready
-        import time
-        time.sleep(1.0)  # Increased delay to 1 second for better stability
-        
-        # Set webcam properties
-        self._cap.set(cv2.CAP_PROP_FRAME_WIDTH, self.width)
-        self._cap.set(cv2.CAP_PROP_FRAME_HEIGHT, self.height)
-        self._cap.set(cv2.CAP_PROP_FPS, self._fps)
+        except Exception as e:
+            logger.error(f"Error capturing webcam frame: {e}")
+            raise RuntimeError(f"Unrecoverable webcam error: {e}")
+    
+    async def _next_frame(self):
+        """
+        Get the next captured frame, skipping frames to honour the output frame
+        rate, or the idle frame rate while the scene is static.
+        """
+        while True:
+            self._last_seq, frame = await self._source.get_frame(self._last_seq)
+            fps = self._source.effective_fps(self._output_fps)
+            if frame_due(frame.pts, self._last_pts, fps, self._source.fps):
+                self._last_pts = frame.pts
+                return frame
+    
+    def get_timing_stats(self):
+        """Get frame delivery jitter, drift and latency for this track."""
+        return self.timing.get_stats()
+
+
+class RelayVideoTrack(VideoStreamTrack):
+    """
+    A video track that forwards packets from the shared encoding relay.
+    The frames are encoded once per codec and ladder rung, and aiortc only
+    packetizes the relayed packets for this peer.
+    """
+    def __init__(self, width=VIDEO_WIDTH, height=VIDEO_HEIGHT, fps=VIDEO_FPS, bitrate=None, relay=None):
+        """
+        Args:
+            width: Initial output width
+            height: Initial output height
+            fps: Initial output frame rate
+            bitrate: Initial target bitrate in bits per second
+            relay: VideoRelay to take packets from (defaults to the process-wide relay)
+        """
+        super().__init__()
+        self._fps = VIDEO_FPS
+        self.width = VIDEO_WIDTH
+        self.height = VIDEO_HEIGHT
+        self.kind = "video"
         
-        # Try to read a test frame to ensure the camera is working
-        for _ in range(3):  # Try multiple times to get a frame
-            ret, _ = self._cap.read()
-            if ret:
-                break
-            time.sleep(0.2)  # Short delay between attempts
+        # Shared capture, kept open from start() until the track stops
+        self._relay = relay if relay is not None else get_video_relay()
+        self._source = self._relay.source
+        self._subscribed = False
+        self._device_id = self._source.device_id
         
-        if not ret:
-            logger.error("Webcam opened but failed to capture test frame")
-            self._cap.release()
-            raise RuntimeError("Webcam opened but failed to capture test frame")
+        # Output requested by the adaptive bitrate controller, applied on the next recv()
+        self._output = (width, height, fps, bitrate or RELAY_DEFAULT_BITRATE)
+        self._layer = None
+        self._transceiver = None
         
-        # Get actual properties (may differ from requested)
-        actual_width = int(self._cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-        actual_height = int(self._cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-        actual_fps = self._cap.get(cv2.CAP_PROP_FPS)
+        # Packets relayed to this peer; after joining or falling behind, wait for a keyframe
+        self._packets = asyncio.Queue()
+        self._waiting_keyframe = True
+        self.packets_dropped = 0
         
-        logger.info(f"Webcam initialized with device ID {self._device_id}")
-        logger.info(f"Requested resolution: {self.width}x{self.height}, fps: {self._fps}")
-        logger.info(f"Actual resolution: {actual_width}x{actual_height}, fps: {actual_fps}")
+        # Delivery timing of packets against their capture timestamps
+        self.timing = FrameTimingStats()
+    
+    def attach(self, pc):
+        """
+        Bind the track to the peer connection it was added to, so the negotiated
+        codec and the peer's keyframe requests can be read from its sender.
+        """
+        for transceiver in pc.getTransceivers():
+            if transceiver.sender.track is self:
+                self._transceiver = transceiver
+                return
+        raise RuntimeError("Track has not been added to the peer connection")
     
-    def __del__(self):
-        """Release webcam when the object is garbage collected."""
-        if hasattr(self, '_cap') and self._cap is not None:
-            self._cap.release()
-            logger.info("Webcam released")
+    async def start(self):
+        """
+        Subscribe to the shared capture, opening the device if nobody else has.
+        The open runs on the video device thread, not the event loop.
+        
+        Raises:
+            RuntimeError: If the webcam could not be opened in time
+        """
+        await subscribe_source(self._source)
+        self._subscribed = True
+        self._device_id = self._source.device_id
     
-    def get_codec_compatibility(self, remote_sdp):
+    def set_output(self, width, height, fps, bitrate=None):
         """
-        Check if the remote SDP offer contains compatible codecs.
-        Returns a tuple (compatible, message) where compatible is a boolean
-        and message contains details if not compatible.
+        Change the ladder rung sent to this peer. The track moves to the
+        matching encoding layer, which starts the peer on a keyframe.
         """
-        if not remote_sdp:
-            return (False, "No remote SDP provided")
-            
-        # Simple SDP parsing to check for codecs
-        remote_codecs = []
+        self._output = (width, height, fps, bitrate or self._output[3])
+    
+    def stop(self):
+        """Stop the track and leave its encoding layer and the shared capture."""
+        if self._layer is not None:
+            self._relay.unsubscribe(self, self._layer)
+            self._layer = None
+        if self._subscribed:
+            self._subscribed = False
+            # Releasing the device joins the capture thread, so keep it off the event loop
+            submit_blocking(self._source.unsubscribe)
+        super().stop()
+    
+    def push(self, packet):
+        """Queue a packet from the encoding layer. Called on the event loop."""
+        if self._waiting_keyframe:
+            if not packet.is_keyframe:
+                return
+            self._waiting_keyframe = False
         
-        # Look for codec information in the SDP
-        lines = remote_sdp.split("\n")
-        for line in lines:
-            # Check for rtpmap entries (which define codecs)
-            if line.startswith("a=rtpmap:"):
-                # Extract codec name from rtpmap
-                codec_info = line.split(" ")[1].split("/")[0].upper()
-                remote_codecs.append(codec_info)
-                logger.info(f"Found codec in SDP: {codec_info}")
-                
-            # Also check for fmtp lines which might contain specific codec parameters
-            elif line.startswith("a=fmtp:") and "profile-level-id" in line:
-                remote_codecs.append("H264")  # H.264 specific parameters 
-                logger.info("Detected H.264 parameters in SDP")
-                
-        # If no specific codec info was found but we see a video section,
-        # assume basic compatibility rather than rejecting
-        if not remote_codecs and "m=video" in remote_sdp:
-            logger.info("No specific codec info found, but video section exists. Assuming compatibility.")
-            return (True, "Assuming compatibility based on video section presence")
-                
-        # Check if we found any compatible codecs
-        compatible_codecs = [c for c in remote_codecs if c in self._supported_codecs or c in ["H264", "VP8"]]
+        if self._packets.qsize() >= MAX_PENDING_PACKETS:
+            # The peer is not keeping up; skip ahead to the next keyframe
+            self._drop_pending()
+            self._waiting_keyframe = True
+            self._layer.request_keyframe()
+            return
+        self._packets.put_nowait(packet)
+    
+    def fail(self, error):
+        """Make the pending recv() fail with an encoding error."""
+        self._packets.put_nowait(error)
+    
+    def _drop_pending(self):
+        while not self._packets.empty():
+            self._packets.get_nowait()
+            self.packets_dropped += 1
+    
+    def _codec_name(self):
+        """Get the codec negotiated for this track's sender."""
+        if self._transceiver is None:
+            raise RuntimeError("No codec negotiated for the relayed track")
+        return negotiated_codec_name(self._transceiver)
+    
+    def _update_layer(self):
+        """Join the encoding layer matching the negotiated codec and requested output."""
+        key = LayerKey(self._codec_name(), *self._output)
+        if self._layer is not None and self._layer.key == key:
+            return
         
-        if compatible_codecs:
-            return (True, f"Found compatible codecs: {', '.join(compatible_codecs)}")
-        elif remote_codecs:
-            # If we found codecs but none are compatible, return false
-            return (False, f"Found incompatible codecs: {', '.join(remote_codecs)}")
-        else:
-            # More permissive: if we have a video section but couldn't parse codecs, assume it's OK
-            # Most browsers will support at least H.264 or VP8
-            return (True, "No video codecs explicitly found in remote SDP, assuming default compatibility")
+        if self._layer is not None:
+            self._relay.unsubscribe(self, self._layer)
+        self._drop_pending()
+        self._waiting_keyframe = True
+        self._layer = self._relay.subscribe(self, key)
+    
+    def _handle_keyframe_request(self):
+        """Forward picture loss / full intra requests from the peer to the encoding layer."""
+        if take_keyframe_request(self._transceiver.sender):
+            self._layer.request_keyframe()
     
     async def recv(self):
-        pts, time_base = await self._next_timestamp()
+        if self.readyState != "live":
+            raise MediaStreamError
         
         try:
-            # Check if webcam is still open, if not try to reinitialize
-            if not self._cap.isOpened():
-                logger.warning("Webcam connection lost, attempting to reconnect...")
-                try:
-                    self._initialize_webcam()
-                except Exception as e:
-                    logger.error(f"Failed to reconnect to webcam: {e}")
-                    raise RuntimeError("Failed to reconnect to webcam")
-            
-            # Capture frame from webcam
-            ret, img = self._cap.read()
-            
-            if not ret:
-                logger.warning("Failed to capture frame, attempting to reconnect...")
-                try:
-                    # Close and reopen the camera
-                    self._cap.release()
-                    self._initialize_webcam()
-                    # Try to read again
-                    ret, img = self._cap.read()
-                    if not ret:
-                        raise RuntimeError("Still failed to capture frame after reconnect")
-                except Exception as e:
-                    logger.error(f"Failed to reconnect to webcam: {e}")
-                    raise RuntimeError(f"Failed to capture frame and reconnect: {e}")
-            
-            # Resize the frame if needed to match expected dimensions
-            if img.shape[1] != self.width or img.shape[0] != self.height:
-                img = cv2.resize(img, (self.width, self.height))
-            
-            # Add timestamp to the frame
-            timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            cv2.putText(
-                img, 
-                f"PiBoat - {timestamp}", 
-                (20, 40), 
-                cv2.FONT_HERSHEY_SIMPLEX, 
-                0.8, 
-                (255, 255, 255), 
-                2
-            )
-            
-            # Create VideoFrame from numpy array
-            frame = VideoFrame.from_ndarray(img, format="bgr24")
-            frame.pts = pts
-            frame.time_base = time_base
-            return frame
-                
+            self._update_layer()
+            self._handle_keyframe_request()
+            packet = await self._packets.get()
         except Exception as e:
-            logger.error(f"Error capturing webcam frame: {e}")
-            # Try one more time to reconnect
-            try:
-                logger.info("Attempting emergency webcam reconnection...")
-                self._cap.release()
-                import time
-                time.sleep(1)  # Give more time for the device to be released
-                self._initialize_webcam()
-                
-                # If we reconnected successfully, try to get a frame again
-                ret, img = self._cap.read()
-                if ret:
-                    # Resize the frame if needed to match expected dimensions
-                    if img.shape[1] != self.width or img.shape[0] != self.height:
-                        img = cv2.resize(img, (self.width, self.height))
-                        
-                    # Add timestamp to the frame
-                    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                    cv2.putText(
-                        img, 
-                        f"PiBoat - {timestamp}", 
-                        (20, 40), 
-                        cv2.FONT_HERSHEY_SIMPLEX, 
-                        0.8, 
-                        (255, 255, 255), 
-                        2
-                    )
-                    
-                    # Create VideoFrame from numpy array
-                    frame = VideoFrame.from_ndarray(img, format="bgr24")
-                    frame.pts = pts
-                    frame.time_base = time_base
-                    return frame
-                    
-            except Exception as reconnect_error:
-                logger.error(f"Emergency webcam reconnection failed: {reconnect_error}")
-                
-            # At this point, we have no choice but to raise the error
+            logger.error(f"Error relaying webcam video: {e}")
             raise RuntimeError(f"Unrecoverable webcam error: {e}")
+        
+        if isinstance(packet, Exception):
+            logger.error(f"Error relaying webcam video: {packet}")
+            raise RuntimeError(f"Unrecoverable webcam error: {packet}")
+        self.timing.record(packet.pts)
+        return packet
     
-    async def _next_timestamp(self):
-        """Generate the next frame timestamp."""
-        self._timestamp += int(90000 / self._fps)
-        return self._timestamp, self._time_base 
\ No newline at end of file
+    def get_timing_stats(self):
+        """Get packet delivery jitter, drift and latency for this track."""
+        stats = self.timing.get_stats()
+        stats['packets_dropped'] = self.packets_dropped
+        return stats
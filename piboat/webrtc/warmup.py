@@ -0,0 +1,308 @@
+import asyncio
+import logging
+import statistics
+import time
+from collections import deque
+
+from aiortc import RTCPeerConnection
+
+from piboat.config import VIDEO_PREWARM_PEERS, VIDEO_RELAY, VIDEO_CODEC_PREFERENCE
+from piboat.webrtc.adaptive import get_default_ladder
+from piboat.webrtc.camera import get_camera_source
+from piboat.webrtc.device_executor import subscribe_source, submit_blocking
+from piboat.webrtc.ice import gather_candidates
+from piboat.webrtc.relay import get_video_relay, LayerKey, RELAY_CODECS
+
+logger = logging.getLogger("WarmPool")
+
+# Pooled peer connections older than this are replaced, so their host candidates follow network changes
+MAX_PEER_AGE = 120.0
+
+# Seconds before retrying after a pooled peer connection could not be prepared
+RETRY_INTERVAL = 10.0
+
+# Stages of a viewer session's startup, in the order they happen, in milliseconds from the signaling message
+STARTUP_STAGES = ("camera_ready", "answer_sent", "ice_connected", "first_frame")
+
+# Completed session startups kept for the rolling statistics
+STARTUP_HISTORY = 20
+
+# Process-wide pool shared by every WebRTC handler
+_shared_pool = None
+
+
+class WarmPool:
+    """
+    Keeps everything a new viewer needs ready before it asks: the capture
+    running, peer connections with ICE gathering already finished, and the
+    relay encoder for the first ladder rung opened.
+
+    A viewer takes a pooled peer connection, which already has a sendonly
+    video transceiver whose transport has gathered (and filtered) its
+    candidates, so setRemoteDescription/setLocalDescription do not wait for
+    gathering. The pool is refilled in the background.
+    """
+    def __init__(self, size=VIDEO_PREWARM_PEERS, source=None):
+        """
+        Args:
+            size: Number of peer connections to keep ready
+            source: CameraSource to keep running (defaults to the process-wide source)
+        """
+        self.size = size
+        self._source = source
+        self._ready = deque()
+        # Expired peer connections taken out by take(), closed by the maintenance loop
+        self._expired = []
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self._running = False
+        self._subscribed = False
+        self._primed_key = None
+
+        # Pool statistics
+        self.peers_taken = 0
+        self.peers_missed = 0
+        self.peers_expired = 0
+
+    def is_running(self):
+        return self._running
+
+    async def start(self):
+        """Start the capture, prime the encoder and begin filling the pool."""
+        if self._running:
+            return
+        self._running = True
+        self._task = asyncio.create_task(self._maintain_loop())
+
+        try:
+            if self._source is None:
+                self._source = get_camera_source()
+            await subscribe_source(self._source)
+            self._subscribed = True
+            logger.info("Keeping the webcam capture running for new viewers")
+        except Exception as e:
+            logger.warning(f"Could not pre-open the webcam: {str(e)}")
+
+        if VIDEO_RELAY:
+            await self._prime_encoder()
+
+    async def stop(self):
+        """Close the pooled peer connections and release the capture and encoder."""
+        self._running = False
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+        while self._ready:
+            pc, _ = self._ready.popleft()
+            await pc.close()
+        await self._close_expired()
+
+        if self._primed_key is not None:
+            get_video_relay().unprime(self._primed_key)
+            self._primed_key = None
+        if self._subscribed:
+            self._subscribed = False
+            submit_blocking(self._source.unsubscribe)
+
+    async def _prime_encoder(self):
+        """Open the relay encoder new viewers start on: the preferred codec at the top ladder rung."""
+        codecs = [c for c in VIDEO_CODEC_PREFERENCE if c in RELAY_CODECS]
+        if not codecs:
+            return
+        key = LayerKey(codecs[0], *get_default_ladder()[0])
+        try:
+            await get_video_relay().prime(key)
+            self._primed_key = key
+            logger.info(f"Primed {key.codec} encoder for {key.width}x{key.height}@{key.fps}")
+        except Exception as e:
+            logger.warning(f"Could not prime the {key.codec} encoder: {str(e)}")
+
+    def take(self):
+        """
+        Take a ready peer connection out of the pool.
+
+        Returns:
+            An RTCPeerConnection with ICE gathered, or None if none is ready
+        """
+        now = time.monotonic()
+        pc = None
+        while self._ready:
+            candidate, created = self._ready.popleft()
+            if now - created <= MAX_PEER_AGE:
+                pc = candidate
+                break
+            self.peers_expired += 1
+            self._expired.append(candidate)
+
+        if pc is None:
+            self.peers_missed += 1
+        else:
+            self.peers_taken += 1
+        self._wakeup.set()
+        return pc
+
+    async def _prepare_peer_connection(self):
+        """Create a peer connection with a video transceiver and gather its candidates."""
+        pc = RTCPeerConnection()
+        try:
+            pc.addTransceiver("video", direction="sendonly")
+            await gather_candidates(pc)
+        except Exception:
+            await pc.close()
+            raise
+        return pc
+
+    async def _close_expired(self):
+        """Close the expired peer connections take() skipped over."""
+        while self._expired:
+            await self._expired.pop().close()
+
+    async def _maintain_loop(self):
+        """Keep the pool full, replacing peer connections before they go stale."""
+        while self._running:
+            await self._close_expired()
+            now = time.monotonic()
+            while self._ready and now - self._ready[0][1] > MAX_PEER_AGE:
+                pc, _ = self._ready.popleft()
+                self.peers_expired += 1
+                await pc.close()
+
+            wait = MAX_PEER_AGE
+            while self._running and len(self._ready) < self.size:
+                try:
+                    self._ready.append((await self._prepare_peer_connection(), time.monotonic()))
+                except Exception as e:
+                    logger.warning(f"Error preparing a peer connection: {str(e)}")
+                    wait = RETRY_INTERVAL
+                    break
+
+            if self._ready:
+                wait = min(wait, MAX_PEER_AGE - (time.monotonic() - self._ready[0][1]))
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), max(wait, 1.0))
+            except asyncio.TimeoutError:
+                pass
+
+    def get_stats(self):
+        """Get pool statistics."""
+        return {
+            'ready': len(self._ready),
+            'taken': self.peers_taken,
+            'missed': self.peers_missed,
+            'expired': self.peers_expired,
+            'capture': self._subscribed,
+            'encoder_primed': self._primed_key is not None
+        }
+
+
+class StartupTimer:
+    """
+    Times one viewer session's startup in stages, from its signaling message
+    to the first frame its video track hands to the sender.
+    """
+    def __init__(self, client_id, received=None):
+        """
+        Args:
+            client_id: Client the session is for
+            received: time.monotonic() when the signaling message arrived (defaults to now)
+        """
+        self.client_id = client_id
+        self.received = received if received is not None else time.monotonic()
+        self.prewarmed = False
+        self.stages = {}
+        self._on_complete = None
+
+    @property
+    def complete(self):
+        return "first_frame" in self.stages
+
+    def mark(self, stage):
+        """Record when a stage was reached, unless it already was."""
+        if stage not in self.stages:
+            self.stages[stage] = (time.monotonic() - self.received) * 1000
+            if stage == "first_frame" and self._on_complete is not None:
+                self._on_complete(self)
+
+    def watch(self, pc, on_complete):
+        """
+        Record the ICE and first frame stages of a peer connection.
+        Call once the local description is set.
+
+        The first frame is taken from the video track's delivery timing: it is
+        the frame aiortc encodes (or, for relayed tracks, packetizes) and sends
+        as the session's first RTP.
+
+        Args:
+            pc: The session's RTCPeerConnection
+            on_complete: Called with this timer once the first frame is sent
+        """
+        self._on_complete = on_complete
+
+        @pc.on("iceconnectionstatechange")
+        def on_iceconnectionstatechange():
+            if pc.iceConnectionState == "completed":
+                self.mark("ice_connected")
+
+        for sender in pc.getSenders():
+            timing = getattr(sender.track, "timing", None)
+            if timing is not None:
+                if timing.frames:
+                    self.mark("first_frame")
+                else:
+                    timing.on_first_frame = lambda: self.mark("first_frame")
+                break
+
+    def get_stages(self):
+        """Get the stages reached so far, in whole milliseconds."""
+        return {stage: round(self.stages[stage]) for stage in STARTUP_STAGES if stage in self.stages}
+
+
+class StartupStats:
+    """Rolling time-to-first-frame statistics over recent viewer sessions."""
+    def __init__(self, history=STARTUP_HISTORY):
+        self._timers = deque(maxlen=history)
+        self.sessions = 0
+        self.prewarmed = 0
+
+    def record(self, timer):
+        """Add a completed session startup."""
+        self._timers.append(timer)
+        self.sessions += 1
+        if timer.prewarmed:
+            self.prewarmed += 1
+
+        stages = ", ".join(f"{stage} {ms}ms" for stage, ms in timer.get_stages().items())
+        warm = "prewarmed" if timer.prewarmed else "cold"
+        logger.info(f"First frame to client {timer.client_id} after {timer.stages['first_frame']:.0f}ms ({warm}: {stages})")
+
+    def get_stats(self):
+        """Get the session count, the last session's stages and the median of each stage."""
+        if not self._timers:
+            return {'sessions': 0}
+
+        median = {}
+        for stage in STARTUP_STAGES:
+            values = [t.stages[stage] for t in self._timers if stage in t.stages]
+            if values:
+                median[stage] = round(statistics.median(values))
+        return {
+            'sessions': self.sessions,
+            'prewarmed': self.prewarmed,
+            'last': self._timers[-1].get_stages(),
+            'median': median
+        }
+
+
+def get_warm_pool():
+    """
+    Get the process-wide warm pool, creating it on first use.
+
+    Returns:
+        The shared WarmPool instance
+    """
+    global _shared_pool
+    if _shared_pool is None:
+        _shared_pool = WarmPool()
+    return _shared_pool
@@ -1,11 +1,20 @@
 import cv2
 import logging
 import glob
+import json
 import os
 import time
 
+from piboat.config import WEBCAM_CACHE_FILE
+
 logger = logging.getLogger("WebcamUtils")
 
+# Resolutions probed for every device in addition to the requested one
+PROBE_RESOLUTIONS = [(1280, 720), (640, 480)]
+
+# Pixel formats probed for every device
+PROBE_FOURCCS = ["MJPG", "YUYV"]
+
 class WebcamDetector:
     """
     Utility class to detect and validate available webcam devices.
@@ -279,9 +288,310 @@ class WebcamDetector:
             logger.error("No suitable webcam device found")
             return None, 0, 0
 
+    @staticmethod
+    def get_device_identity(device_path):
+        """
+        Get a stable identity for a V4L device that survives renumbering.
+        
+        The identity is built from the device name plus its USB serial number
+        when available, falling back to the resolved sysfs path of the device.
+        
+        Args:
+            device_path: Path to the video device (e.g., /dev/video0)
+            
+        Returns:
+            Identity string
+        """
+        node = os.path.basename(device_path)
+        sysfs_dir = f"/sys/class/video4linux/{node}"
+        
+        name = ""
+        try:
+            with open(os.path.join(sysfs_dir, "name")) as f:
+                name = f.read().strip()
+        except OSError:
+            pass
+        
+        sysfs_path = os.path.realpath(os.path.join(sysfs_dir, "device"))
+        
+        # USB cameras expose their serial on the parent USB device
+        serial = None
+        for candidate in (os.path.join(sysfs_path, "serial"), os.path.join(os.path.dirname(sysfs_path), "serial")):
+            try:
+                with open(candidate) as f:
+                    serial = f.read().strip() or None
+                break
+            except OSError:
+                continue
+        
+        # Several nodes can belong to one camera (e.g. metadata nodes), so keep the node index too
+        index = ""
+        try:
+            with open(os.path.join(sysfs_dir, "index")) as f:
+                index = f.read().strip()
+        except OSError:
+            pass
+        
+        return f"{name}|{serial or sysfs_path}|{index}"
+    
+    @staticmethod
+    def probe_capabilities(device_path, target_width, target_height):
+        """
+        Open a device once and record the resolutions, FPS and pixel formats it supports.
+        
+        Resolutions are probed separately for each pixel format, as many cameras
+        only offer their larger modes as MJPEG.
+        
+        Args:
+            device_path: Path to the video device (e.g., /dev/video0)
+            target_width: Resolution width to probe in addition to PROBE_RESOLUTIONS
+            target_height: Resolution height to probe in addition to PROBE_RESOLUTIONS
+            
+        Returns:
+            Dictionary with the device capabilities
+        """
+        device_id = int(device_path.replace('/dev/video', ''))
+        capabilities = {
+            'path': device_path,
+            'id': device_id,
+            'status': 'Failed to open',
+            'resolutions': [],
+            'fourccs': [],
+            'probed_at': time.time()
+        }
+        
+        cap = cv2.VideoCapture(device_id)
+        try:
+            if not cap.isOpened():
+                return capabilities
+            
+            ret, _ = cap.read()
+            if not ret:
+                capabilities['status'] = 'Not capturing frames'
+                return capabilities
+            capabilities['status'] = 'Working'
+            
+            # Pixel formats the driver accepts, each probed for its resolutions (and the fps it reports
+            # for each); without any accepted format the driver's default one is probed
+            resolutions = [(target_width, target_height)] + [r for r in PROBE_RESOLUTIONS if r != (target_width, target_height)]
+            for fourcc in PROBE_FOURCCS:
+                code = cv2.VideoWriter_fourcc(*fourcc)
+                cap.set(cv2.CAP_PROP_FOURCC, code)
+                if int(cap.get(cv2.CAP_PROP_FOURCC)) == code:
+                    capabilities['fourccs'].append(fourcc)
+                    WebcamDetector._probe_resolutions(cap, resolutions, fourcc, capabilities['resolutions'])
+            if not capabilities['fourccs']:
+                WebcamDetector._probe_resolutions(cap, resolutions, None, capabilities['resolutions'])
+        except Exception as e:
+            logger.error(f"Error probing capabilities for {device_path}: {e}")
+            capabilities['status'] = 'Error'
+        finally:
+            cap.release()
+        
+        return capabilities
+    
+    @staticmethod
+    def _probe_resolutions(cap, resolutions, fourcc, found):
+        """
+        Try each resolution in the current pixel format and add the modes the
+        device actually delivers to found, tagged with the pixel format.
+        """
+        for width, height in resolutions:
+            cap.set(cv2.CAP_PROP_FRAME_WIDTH, width)
+            cap.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
+            ret, _ = cap.read()
+            if not ret:
+                continue
+            
+            actual = {
+                'width': int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
+                'height': int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+                'fps': cap.get(cv2.CAP_PROP_FPS),
+                'fourcc': fourcc
+            }
+            if actual not in found:
+                found.append(actual)
+
+
+def fourccs_for_resolution(capabilities, width, height):
+    """
+    Get the pixel formats a probed device delivers a resolution in.
+    
+    Args:
+        capabilities: Capabilities dictionary from the cache
+        width: Capture width
+        height: Capture height
+        
+    Returns:
+        List of FOURCCs, or all of the device's FOURCCs if none was seen at that resolution
+    """
+    fourccs = [r.get('fourcc') for r in capabilities.get('resolutions', [])
+               if r['width'] == width and r['height'] == height and r.get('fourcc')]
+    matching = [f for f in capabilities.get('fourccs', []) if f in fourccs]
+    return matching or list(capabilities.get('fourccs', []))
+
+
+class WebcamCapabilityCache:
+    """
+    Persistent cache of probed webcam capabilities.
+    
+    Entries are keyed by stable device identity and the whole cache is
+    invalidated whenever a /dev/video* node is added, removed or now belongs
+    to another camera, so probing only happens after a camera is plugged,
+    unplugged or renumbered, not on every boot.
+    
+    Each entry holds every mode probed (size, fps and pixel format) and the
+    best mode is chosen from them at lookup time, so changing the preferred
+    pixel format needs no probing. The requested size is probed along with
+    PROBE_RESOLUTIONS and remembered; asking for a size that was not probed
+    probes the devices again.
+    """
+    def __init__(self, cache_file=WEBCAM_CACHE_FILE):
+        self.cache_file = cache_file
+        self._fingerprint = None
+        self._target = None
+        self._devices = {}
+        self._load()
+    
+    @staticmethod
+    def device_fingerprint():
+        """
+        Fingerprint the current video device nodes by the camera behind each one.
+        
+        The device nodes themselves are recreated on every boot and hotplug, so
+        their inode and ctime cannot be used; the sysfs identity (name, USB serial
+        or bus path) stays the same as long as the same camera is in the same place.
+        """
+        return [[device_path, WebcamDetector.get_device_identity(device_path)]
+                for device_path in WebcamDetector.list_v4l_devices()]
+    
+    def _load(self):
+        """Load the cache from disk, ignoring missing or corrupt files."""
+        try:
+            with open(self.cache_file) as f:
+                data = json.load(f)
+            self._fingerprint = data.get('fingerprint')
+            self._target = data.get('target')
+            self._devices = data.get('devices', {})
+            logger.info(f"Loaded webcam capability cache with {len(self._devices)} device(s)")
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable webcam capability cache {self.cache_file}: {e}")
+    
+    def _save(self):
+        """Persist the cache atomically."""
+        try:
+            os.makedirs(os.path.dirname(self.cache_file), exist_ok=True)
+            tmp_file = f"{self.cache_file}.tmp"
+            with open(tmp_file, "w") as f:
+                json.dump({'fingerprint': self._fingerprint, 'target': self._target, 'devices': self._devices}, f, indent=2)
+            os.replace(tmp_file, self.cache_file)
+        except Exception as e:
+            logger.warning(f"Failed to save webcam capability cache: {e}")
+    
+    def is_valid(self, fingerprint=None):
+        """Check whether the cached entries still describe the attached devices."""
+        if fingerprint is None:
+            fingerprint = self.device_fingerprint()
+        return self._fingerprint is not None and self._fingerprint == fingerprint
+    
+    def has_probed(self, width, height):
+        """Check whether the cached entries include a capture size."""
+        return (width, height) in PROBE_RESOLUTIONS or self._target == [width, height]
+    
+    def get_devices(self, target_width, target_height):
+        """
+        Get capabilities for all attached devices, probing only if the devices
+        changed or the target size was not probed before.
+        
+        Args:
+            target_width: Resolution width to probe on a cache miss
+            target_height: Resolution height to probe on a cache miss
+            
+        Returns:
+            Dictionary mapping device identity to its capabilities
+        """
+        fingerprint = self.device_fingerprint()
+        if self.is_valid(fingerprint) and self.has_probed(target_width, target_height):
+            return self._devices
+        
+        logger.info(f"Video devices or requested size ({target_width}x{target_height}) changed, "
+                    f"probing webcam capabilities...")
+        devices = {}
+        for device_path in WebcamDetector.list_v4l_devices():
+            identity = WebcamDetector.get_device_identity(device_path)
+            capabilities = WebcamDetector.probe_capabilities(device_path, target_width, target_height)
+            devices[identity] = capabilities
+            logger.info(f"Probed {device_path} ({identity}): {capabilities['status']}, "
+                        f"resolutions={[(r['width'], r['height']) for r in capabilities['resolutions']]}, "
+                        f"fourccs={capabilities['fourccs']}")
+        
+        self._fingerprint = fingerprint
+        self._target = [target_width, target_height]
+        self._devices = devices
+        self._save()
+        return self._devices
+    
+    def get_cached_device(self, device_id):
+        """
+        Look up cached capabilities for a device ID without probing.
+        
+        Returns:
+            Capabilities dictionary, or None if the device is not cached or the cache is stale
+        """
+        if not self.is_valid():
+            return None
+        for capabilities in self._devices.values():
+            if capabilities['id'] == device_id:
+                return capabilities
+        return None
+    
+    def invalidate(self):
+        """Drop all cached entries so the next lookup probes again."""
+        self._fingerprint = None
+        self._target = None
+        self._devices = {}
+    
+    def find_best_device(self, target_width, target_height):
+        """
+        Pick the working device whose cached resolution is closest to the target.
+        
+        Returns:
+            Tuple of (device_id, actual_width, actual_height) or (None, 0, 0) if no device works
+        """
+        best = (None, 0, 0)
+        best_diff = float('inf')
+        
+        for capabilities in self.get_devices(target_width, target_height).values():
+            if capabilities['status'] != 'Working':
+                continue
+            for resolution in capabilities['resolutions']:
+                diff = abs(resolution['width'] - target_width) + abs(resolution['height'] - target_height)
+                # Prefer the lowest device ID on ties, matching the probing order
+                if diff < best_diff or (diff == best_diff and capabilities['id'] < best[0]):
+                    best_diff = diff
+                    best = (capabilities['id'], resolution['width'], resolution['height'])
+        
+        return best
+
+
+# Process-wide capability cache, loaded on first use
+_capability_cache = None
+
+
+def get_capability_cache():
+    """Get the process-wide webcam capability cache."""
+    global _capability_cache
+    if _capability_cache is None:
+        _capability_cache = WebcamCapabilityCache()
+    return _capability_cache
+
+
 def get_best_webcam_device(target_width=640, target_height=480):
     """
     Convenience function to get the best webcam device for the target resolution.
+    Uses the persistent capability cache and falls back to a live search.
     
     Args:
         target_width: Desired width (default: 640)
@@ -291,6 +601,12 @@ def get_best_webcam_device(target_width=640, target_height=480):
         The device ID of the best webcam or 0 if none found
     """
     try:
+        # Use cached capabilities; devices are only probed when /dev/video* changed
+        device_id, width, height = get_capability_cache().find_best_device(target_width, target_height)
+        if device_id is not None:
+            logger.info(f"Best cached device: {device_id} with resolution {width}x{height}")
+            return device_id
+        
         # Only check a maximum of 3 devices to prevent long search times
         device_id, _, _ = WebcamDetector.find_best_device(
             target_width, 
@@ -1,13 +1,29 @@
+import asyncio
 import json
 import logging
+import time
+from collections import OrderedDict
 from aiortc import RTCPeerConnection, RTCSessionDescription
 
-from piboat.webrtc.video import WebcamVideoTrack
-from piboat.webrtc.webcam_utils import get_best_webcam_device
-from piboat.config import VIDEO_WIDTH, VIDEO_HEIGHT, VIDEO_FPS
+from piboat.config import (
+    VIDEO_ADAPTIVE, VIDEO_RELAY, VIDEO_MAX_VIEWERS, VIDEO_VIEWER_QUEUE, VIDEO_QUEUE_TIMEOUT,
+    VIDEO_PEER_CONNECT_TIMEOUT, VIDEO_PEER_DISCONNECT_GRACE, VIDEO_PREWARM, WEBRTC_DATA_CHANNELS
+)
+from piboat.webrtc.ice import gather_candidates, parse_candidate, candidate_to_json
+from piboat.webrtc.datachannel import (
+    COMMAND_CHANNEL, TELEMETRY_CHANNEL, create_data_channels, channel_sender, send_unreliable
+)
+from piboat.webrtc.adaptive import AdaptiveBitrateController, get_default_ladder
+from piboat.webrtc.stats import PeerStats, summarize_peer_stats, STATS_INTERVAL
+from piboat.webrtc.sdp import parse_sdp, check_video_compatibility, apply_codec_preferences
+from piboat.webrtc.video import WebcamVideoTrack, RelayVideoTrack
+from piboat.webrtc.warmup import get_warm_pool, StartupTimer, StartupStats
 
 logger = logging.getLogger("WebRTCHandler")
 
+# How often peer connections are checked for failed or abandoned peers, in seconds
+REAP_INTERVAL = 2.0
+
 class WebRTCHandler:
     """
     Handles WebRTC signaling and connections.
@@ -23,6 +39,46 @@ class WebRTCHandler:
         self.device_id = device_id
         self.websocket = websocket
         self.peer_connections = {}
+        
+        # Per-peer stream statistics and adaptive bitrate controllers, and the task that updates both
+        self.peer_stats = {}
+        self.adaptive_controllers = {}
+        self._stats_task = None
+        self._ladder = get_default_ladder()
+        
+        # Viewer admission: clients being set up hold a slot until their peer connection exists,
+        # and clients over the limit wait in arrival order: {client_id: (message, queued at)}
+        self._reserved = set()
+        self._waiting = OrderedDict()
+        self._admit_tasks = set()
+        self.viewers_admitted = 0
+        self.viewers_queued = 0
+        self.viewers_rejected = 0
+        
+        # Connection health of each peer, checked by the reaper: when it was created
+        # (until it first connects) and since when it has been disconnected
+        self._peer_created = {}
+        self._peer_disconnected = {}
+        self._reaper_task = None
+        self.peers_reaped = 0
+        
+        # Remote candidates are counted as they arrive
+        self.ice_candidates_received = 0
+        self.ice_candidates_dropped = 0
+        
+        # Peer connections are taken ready-gathered from the warm pool when there is one,
+        # and each session's startup is timed until its first video frame is sent
+        self._warm_pool = get_warm_pool() if VIDEO_PREWARM else None
+        self._startup_timers = {}
+        self.startup_stats = StartupStats()
+        
+        # Command and telemetry data channels of each peer: {client_id: {label: channel}}
+        self.data_channels = {}
+        self._command_callback = None
+        self.channel_commands_received = 0
+        self.channel_telemetry_sent = 0
+        self.channel_telemetry_dropped = 0
+        
         logger.info("WebRTC handler initialized")
     
     async def handle_message(self, message):
@@ -36,17 +92,148 @@ class WebRTCHandler:
         
         if message_subtype == "answer":
             await self._handle_answer(message)
-        elif message_subtype == "ice_candidate":
+        elif message_subtype in ("ice_candidate", "ice_candidates"):
             await self._handle_ice_candidate(message)
-        elif message_subtype == "request_offer":
-            await self._handle_request_offer(message)
-        elif message_subtype == "offer":
-            await self._handle_offer(message)
+        elif message_subtype in ("request_offer", "offer"):
+            await self._handle_viewer_request(message)
         elif message_subtype == "close":
             await self._handle_close(message)
         else:
             logger.warning(f"Unknown WebRTC message subtype: {message_subtype}")
     
+    def _active_viewers(self):
+        """Clients that are connected or being set up."""
+        return set(self.peer_connections) | self._reserved
+    
+    def _has_capacity(self, client_id=None):
+        """Check whether a client may connect now. Clients that are already viewing may always renegotiate."""
+        active = self._active_viewers()
+        return VIDEO_MAX_VIEWERS <= 0 or client_id in active or len(active) < VIDEO_MAX_VIEWERS
+    
+    async def _handle_viewer_request(self, message):
+        """
+        Admit an offer or offer request if there is a free viewer slot, and
+        otherwise queue or reject it.
+        """
+        client_id = message.get("clientId") or message.get("client_id")
+        if client_id and not self._has_capacity(client_id):
+            await self._queue_viewer(client_id, message)
+            return
+        
+        if client_id and client_id not in self._active_viewers():
+            self.viewers_admitted += 1
+        await self._serve_viewer(client_id, message)
+    
+    async def _serve_viewer(self, client_id, message):
+        """Set up an admitted client's connection, holding its viewer slot meanwhile."""
+        if client_id:
+            self._reserved.add(client_id)
+        try:
+            if message.get("subtype") == "offer":
+                await self._handle_offer(message)
+            else:
+                await self._handle_request_offer(message)
+        finally:
+            self._reserved.discard(client_id)
+            if client_id not in self.peer_connections:
+                # Setup failed, so the slot is free again
+                self._startup_timers.pop(client_id, None)
+                await self._admit_waiting()
+    
+    async def _queue_viewer(self, client_id, message):
+        """Put a client over the viewer limit in the waiting queue, or reject it if the queue is full."""
+        if client_id not in self._waiting and len(self._waiting) >= VIDEO_VIEWER_QUEUE:
+            await self._reject_viewer(client_id, f"The boat is at its limit of {VIDEO_MAX_VIEWERS} viewers")
+            return
+        
+        # A repeated request replaces the earlier one but keeps its place in the queue
+        queued_at = self._waiting[client_id][1] if client_id in self._waiting else time.monotonic()
+        self._waiting[client_id] = (message, queued_at)
+        self.viewers_queued += 1
+        position = list(self._waiting).index(client_id) + 1
+        logger.info(f"Viewer limit reached, client {client_id} is waiting at position {position}")
+        
+        await self.websocket.send(json.dumps({
+            "type": "webrtc",
+            "subtype": "queued",
+            "boatId": self.device_id,
+            "clientId": client_id,
+            "position": position,
+            "maxViewers": VIDEO_MAX_VIEWERS
+        }))
+    
+    async def _reject_viewer(self, client_id, message):
+        self.viewers_rejected += 1
+        logger.warning(f"Rejecting client {client_id}: {message}")
+        await self.websocket.send(json.dumps({
+            "type": "webrtc",
+            "subtype": "error",
+            "boatId": self.device_id,
+            "clientId": client_id,
+            "error": "viewer_limit_reached",
+            "message": message
+        }))
+    
+    async def reject_message(self, message, reason):
+        """
+        Tell a client that one of its signaling messages was not handled, e.g.
+        because too many were pending, so it can retry instead of waiting.
+        
+        Args:
+            message (dict): The signaling message that was refused
+            reason (str): Why it was refused
+        """
+        client_id = message.get("clientId") or message.get("client_id")
+        logger.warning(f"Refusing '{message.get('subtype')}' message from client {client_id}: {reason}")
+        await self.websocket.send(json.dumps({
+            "type": "webrtc",
+            "subtype": "error",
+            "boatId": self.device_id,
+            "clientId": client_id,
+            "error": "signaling_busy",
+            "rejected": message.get("subtype"),
+            "message": reason
+        }))
+    
+    async def _admit_waiting(self):
+        """Admit waiting clients into free viewer slots, in arrival order."""
+        while self._waiting and self._has_capacity():
+            client_id, (message, queued_at) = self._waiting.popitem(last=False)
+            if time.monotonic() - queued_at > VIDEO_QUEUE_TIMEOUT:
+                await self._reject_viewer(client_id, "Timed out waiting for a free viewer slot")
+                continue
+            
+            logger.info(f"Admitting waiting client {client_id}")
+            self.viewers_admitted += 1
+            # Hold the slot now; the setup itself runs as its own task
+            self._reserved.add(client_id)
+            task = asyncio.create_task(self._serve_viewer(client_id, message))
+            self._admit_tasks.add(task)
+            task.add_done_callback(self._admit_tasks.discard)
+    
+    def get_viewer_stats(self):
+        """Get viewer admission counters for telemetry."""
+        return {
+            'viewers': len(self._active_viewers()),
+            'max_viewers': VIDEO_MAX_VIEWERS,
+            'waiting': len(self._waiting),
+            'admitted': self.viewers_admitted,
+            'queued': self.viewers_queued,
+            'rejected': self.viewers_rejected,
+            'reaped': self.peers_reaped,
+            'ice_candidates_received': self.ice_candidates_received,
+            'ice_candidates_dropped': self.ice_candidates_dropped,
+            'data_channels': {
+                'open': sum(1 for channels in self.data_channels.values()
+                            if any(c.readyState == "open" for c in channels.values())),
+                'commands_received': self.channel_commands_received,
+                'telemetry_sent': self.channel_telemetry_sent,
+                'telemetry_dropped': self.channel_telemetry_dropped
+            },
+            'startup': self.startup_stats.get_stats(),
+            'warm_pool': self._warm_pool.get_stats() if self._warm_pool is not None else None
+        }
+    
     async def _handle_answer(self, message):
         """Handle SDP answer from a client."""
         client_id = message.get("clientId")
@@ -67,11 +254,18 @@ class WebRTCHandler:
         logger.info(f"Set remote description from client {client_id}")
     
     async def _handle_ice_candidate(self, message):
-        """Handle ICE candidate from a client."""
+        """
+        Handle ICE candidates from a client, either a single "ice_candidate"
+        or a batched "ice_candidates" list. An empty candidate marks the end
+        of the client's candidates.
+        """
         client_id = message.get("clientId")
-        candidate = message.get("candidate")
+        if "candidates" in message:
+            candidates = message.get("candidates") or []
+        else:
+            candidates = [message.get("candidate")] if message.get("candidate") is not None else []
         
-        if not client_id or not candidate:
+        if not client_id or not candidates:
             logger.warning("Invalid ICE candidate message")
             return
             
@@ -79,9 +273,18 @@ class WebRTCHandler:
         if not pc:
             logger.warning(f"No peer connection for client {client_id}")
             return
-            
-        await pc.addIceCandidate(candidate)
-        logger.debug(f"Added ICE candidate from client {client_id}")
+        
+        for data in candidates:
+            try:
+                candidate = parse_candidate(data) if isinstance(data, dict) else None
+            except Exception as e:
+                logger.warning(f"Skipping invalid ICE candidate from client {client_id}: {str(e)}")
+                self.ice_candidates_dropped += 1
+                continue
+            await pc.addIceCandidate(candidate)
+            if candidate is not None:
+                self.ice_candidates_received += 1
+        logger.debug(f"Added {len(candidates)} ICE candidates from client {client_id}")
     
     async def _handle_request_offer(self, message):
         """Handle a request to create a WebRTC offer."""
@@ -94,6 +297,8 @@ class WebRTCHandler:
     
     async def _handle_offer(self, message):
         """Handle incoming offer from client."""
+        received = time.monotonic()
+        
         # Get clientId from message - it might be in deviceId or clientId
         client_id = message.get("clientId")
         if not client_id:
@@ -106,21 +311,43 @@ class WebRTCHandler:
             
         logger.info(f"Received WebRTC offer from client {client_id}")
         
+        # Replace any previous connection so its capture subscription is released
+        await self._close_peer_connection(client_id, "renegotiation")
+        self._startup_timers[client_id] = StartupTimer(client_id, received)
+        
+        sdp = message.get("sdp")
+        if not sdp:
+            logger.warning("Received offer without SDP")
+            return
+        
+        # Parse the offer once and check codec compatibility before opening the webcam
+        offer = parse_sdp(sdp)
+        compatible, compatibility_message = check_video_compatibility(offer)
+        logger.info(f"Codec compatibility check: {compatibility_message}")
+        
+        if not compatible:
+            # Send error to client
+            error_response = {
+                "type": "webrtc",
+                "subtype": "error",
+                "boatId": self.device_id,
+                "clientId": client_id,
+                "error": "codec_incompatible",
+                "message": compatibility_message
+            }
+            await self.websocket.send(json.dumps(error_response))
+            logger.warning(f"Rejecting WebRTC offer due to codec incompatibility: {compatibility_message}")
+            return
+        
         # Create a new RTCPeerConnection with default configuration
-        pc = RTCPeerConnection()
-        self.peer_connections[client_id] = pc
-        logger.info(f"Created peer connection for client {client_id}")
+        pc = self._create_peer_connection(client_id)
         
         # Set up the video track - use the webcam
         try:
-            # Get the best webcam device ID
-            device_id = get_best_webcam_device(VIDEO_WIDTH, VIDEO_HEIGHT)
-            logger.info(f"Using webcam device ID: {device_id}")
-            
-            # Initialize the video track with the selected device
-            video_track = WebcamVideoTrack(device_id=device_id)
-            pc.addTrack(video_track)
-            logger.info(f"Initialized video stream with {video_track.width}x{video_track.height} resolution at {video_track._fps}fps")
+            video_track = await self._create_video_track(pc)
+            self._mark_startup(client_id, "camera_ready")
+            self._start_stats(client_id, pc)
+            logger.info(f"Initialized video stream from webcam device {video_track._device_id} with {video_track.width}x{video_track.height} resolution at {video_track._fps}fps")
         except Exception as e:
             logger.error(f"Error initializing webcam: {str(e)}")
             # Send error to client
@@ -135,10 +362,7 @@ class WebRTCHandler:
             await self.websocket.send(json.dumps(error_response))
             
             # Clean up and return
-            if client_id in self.peer_connections:
-                await self.peer_connections[client_id].close()
-                del self.peer_connections[client_id]
-                logger.info(f"Closed connection with client {client_id} due to webcam initialization error")
+            await self._close_peer_connection(client_id, "webcam initialization error")
             return
         
         # Set up ICE candidate handling
@@ -147,39 +371,18 @@ class WebRTCHandler:
             await self._send_ice_candidate(client_id, candidate)
         
         # Apply the remote description (the offer)
-        sdp = message.get("sdp")
-        if not sdp:
-            logger.warning("Received offer without SDP")
-            return
-            
         try:
-            # Check codec compatibility first
-            compatible, compatibility_message = video_track.get_codec_compatibility(sdp)
-            logger.info(f"Codec compatibility check: {compatibility_message}")
-            
-            if not compatible:
-                # Send error to client
-                error_response = {
-                    "type": "webrtc",
-                    "subtype": "error",
-                    "boatId": self.device_id,
-                    "clientId": client_id,
-                    "error": "codec_incompatible",
-                    "message": compatibility_message
-                }
-                await self.websocket.send(json.dumps(error_response))
-                logger.warning(f"Rejecting WebRTC offer due to codec incompatibility: {compatibility_message}")
-                
-                # Clean up and return
-                if client_id in self.peer_connections:
-                    await self.peer_connections[client_id].close()
-                    del self.peer_connections[client_id]
-                return
+            # Answer with the cheapest codec to encode that the client offered
+            preferred_codecs = apply_codec_preferences(pc, offer)
+            logger.debug(f"Video codec preference for client {client_id}: {', '.join(preferred_codecs)}")
             
             # Set the remote description (the offer)
             await pc.setRemoteDescription(RTCSessionDescription(sdp=sdp, type="offer"))
             logger.info(f"Set remote offer from client {client_id}")
             
+            # The client's own command and telemetry channels arrive through on_datachannel;
+            # creating ours as well when answering would leave two of each
+            
             try:
                 # Create and set the answer - with explicit error handling
                 answer = await pc.createAnswer()
@@ -190,6 +393,8 @@ class WebRTCHandler:
                     # We could add fallback codec handling here if needed
                     # For now, just log and let the process continue
                 
+                # Gather up front so unusable interfaces can be dropped from the answer
+                await gather_candidates(pc)
                 await pc.setLocalDescription(answer)
                 
                 # Send the answer to the client
@@ -203,6 +408,7 @@ class WebRTCHandler:
                 }
                 await self.websocket.send(json.dumps(response))
                 logger.info(f"Sent answer to client {client_id}")
+                self._watch_startup(client_id, pc)
                 
             except ValueError as codec_error:
                 # This is likely a codec negotiation error
@@ -221,10 +427,7 @@ class WebRTCHandler:
         except Exception as e:
             logger.error(f"Error processing WebRTC offer: {str(e)}")
             # Close the peer connection on error
-            if client_id in self.peer_connections:
-                await self.peer_connections[client_id].close()
-                del self.peer_connections[client_id]
-                logger.info(f"Closed connection with client {client_id} due to error")
+            await self._close_peer_connection(client_id, "error")
     
     async def _handle_close(self, message):
         """Handle close request from a client."""
@@ -232,12 +435,325 @@ class WebRTCHandler:
         if not client_id:
             logger.warning("Received close without client ID")
             return
-            
-        if client_id in self.peer_connections:
-            pc = self.peer_connections[client_id]
-            await pc.close()
-            del self.peer_connections[client_id]
+        
+        if self._waiting.pop(client_id, None) is not None:
+            logger.info(f"Client {client_id} left the viewer queue")
+        await self._close_peer_connection(client_id)
+    
+    async def _close_peer_connection(self, client_id, reason=None):
+        """
+        Close a peer connection and stop its tracks so the shared capture
+        subscription is released.
+        
+        Args:
+            client_id (str): Client whose connection should be closed
+            reason (str, optional): Why the connection is being closed, for logging
+        """
+        self.adaptive_controllers.pop(client_id, None)
+        self.peer_stats.pop(client_id, None)
+        self._peer_created.pop(client_id, None)
+        self._peer_disconnected.pop(client_id, None)
+        self._startup_timers.pop(client_id, None)
+        self.data_channels.pop(client_id, None)
+        pc = self.peer_connections.pop(client_id, None)
+        if pc is None:
+            return
+        
+        for sender in pc.getSenders():
+            if sender.track is not None:
+                sender.track.stop()
+        await pc.close()
+        
+        if reason:
+            logger.info(f"Closed connection with client {client_id} due to {reason}")
+        else:
             logger.info(f"Closed connection with client {client_id}")
+        
+        # Let the next waiting viewer into the freed slot
+        await self._admit_waiting()
+    
+    def _create_peer_connection(self, client_id):
+        """
+        Create and register a peer connection for a client, watched by the reaper
+        so it is torn down if the client disappears. A pre-warmed connection
+        from the warm pool is used when one is ready.
+        
+        Args:
+            client_id (str): Client the connection is for
+            
+        Returns:
+            The new RTCPeerConnection
+        """
+        pc = self._warm_pool.take() if self._warm_pool is not None and self._warm_pool.is_running() else None
+        timer = self._startup_timers.get(client_id)
+        if timer is not None:
+            timer.prewarmed = pc is not None
+        
+        if pc is None:
+            pc = RTCPeerConnection()
+            logger.info(f"Created peer connection for client {client_id}")
+        else:
+            logger.info(f"Using pre-warmed peer connection for client {client_id}")
+        self.peer_connections[client_id] = pc
+        self._peer_created[client_id] = time.monotonic()
+        
+        # Accept command and telemetry channels opened by the client
+        @pc.on("datachannel")
+        def on_datachannel(channel):
+            self._register_data_channel(client_id, channel)
+        
+        @pc.on("connectionstatechange")
+        async def on_connectionstatechange():
+            logger.info(f"Connection state for client {client_id}: {pc.connectionState}")
+            if pc.connectionState == "failed":
+                await self._reap_peer(client_id, pc, "connection failed")
+        
+        if self._reaper_task is None or self._reaper_task.done():
+            self._reaper_task = asyncio.create_task(self._reaper_loop())
+        return pc
+    
+    def set_websocket(self, websocket):
+        """
+        Use a new WebSocket connection for signaling, e.g. after reconnecting.
+        Existing peer connections and their data channels are kept.
+        
+        Args:
+            websocket: WebSocket connection for signaling
+        """
+        self.websocket = websocket
+    
+    async def _send_websocket(self, message):
+        """Send a message on the current websocket, whichever connection that is."""
+        await self.websocket.send(message)
+    
+    def set_command_handler(self, callback):
+        """
+        Set the handler for commands received on data channels.
+        
+        Args:
+            callback: Coroutine function called as callback(command, send), where
+                      send replies on the same channel (or the websocket once it closes)
+        """
+        self._command_callback = callback
+    
+    def _create_data_channels(self, client_id, pc):
+        """Create the command and telemetry data channels for a peer."""
+        if not WEBRTC_DATA_CHANNELS:
+            return
+        for channel in create_data_channels(pc):
+            self._register_data_channel(client_id, channel)
+    
+    def _register_data_channel(self, client_id, channel):
+        """Track a peer's command or telemetry channel and handle the commands it carries."""
+        if not WEBRTC_DATA_CHANNELS or channel.label not in (COMMAND_CHANNEL, TELEMETRY_CHANNEL):
+            return
+        self.data_channels.setdefault(client_id, {})[channel.label] = channel
+        
+        @channel.on("open")
+        def on_open():
+            logger.info(f"Data channel '{channel.label}' open with client {client_id}")
+        
+        @channel.on("close")
+        def on_close():
+            channels = self.data_channels.get(client_id)
+            if channels is not None and channels.get(channel.label) is channel:
+                del channels[channel.label]
+        
+        if channel.label == COMMAND_CHANNEL:
+            @channel.on("message")
+            async def on_message(message):
+                await self._handle_channel_command(client_id, channel, message)
+    
+    async def _handle_channel_command(self, client_id, channel, message):
+        """Pass a command received on a data channel to the command handler."""
+        try:
+            data = json.loads(message)
+        except (TypeError, ValueError):
+            logger.warning(f"Invalid message on command channel of client {client_id}")
+            return
+        
+        if data.get("type") != "command" or self._command_callback is None:
+            logger.warning(f"Unexpected message on command channel of client {client_id}: {data.get('type')}")
+            return
+        
+        self.channel_commands_received += 1
+        try:
+            await self._command_callback(data, channel_sender(channel, self._send_websocket))
+        except Exception as e:
+            logger.error(f"Error handling command from client {client_id}: {str(e)}")
+    
+    def has_telemetry_channels(self):
+        """Check whether any viewer has an open telemetry channel."""
+        return any(channels.get(TELEMETRY_CHANNEL) is not None
+                   and channels[TELEMETRY_CHANNEL].readyState == "open"
+                   for channels in self.data_channels.values())
+    
+    def send_telemetry(self, message):
+        """
+        Send a telemetry message on every open telemetry channel. A channel that
+        is still backed up with earlier samples skips this one.
+        
+        Args:
+            message (str): JSON telemetry message
+            
+        Returns:
+            Number of viewers with an open telemetry channel
+        """
+        viewers = 0
+        for channels in self.data_channels.values():
+            channel = channels.get(TELEMETRY_CHANNEL)
+            if channel is None or channel.readyState != "open":
+                continue
+            viewers += 1
+            if send_unreliable(channel, message):
+                self.channel_telemetry_sent += 1
+            else:
+                self.channel_telemetry_dropped += 1
+        return viewers
+    
+    def _mark_startup(self, client_id, stage):
+        """Record that a client's session reached a startup stage."""
+        timer = self._startup_timers.get(client_id)
+        if timer is not None:
+            timer.mark(stage)
+    
+    def _watch_startup(self, client_id, pc):
+        """
+        Mark a client's local description as sent and time the rest of its
+        startup, until the first video frame, on its peer connection.
+        """
+        timer = self._startup_timers.get(client_id)
+        if timer is None:
+            return
+        timer.mark("answer_sent")
+        
+        def on_complete(timer):
+            if self._startup_timers.get(client_id) is timer:
+                del self._startup_timers[client_id]
+                self.startup_stats.record(timer)
+        
+        timer.watch(pc, on_complete)
+    
+    def _check_peer(self, client_id, pc, now):
+        """
+        Check a peer connection's health.
+        
+        Returns:
+            Why the peer should be reaped, or None if it is healthy
+        """
+        state = pc.connectionState
+        if state in ("failed", "closed"):
+            return f"connection {state}"
+        
+        if state == "connected":
+            self._peer_created.pop(client_id, None)
+            self._peer_disconnected.pop(client_id, None)
+            return None
+        
+        if state == "disconnected" or pc.iceConnectionState == "disconnected":
+            since = self._peer_disconnected.setdefault(client_id, now)
+            if now - since > VIDEO_PEER_DISCONNECT_GRACE:
+                return f"disconnected for over {VIDEO_PEER_DISCONNECT_GRACE:g}s"
+            return None
+        
+        created = self._peer_created.get(client_id)
+        if created is not None and now - created > VIDEO_PEER_CONNECT_TIMEOUT:
+            return f"not connected after {VIDEO_PEER_CONNECT_TIMEOUT:g}s"
+        return None
+    
+    async def _reap_peer(self, client_id, pc, reason):
+        """Close a failed or abandoned peer, unless it has been replaced meanwhile."""
+        if self.peer_connections.get(client_id) is not pc:
+            return
+        self.peers_reaped += 1
+        logger.warning(f"Reaping peer connection of client {client_id}: {reason}")
+        await self._close_peer_connection(client_id, reason)
+    
+    async def _reaper_loop(self):
+        """Periodically close peers that failed, dropped off or never connected."""
+        while self.peer_connections:
+            await asyncio.sleep(REAP_INTERVAL)
+            now = time.monotonic()
+            for client_id, pc in list(self.peer_connections.items()):
+                reason = self._check_peer(client_id, pc, now)
+                if reason is None:
+                    continue
+                try:
+                    await self._reap_peer(client_id, pc, reason)
+                except Exception as e:
+                    logger.warning(f"Error reaping peer connection of client {client_id}: {str(e)}")
+    
+    async def _create_video_track(self, pc):
+        """
+        Create a webcam track for a peer and add it to its connection.
+        
+        With VIDEO_RELAY the track forwards packets from the shared encoders,
+        starting on the top ladder rung; otherwise it subscribes to the shared
+        capture and the peer connection encodes for itself. Opening the webcam
+        runs on the video device thread, so signaling, commands and telemetry
+        carry on while it opens.
+        
+        Args:
+            pc: The RTCPeerConnection to add the track to
+            
+        Returns:
+            The video track
+            
+        Raises:
+            RuntimeError: If the webcam could not be opened within VIDEO_SETUP_TIMEOUT
+        """
+        if VIDEO_RELAY:
+            video_track = RelayVideoTrack(*self._ladder[0])
+        else:
+            # Start within the per-viewer budget; the adaptive controller moves it from there
+            video_track = WebcamVideoTrack()
+            video_track.set_output(*self._ladder[0])
+        await video_track.start()
+        pc.addTrack(video_track)
+        if VIDEO_RELAY:
+            video_track.attach(pc)
+        return video_track
+    
+    def _start_stats(self, client_id, pc):
+        """
+        Start collecting a peer's stream statistics and, with VIDEO_ADAPTIVE,
+        adapting its resolution, frame rate and bitrate to its link.
+        
+        Args:
+            client_id (str): Client the peer connection belongs to
+            pc: The RTCPeerConnection carrying the video track
+        """
+        self.peer_stats[client_id] = PeerStats(client_id, pc)
+        if VIDEO_ADAPTIVE:
+            self.adaptive_controllers[client_id] = AdaptiveBitrateController(client_id, pc, self._ladder)
+        if self._stats_task is None or self._stats_task.done():
+            self._stats_task = asyncio.create_task(self._stats_loop())
+    
+    async def _stats_loop(self):
+        """
+        Periodically collect every connected peer's statistics. Each peer's
+        getStats() report is taken once per interval and shared by its stream
+        statistics and its adaptive bitrate controller.
+        """
+        while self.peer_stats:
+            await asyncio.sleep(STATS_INTERVAL)
+            for client_id, stats in list(self.peer_stats.items()):
+                pc = stats.pc
+                # Only connected peers produce receiver reports
+                if pc.connectionState != "connected":
+                    continue
+                try:
+                    report = await pc.getStats()
+                    stats.update(report)
+                    controller = self.adaptive_controllers.get(client_id)
+                    if controller is not None:
+                        controller.update(report)
+                except Exception as e:
+                    logger.warning(f"Error updating stream statistics for client {client_id}: {str(e)}")
+    
+    def get_video_stats(self):
+        """Get the compact per-peer stream health summary for telemetry."""
+        return summarize_peer_stats(self.peer_stats)
     
     async def create_webrtc_offer(self, client_id):
         """
@@ -246,22 +762,21 @@ class WebRTCHandler:
         Args:
             client_id (str): Client ID to create the offer for
         """
+        received = time.monotonic()
         try:
+            # Replace any previous connection so its capture subscription is released
+            await self._close_peer_connection(client_id, "renegotiation")
+            self._startup_timers[client_id] = StartupTimer(client_id, received)
+            
             # Create a new RTCPeerConnection with default configuration
-            pc = RTCPeerConnection()
-            self.peer_connections[client_id] = pc
-            logger.info(f"Created peer connection for client {client_id}")
+            pc = self._create_peer_connection(client_id)
             
             # Set up the video track with best available webcam
             try:
-                # Get the best webcam device ID
-                device_id = get_best_webcam_device(VIDEO_WIDTH, VIDEO_HEIGHT)
-                logger.info(f"Using webcam device ID: {device_id}")
-                
-                # Initialize the video track with the selected device
-                video_track = WebcamVideoTrack(device_id=device_id)
-                pc.addTrack(video_track)
-                logger.info(f"Initialized video stream with {video_track.width}x{video_track.height} resolution at {video_track._fps}fps")
+                video_track = await self._create_video_track(pc)
+                self._mark_startup(client_id, "camera_ready")
+                self._start_stats(client_id, pc)
+                logger.info(f"Initialized video stream from webcam device {video_track._device_id} with {video_track.width}x{video_track.height} resolution at {video_track._fps}fps")
             except Exception as e:
                 logger.error(f"Error initializing webcam: {str(e)}")
                 # Send error to client
@@ -276,10 +791,7 @@ class WebRTCHandler:
                 await self.websocket.send(json.dumps(error_response))
                 
                 # Clean up and return
-                if client_id in self.peer_connections:
-                    await self.peer_connections[client_id].close()
-                    del self.peer_connections[client_id]
-                    logger.info(f"Closed connection with client {client_id} due to webcam initialization error")
+                await self._close_peer_connection(client_id, "webcam initialization error")
                 return
             
             # Set up ICE candidate handling
@@ -287,8 +799,13 @@ class WebRTCHandler:
             async def on_icecandidate(candidate):
                 await self._send_ice_candidate(client_id, candidate)
             
+            # Offer video codecs in order of encoding cost, and the data channels alongside the video
+            apply_codec_preferences(pc)
+            self._create_data_channels(client_id, pc)
+            
             # Create offer
             offer = await pc.createOffer()
+            await gather_candidates(pc)
             await pc.setLocalDescription(offer)
             
             # Send offer to client via relay server
@@ -301,46 +818,28 @@ class WebRTCHandler:
             }
             await self.websocket.send(json.dumps(message))
             logger.info(f"Sent WebRTC offer to client {client_id}")
+            self._watch_startup(client_id, pc)
         except Exception as e:
             logger.error(f"Error creating WebRTC offer: {str(e)}")
     
     async def _send_ice_candidate(self, client_id, candidate):
         """
-        Send an ICE candidate to a client.
+        Send a local ICE candidate to a client. aiortc embeds the candidates
+        gathered before setLocalDescription in the SDP, so this only runs for
+        candidates found later.
         
         Args:
             client_id (str): The client ID to send to
-            candidate: The ICE candidate
+            candidate: The RTCIceCandidate
         """
         if candidate:
             try:
-                # Ensure all required properties exist
-                if not hasattr(candidate, 'candidate') or not candidate.candidate:
-                    logger.warning(f"Skipping invalid ICE candidate (missing candidate string)")
-                    return
-                    
-                if not hasattr(candidate, 'sdpMid') or candidate.sdpMid is None:
-                    logger.warning(f"ICE candidate missing sdpMid, using empty string")
-                    sdpMid = ""
-                else:
-                    sdpMid = candidate.sdpMid
-                    
-                if not hasattr(candidate, 'sdpMLineIndex') or candidate.sdpMLineIndex is None:
-                    logger.warning(f"ICE candidate missing sdpMLineIndex, using 0")
-                    sdpMLineIndex = 0
-                else:
-                    sdpMLineIndex = candidate.sdpMLineIndex
-                    
                 message = {
                     "type": "webrtc",
                     "subtype": "ice_candidate",
                     "boatId": self.device_id,
                     "clientId": client_id,
-                    "candidate": {
-                        "candidate": candidate.candidate,
-                        "sdpMid": sdpMid,
-                        "sdpMLineIndex": sdpMLineIndex
-                    }
+                    "candidate": candidate_to_json(candidate)
                 }
                 await self.websocket.send(json.dumps(message))
                 logger.debug(f"Sent ICE candidate to client {client_id}")
@@ -349,11 +848,29 @@ class WebRTCHandler:
     
     async def close_all_connections(self):
         """Close all peer connections when shutting down."""
-        for client_id, pc in list(self.peer_connections.items()):
+        # Stop admitting viewers first, so no new peer connection appears while closing
+        self._waiting.clear()
+        admitting = list(self._admit_tasks)
+        for task in admitting:
+            task.cancel()
+        await asyncio.gather(*admitting, return_exceptions=True)
+        self._reserved.clear()
+        
+        for client_id in list(self.peer_connections):
             try:
-                await pc.close()
-                logger.info(f"Closed connection with client {client_id}")
+                await self._close_peer_connection(client_id)
             except Exception as e:
                 logger.warning(f"Error closing connection with client {client_id}: {str(e)}")
         
-        self.peer_connections.clear() 
\ No newline at end of file
+        self.peer_connections.clear()
+        
+        if self._stats_task is not None:
+            self._stats_task.cancel()
+            self._stats_task = None
+    
+    async def shutdown(self):
+        """Close every peer connection and stop the handler's background tasks."""
+        await self.close_all_connections()
+        if self._reaper_task is not None:
+            self._reaper_task.cancel()
+            self._reaper_task = None
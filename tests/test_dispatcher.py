@@ -0,0 +1,207 @@
+import asyncio
+import time
+
+from piboat.device.dispatcher import (
+    MessageDispatcher, Lane, classify_message, command_key, LANE_OVERFLOW,
+    DROP_OLDEST, REJECT, COALESCE, DROPPED, SUPERSEDED, CONTROL_LANE, PING_LANE, WEBRTC_LANE, COMMAND_LANE
+)
+
+
+def command(name, value=None):
+    return {"type": "command", "command": name, "value": value}
+
+
+class Recorder:
+    """Lane handler that records what it handled, optionally blocking until released."""
+    def __init__(self, handled, name, gate=None):
+        self.handled = handled
+        self.name = name
+        self.gate = gate
+
+    async def __call__(self, *args):
+        if self.gate is not None:
+            await self.gate.wait()
+        self.handled.append((self.name, args))
+
+
+def make_dispatcher(handled, gates=None, sizes=None, overflow=None, on_discard=None):
+    gates = gates or {}
+    sizes = sizes or {}
+    overflow = overflow or {}
+    return MessageDispatcher([
+        Lane(name, Recorder(handled, name, gates.get(name)), sizes.get(name, 8),
+             overflow.get(name, DROP_OLDEST), command_key)
+        for name in ("high", "low")
+    ], on_discard=on_discard)
+
+
+async def settle():
+    for _ in range(10):
+        await asyncio.sleep(0)
+
+
+def test_classify_message():
+    assert classify_message(command("set_rudder")) == CONTROL_LANE
+    assert classify_message(command("stop")) == CONTROL_LANE
+    assert classify_message(command("snapshot")) == COMMAND_LANE
+    assert classify_message({"type": "ping"}) == PING_LANE
+    assert classify_message({"type": "webrtc"}) == WEBRTC_LANE
+    assert classify_message({"type": "unknown"}) is None
+
+
+def test_higher_lane_goes_first():
+    async def run():
+        handled = []
+        dispatcher = make_dispatcher(handled)
+        dispatcher.dispatch("low", "l1")
+        dispatcher.dispatch("high", "h1")
+        dispatcher.dispatch("high", "h2")
+        dispatcher.start()
+        await settle()
+        await dispatcher.stop()
+        return handled
+
+    assert asyncio.run(run()) == [("high", ("h1",)), ("high", ("h2",)), ("low", ("l1",))]
+
+
+def test_lower_lane_waits_without_spinning():
+    async def run():
+        handled = []
+        gate = asyncio.Event()
+        dispatcher = make_dispatcher(handled, gates={"high": gate})
+        dispatcher.start()
+        dispatcher.dispatch("high", "h1")
+        dispatcher.dispatch("high", "h2")
+        dispatcher.dispatch("low", "l1")
+
+        cpu = time.process_time()
+        await asyncio.sleep(0.2)
+        cpu = time.process_time() - cpu
+        waiting = list(handled)
+
+        gate.set()
+        await settle()
+        await dispatcher.stop()
+        return cpu, waiting, handled
+
+    cpu, waiting, handled = asyncio.run(run())
+    # The low lane gives way while the high lane has a backlog, and sleeps meanwhile
+    assert waiting == []
+    assert cpu < 0.1
+    assert handled == [("high", ("h1",)), ("high", ("h2",)), ("low", ("l1",))]
+
+
+def test_drop_oldest_when_full():
+    async def run():
+        handled = []
+        dispatcher = make_dispatcher(handled, sizes={"low": 2})
+        for message in ("a", "b", "c"):
+            assert dispatcher.dispatch("low", message)
+        dispatcher.start()
+        await settle()
+        await dispatcher.stop()
+        return handled, dispatcher.get_stats()["low"]
+
+    handled, stats = asyncio.run(run())
+    assert handled == [("low", ("b",)), ("low", ("c",))]
+    assert stats["dropped"] == 1
+
+
+def test_reject_when_full():
+    async def run():
+        handled = []
+        dispatcher = make_dispatcher(handled, sizes={"low": 2}, overflow={"low": REJECT})
+        results = [dispatcher.dispatch("low", message) for message in ("a", "b", "c")]
+        dispatcher.start()
+        await settle()
+        await dispatcher.stop()
+        return results, handled, dispatcher.get_stats()["low"]
+
+    results, handled, stats = asyncio.run(run())
+    assert results == [True, True, False]
+    assert handled == [("low", ("a",)), ("low", ("b",))]
+    assert stats["rejected"] == 1
+
+
+def test_coalesce_keeps_latest_of_each_command_in_order():
+    async def run():
+        handled = []
+        dispatcher = make_dispatcher(handled, overflow={"high": COALESCE})
+        for message in (command("set_throttle", 50), command("stop"), command("set_throttle", 60)):
+            assert dispatcher.dispatch("high", message)
+        dispatcher.start()
+        await settle()
+        await dispatcher.stop()
+        return handled, dispatcher.get_stats()["high"]
+
+    handled, stats = asyncio.run(run())
+    # The later throttle replaces the earlier one and still runs after the stop
+    assert [args[0] for _, args in handled] == [command("stop"), command("set_throttle", 60)]
+    assert stats["coalesced"] == 1
+
+
+def test_coalesce_rejects_when_full_of_other_commands():
+    dispatcher = make_dispatcher([], sizes={"high": 1}, overflow={"high": COALESCE})
+    assert dispatcher.dispatch("high", command("set_rudder", 1))
+    assert dispatcher.dispatch("high", command("set_rudder", 2))
+    assert not dispatcher.dispatch("high", command("stop"))
+
+
+def test_superseded_commands_are_reported_for_acknowledgement():
+    discarded = []
+    dispatcher = make_dispatcher([], overflow={"high": COALESCE},
+                                 on_discard=lambda *args: discarded.append(args))
+    first = command("set_throttle", 50)
+    assert dispatcher.dispatch("high", first, "channel")
+    assert dispatcher.dispatch("high", command("stop"), "channel")
+    assert discarded == []
+    assert dispatcher.dispatch("high", command("set_throttle", 60), "channel")
+    # The replaced command is reported with the reply function it arrived with
+    assert discarded == [("high", SUPERSEDED, first, "channel")]
+
+
+def test_dropped_messages_are_reported():
+    discarded = []
+    dispatcher = make_dispatcher([], sizes={"low": 1}, on_discard=lambda *args: discarded.append(args))
+    assert dispatcher.dispatch("low", "a")
+    assert dispatcher.dispatch("low", "b")
+    assert discarded == [("low", DROPPED, "a")]
+
+
+def test_rejected_messages_are_left_to_the_caller():
+    discarded = []
+    dispatcher = make_dispatcher([], sizes={"low": 1}, overflow={"low": REJECT},
+                                 on_discard=lambda *args: discarded.append(args))
+    assert dispatcher.dispatch("low", "a")
+    assert not dispatcher.dispatch("low", "b")
+    assert discarded == []
+
+
+def test_signaling_is_refused_not_dropped():
+    assert LANE_OVERFLOW[WEBRTC_LANE] == REJECT
+
+
+def test_unknown_lane():
+    assert not make_dispatcher([]).dispatch("missing", "message")
+
+
+def test_handler_errors_do_not_stop_the_lane():
+    async def run():
+        handled = []
+
+        async def failing(message):
+            if message == "bad":
+                raise ValueError("bad message")
+            handled.append(message)
+
+        dispatcher = MessageDispatcher([Lane("only", failing, 8)])
+        dispatcher.start()
+        dispatcher.dispatch("only", "bad")
+        dispatcher.dispatch("only", "good")
+        await settle()
+        await dispatcher.stop()
+        return handled, dispatcher.get_stats()["only"]
+
+    handled, stats = asyncio.run(run())
+    assert handled == ["good"]
+    assert stats["processed"] == 2
@@ -0,0 +1,105 @@
+import copy
+
+from piboat.device.telemetry_scheduler import TelemetryScheduler, _heading_change, _position_change
+
+
+def sample(heading=90.0, latitude=52.0, longitude=4.0, throttle=0, rudder=0, status="fix_acquired", fix_epoch=1):
+    return {
+        'position': {'latitude': latitude, 'longitude': longitude},
+        'navigation': {'heading': heading, 'speed': 0.0, 'throttle': throttle, 'rudder_position': rudder},
+        'status': {'gps': {'status': status, 'has_fix': status == "fix_acquired", 'fix_epoch': fix_epoch}},
+    }
+
+
+def sent_scheduler(telemetry=None, **kwargs):
+    """A scheduler that has just sent a sample at time 0."""
+    kwargs.setdefault('heartbeat', 1.0)
+    scheduler = TelemetryScheduler(**kwargs)
+    scheduler.mark_sent(telemetry or sample(), 0.0)
+    return scheduler
+
+
+def test_first_sample_is_sent():
+    assert TelemetryScheduler(heartbeat=1.0).check(sample(), 0.0) == "heartbeat"
+
+
+def test_unchanged_sample_waits_for_heartbeat():
+    scheduler = sent_scheduler()
+    assert scheduler.check(sample(), 0.5) is None
+    assert scheduler.check(sample(), 1.0) == "heartbeat"
+
+
+def test_heading_deadband():
+    scheduler = sent_scheduler(heading_deadband=2.0)
+    assert scheduler.check(sample(heading=91.5), 0.2) is None
+    assert scheduler.check(sample(heading=92.0), 0.2) == "heading"
+
+
+def test_heading_change_wraps_around_north():
+    assert _heading_change(359.0, 1.0) == 2.0
+    scheduler = sent_scheduler(sample(heading=359.5), heading_deadband=2.0)
+    assert scheduler.check(sample(heading=0.5), 0.2) is None
+
+
+def test_position_deadband():
+    scheduler = sent_scheduler(position_deadband=2.0)
+    # About 1.1 m and 3.3 m north
+    assert scheduler.check(sample(latitude=52.00001), 0.2) is None
+    assert scheduler.check(sample(latitude=52.00003), 0.2) == "position"
+    assert abs(_position_change(52.0, 4.0, 52.00003, 4.0) - 3.34) < 0.01
+
+
+def test_position_appearing_is_sent():
+    scheduler = sent_scheduler(sample(latitude=None, longitude=None))
+    assert scheduler.check(sample(), 0.2) == "position"
+
+
+def test_control_deadband():
+    scheduler = sent_scheduler(control_deadband=1.0)
+    assert scheduler.check(sample(throttle=0.5), 0.2) is None
+    assert scheduler.check(sample(rudder=-1), 0.2) == "control"
+
+
+def test_gps_fix_changes():
+    scheduler = sent_scheduler()
+    assert scheduler.check(sample(status="acquiring"), 0.2) == "fix_status"
+    assert scheduler.check(sample(fix_epoch=2), 0.2) == "fix_epoch"
+
+
+def test_max_rate():
+    scheduler = sent_scheduler(max_rate=10.0)
+    assert scheduler.check(sample(heading=120.0), 0.05) is None
+    assert scheduler.check(sample(heading=120.0), 0.1) == "heading"
+
+
+def test_changes_are_compared_with_the_last_sample_sent():
+    scheduler = sent_scheduler(heading_deadband=2.0)
+    # Creeping by less than the deadband per sample still triggers once the total exceeds it
+    assert scheduler.check(sample(heading=91.0), 0.2) is None
+    assert scheduler.check(sample(heading=92.5), 0.4) == "heading"
+
+
+def test_sent_sample_is_not_affected_by_later_samples():
+    telemetry = sample()
+    scheduler = sent_scheduler(telemetry)
+    later = copy.deepcopy(telemetry)
+    later['navigation']['heading'] = 180.0
+    assert scheduler.check(later, 0.2) == "heading"
+
+
+def test_fixed_interval_mode():
+    scheduler = sent_scheduler(heartbeat=1.0, on_change=False)
+    assert scheduler.sample_interval == 1.0
+    assert scheduler.check(sample(heading=180.0), 0.5) is None
+    assert scheduler.check(sample(), 1.0) == "heartbeat"
+
+
+def test_sample_interval_follows_max_rate():
+    assert TelemetryScheduler(heartbeat=1.0, max_rate=10.0).sample_interval == 0.1
+    assert TelemetryScheduler(heartbeat=1.0, max_rate=0).sample_interval == 1.0
+
+
+def test_reset_sends_next_sample():
+    scheduler = sent_scheduler()
+    scheduler.reset()
+    assert scheduler.check(sample(), 0.1) == "heartbeat"